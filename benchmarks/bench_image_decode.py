@@ -0,0 +1,121 @@
+"""
+Benchmark dekodowania zdjęć przy przesyłaniu (szczytowa pamięć i czas).
+
+Porównuje dotychczasową ścieżkę (Image.open + thumbnail do 1920x1080)
+z open_image_reduced (draft JPEG / reduce PNG + orientacja EXIF).
+Każdy wariant uruchamiany jest w osobnym procesie, aby szczyt pamięci
+(VmHWM, na innych systemach ru_maxrss) dotyczył tylko tego wariantu.
+
+Użycie:
+    python benchmarks/bench_image_decode.py > bench_output.txt
+"""
+import io
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+MAX_SIZE = (1920, 1080)
+REPEATS = 5
+
+SAMPLES = [
+    ('JPEG 12 MP (4000x3000)', 'JPEG', (4000, 3000)),
+    ('JPEG 48 MP (8000x6000)', 'JPEG', (8000, 6000)),
+    ('JPEG 12 MP, EXIF 6 (pion)', 'JPEG-EXIF6', (4000, 3000)),
+    ('PNG 12 MP (4000x3000)', 'PNG', (4000, 3000)),
+]
+
+
+def _make_sample(kind, size):
+    from PIL import Image
+    # Szum + gradient – treść podobna do zdjęcia, nie do jednolitej plamy
+    noise = Image.effect_noise((size[0] // 4, size[1] // 4), 64).resize(size)
+    gradient = Image.linear_gradient('L').resize(size)
+    image = Image.merge('RGB', (noise, gradient, noise))
+    buffer = io.BytesIO()
+    if kind == 'PNG':
+        image.save(buffer, format='PNG', compress_level=1)
+    elif kind == 'JPEG-EXIF6':
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        image.save(buffer, format='JPEG', quality=90, exif=exif)
+    else:
+        image.save(buffer, format='JPEG', quality=90)
+    return buffer.getvalue()
+
+
+def _decode_before(path):
+    from PIL import Image
+    image = Image.open(path)
+    if image.width > MAX_SIZE[0] or image.height > MAX_SIZE[1]:
+        image.thumbnail(MAX_SIZE, Image.Resampling.LANCZOS)
+    image.load()
+    return image.size
+
+
+def _decode_after(path):
+    from image_store import open_image_reduced
+    image = open_image_reduced(path, *MAX_SIZE)
+    return image.size
+
+
+def _peak_rss_kb():
+    # ru_maxrss jest dziedziczone przez fork/exec, VmHWM dotyczy tylko tego procesu
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _run_variant(variant, path, queue):
+    decode = _decode_before if variant == 'przed' else _decode_after
+    # Rozgrzewka importów, potem pomiar bazowy pamięci
+    if variant == 'po':
+        import image_store  # noqa: F401
+    import PIL.Image  # noqa: F401
+    baseline = _peak_rss_kb()
+    timings = []
+    size = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        size = decode(path)
+        timings.append(time.perf_counter() - start)
+    peak = _peak_rss_kb()
+    queue.put((statistics.median(timings), (peak - baseline) / 1024, size))
+
+
+def _measure(variant, path):
+    # Próbka przekazywana jest jako ścieżka – bajty pliku nie zawyżają pomiaru bazowego
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    proc = ctx.Process(target=_run_variant, args=(variant, path, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def main():
+    print(f"{'Próbka':<28} {'Wariant':<6} {'Czas [ms]':>10} {'Szczyt RSS [MB]':>16} {'Wynik':>12}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for label, kind, size in SAMPLES:
+            path = os.path.join(tmp_dir, f"{kind}_{size[0]}x{size[1]}")
+            with open(path, 'wb') as f:
+                f.write(_make_sample(kind, size))
+            for variant in ('przed', 'po'):
+                median_s, peak_mb, out_size = _measure(variant, path)
+                print(f"{label:<28} {variant:<6} {median_s * 1000:>10.1f} {peak_mb:>16.1f} "
+                      f"{out_size[0]:>5}x{out_size[1]:<6}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Wypełnia lokalną bazę SQLite (STORAGE_BACKEND=sqlite) losowymi protokołami,
+aby profilować strony aplikacji bez projektu Firebase.
+
+Użycie:
+    python benchmarks/seed_sqlite.py --count 100000 --db monterapp.db
+    STORAGE_BACKEND=sqlite SQLITE_DB_PATH=monterapp.db streamlit run main.py
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import sqlite_backend  # noqa: E402
+
+COLLECTIONS = ['drzwi', 'drzwi_wejsciowe', 'podlogi']
+STATUSES = ['pomiary_wykonane', 'aktywny', 'zakończony', 'anulowany']
+ROOMS = ['Salon', 'Kuchnia', 'Łazienka', 'Sypialnia', 'Przedpokój', 'Gabinet']
+NAMES = ['Jan Kowalski', 'Anna Nowak', 'Piotr Wiśniewski', 'Maria Wójcik', 'Tomasz Kamiński']
+MONTERS = ['monter', 'monter2', 'monter3']
+
+
+def _protocol(rng, created):
+    status = rng.choice(STATUSES)
+    return {
+        'data_utworzenia': created,
+        'data_pomiary': created,
+        'updated_at': created,
+        'pomieszczenie': rng.choice(ROOMS),
+        'imie_nazwisko': rng.choice(NAMES),
+        'telefon': f"{rng.randint(500000000, 899999999)}",
+        'szerokosc_otworu': str(rng.randint(60, 120)),
+        'wysokosc_otworu': str(rng.randint(190, 220)),
+        'monter_id': rng.choice(MONTERS),
+        'status': status,
+        'etap_formularza': 'pomiary' if status == 'pomiary_wykonane' else 'kompletny',
+        'wypelnil_monter': True,
+        'uwagi_montera': 'Pomiar testowy ' * rng.randint(1, 20),
+    }
+
+
+def seed(db, count, seed_value=0):
+    rng = random.Random(seed_value)
+    start = datetime.now() - timedelta(days=730)
+    batch = db.batch()
+    for i in range(count):
+        collection_name = COLLECTIONS[i % len(COLLECTIONS)]
+        doc_ref = db.collection(collection_name).document()
+        data = _protocol(rng, start + timedelta(minutes=rng.randint(0, 730 * 24 * 60)))
+        kod = f"S{i:07d}"
+        data['kod_dostepu'] = kod
+        batch.set(doc_ref, data)
+        batch.set(db.collection('kody_dostepu').document(kod),
+                  {'collection': collection_name, 'doc_id': doc_ref.id, 'data_utworzenia': data['data_utworzenia']})
+        if len(batch) >= sqlite_backend.MAX_BATCH_OPERATIONS:
+            batch.commit()
+            batch = db.batch()
+    if len(batch):
+        batch.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--count', type=int, default=100_000, help="liczba protokołów")
+    parser.add_argument('--db', default=os.environ.get('SQLITE_DB_PATH', 'monterapp.db'))
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    db = sqlite_backend.open_database(args.db)
+    started = time.perf_counter()
+    seed(db, args.count, args.seed)
+    elapsed = time.perf_counter() - started
+    print(f"Zapisano {args.count} protokołów w {elapsed:.1f} s ({args.count / elapsed:.0f} dok./s) -> {args.db}")
+
+
+if __name__ == '__main__':
+    main()
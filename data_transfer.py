@@ -0,0 +1,421 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from firebase_admin import firestore
+
+from firebase_config import (
+    ACCESS_CODE_INDEX, BULK_WORKERS, DRAFT_TARGETS, FIRESTORE_MAX_DOCUMENT_SIZE, IMAGE_IDS_FIELD, OVERFLOW_FIELD,
+    UPDATED_AT_FIELD, _RecordedWrites, _chunk_plans, _fetch_page, call_firestore, count_records, estimate_document_size,
+    invalidate_collection_cache, reassemble_document, write_with_budget,
+)
+from image_store import MIGRATION_COLLECTION, MIGRATION_DONE
+
+# ===================
+# Eksport do Parquet
+# ===================
+#
+# Eksport kolekcji do Parquet i import (Parquet / JSONL) dla export_parquet.py,
+# import_data.py i panelu administratora. Moduł jest osobny, aby pyarrow
+# nie był ładowany przy starcie każdej strony aplikacji.
+
+EXPORT_COLLECTIONS = ['drzwi', 'drzwi_wejsciowe', 'podlogi', 'wymiary_draft']
+# Dokumenty pobierane stronami – w pamięci jest najwyżej strona i jedna grupa wierszy.
+# Strona liczona jest w bajtach: liczba dokumentów na stronie wynika ze średniego
+# rozmiaru dokumentów poprzedniej strony (stare dokumenty ze zdjęciami base64
+# są wielokrotnie większe od nowych), ale nie przekracza EXPORT_PAGE_SIZE
+EXPORT_PAGE_SIZE = 200
+EXPORT_PAGE_BYTES = 8 * 1024 * 1024
+EXPORT_ROW_GROUP_SIZE = 5000
+# Po tylu wierszach partycja zaczyna kolejny plik (czesc-0, czesc-1, …)
+EXPORT_FILE_ROWS = 250_000
+# Pole daty wyznaczające partycję miesięczną (domyślnie data_utworzenia)
+EXPORT_DATE_FIELDS = {'wymiary_draft': 'created_at'}
+
+_EXPORT_TIMESTAMP_FIELDS = ['data_utworzenia', 'data_pomiary', 'data_sprzedaz', 'created_at', 'updated_at']
+_EXPORT_INT_FIELDS = ['nw', 'nz', 'l', 'zl', 'zp']
+_EXPORT_BOOL_FIELDS = ['wypelnil_monter', 'wypelnil_sprzedawca', 'wizjer']
+_EXPORT_STRING_FIELDS = [
+    'collection_target', 'status', 'etap_formularza', 'kod_dostepu', 'monter_id', 'sprzedawca_id', 'folder',
+    # Formularz montera
+    'numer_strony', 'pomieszczenie', 'imie_nazwisko', 'telefon', 'szerokosc_otworu', 'wysokosc_otworu',
+    'mierzona_od', 'skrot', 'typ_drzwi', 'norma', 'grubosc_muru', 'stan_sciany', 'oscieznica', 'okapnik',
+    'opaska', 'kat_zaciecia', 'prog', 'elektrozaczep', 'napis_nad_drzwiami', 'szerokosc_skrzydla',
+    'system_montazu', 'podklad', 'mdf_mozliwy', 'listwy_jaka', 'listwy_ile', 'listwy_gdzie', 'uwagi_montera',
+    # Formularz sprzedawcy
+    'producent', 'seria', 'typ', 'rodzaj_okleiny', 'ilosc_szyb', 'zamek', 'szyba', 'wentylacja', 'klamka',
+    'kolor_wizjera', 'wypelnienie', 'kolor_okuc', 'kolor_osc', 'opcje_dodatkowe', 'uwagi_klienta',
+    'rodzaj_podlogi', 'kolor', 'folia', 'listwa_przypodlogowa', 'dostawka', 'grubosc', 'ramka', 'wkladki',
+    'wzor', 'uwagi',
+]
+# Jeden schemat dla wszystkich kolekcji; pola spoza schematu trafiają do 'pozostale' (JSON),
+# a zdjęcia zapisywane są wyłącznie jako identyfikatory w magazynie zdjęć
+EXPORT_SCHEMA = pa.schema(
+    [pa.field('id', pa.string(), nullable=False)]
+    + [pa.field(name, pa.timestamp('us', tz='UTC')) for name in _EXPORT_TIMESTAMP_FIELDS]
+    + [pa.field(name, pa.int64()) for name in _EXPORT_INT_FIELDS]
+    + [pa.field(name, pa.bool_()) for name in _EXPORT_BOOL_FIELDS]
+    + [pa.field(name, pa.string()) for name in _EXPORT_STRING_FIELDS]
+    + [
+        pa.field('strona_otwierania', pa.string()),
+        pa.field('zdjecia', pa.list_(pa.string())),
+        pa.field('zdjecia_referencje', pa.string()),
+        pa.field('liczba_zdjec', pa.int32()),
+        pa.field('pozostale', pa.string()),
+    ]
+)
+# Pola pomijane w 'pozostale' (metadane zapisu)
+_EXPORT_SKIPPED_FIELDS = {'id', OVERFLOW_FIELD, IMAGE_IDS_FIELD}
+
+def _export_json(value):
+    return json.dumps(value, ensure_ascii=False, sort_keys=True, default=str)
+
+def _export_row(record):
+    """Rekord Firestore -> wiersz zgodny z EXPORT_SCHEMA"""
+    row = {'id': record['id']}
+    rest = {}
+    for name in _EXPORT_TIMESTAMP_FIELDS:
+        value = record.get(name)
+        if value is not None and not isinstance(value, datetime):
+            rest[name], value = value, None
+        elif value is not None and value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)  # naiwne daty – jak w Firestore, UTC
+        row[name] = value
+    for name in _EXPORT_INT_FIELDS:
+        value = record.get(name)
+        try:
+            row[name] = int(value) if value not in (None, '') else None
+        except (TypeError, ValueError):
+            row[name], rest[name] = None, value
+    for name in _EXPORT_BOOL_FIELDS:
+        value = record.get(name)
+        row[name] = bool(value) if value is not None else None
+    for name in _EXPORT_STRING_FIELDS:
+        value = record.get(name)
+        # Np. odznaczony checkbox zapisany jako False – typ zachowuje 'pozostale'
+        if value is not None and not isinstance(value, str):
+            rest[name], value = value, None
+        row[name] = value
+    so = record.get('strona_otwierania')
+    row['strona_otwierania'] = _export_json(so) if so is not None else None
+    images = record.get('zdjecia') or []
+    # Zdjęcia osadzone (base64) nie mają identyfikatora w magazynie – tylko liczba
+    refs = [img for img in images if isinstance(img, dict) and img.get('id')]
+    row['zdjecia'] = [img['id'] for img in refs]
+    # Pełne referencje (nazwa, miniatury…) – do odtworzenia dokumentu przy imporcie
+    row['zdjecia_referencje'] = _export_json(refs) if refs else None
+    row['liczba_zdjec'] = len(images)
+    known = set(EXPORT_SCHEMA.names) | _EXPORT_SKIPPED_FIELDS
+    rest.update({k: v for k, v in record.items() if k not in known})
+    row['pozostale'] = _export_json(rest) if rest else None
+    return row
+
+def _export_partition(record, date_field):
+    value = record.get(date_field)
+    return value.strftime('%Y-%m') if isinstance(value, datetime) else 'brak_daty'
+
+class _PartitionWriter:
+    """Zapisuje wiersze kolejnych partycji; otwarty jest zawsze tylko jeden plik"""
+
+    def __init__(self, out_dir, collection_name):
+        self.out_dir = out_dir
+        self.collection_name = collection_name
+        self.files = []
+        self._partition = None
+        self._part = 0
+        self._writer = None
+        self._file_rows = 0
+        self._rows = []
+
+    def write(self, partition, row):
+        if partition != self._partition:
+            self.close()
+            self._partition = partition
+            self._part = 0
+        elif self._file_rows + len(self._rows) >= EXPORT_FILE_ROWS:
+            self.close()
+            self._part += 1
+        self._rows.append(row)
+        if len(self._rows) >= EXPORT_ROW_GROUP_SIZE:
+            self._flush()
+
+    def _flush(self):
+        if not self._rows:
+            return
+        if self._writer is None:
+            directory = os.path.join(self.out_dir, f"kolekcja={self.collection_name}", f"miesiac={self._partition}")
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f'czesc-{self._part}.parquet')
+            self._writer = pq.ParquetWriter(path, EXPORT_SCHEMA, compression='zstd')
+            self.files.append(path)
+        self._writer.write_table(pa.Table.from_pylist(self._rows, schema=EXPORT_SCHEMA))
+        self._file_rows += len(self._rows)
+        self._rows = []
+
+    def close(self):
+        self._flush()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        self._file_rows = 0
+
+def export_collections_parquet(db, out_dir, collections=None, progress_callback=None):
+    """
+    Eksportuje kolekcje do plików Parquet partycjonowanych po kolekcji i miesiącu
+    (out_dir/kolekcja=<nazwa>/miesiac=<RRRR-MM>/czesc-<N>.parquet, nowy plik co
+    EXPORT_FILE_ROWS wierszy). Dokumenty czytane są stronami o rozmiarze około
+    EXPORT_PAGE_BYTES po dacie malejąco, więc każda partycja powstaje jednym
+    przebiegiem, a pamięć nie rośnie z rozmiarem kolekcji.
+    Dokumenty bez pola daty nie trafiają do zapytania – raportowane są jako pominięte.
+    progress_callback(kolekcja, wyeksportowane)
+    Zwraca {kolekcja: {'rows', 'files', 'skipped'}}.
+    """
+    summary = {}
+    for collection_name in collections or EXPORT_COLLECTIONS:
+        date_field = EXPORT_DATE_FIELDS.get(collection_name, 'data_utworzenia')
+        writer = _PartitionWriter(out_dir, collection_name)
+        rows = 0
+        cursor = None
+        # Pierwsza strona zakłada dokumenty o maksymalnym rozmiarze
+        page_size = max(1, EXPORT_PAGE_BYTES // FIRESTORE_MAX_DOCUMENT_SIZE)
+        try:
+            while True:
+                records, cursor = _fetch_page(db, collection_name, page_size=page_size, cursor=cursor,
+                                              order_field=date_field, summary=False)
+                if records:
+                    average = sum(estimate_document_size(r) for r in records) / len(records)
+                    page_size = max(1, min(EXPORT_PAGE_SIZE, int(EXPORT_PAGE_BYTES // average)))
+                for record in records:
+                    if record.get(OVERFLOW_FIELD):
+                        doc_ref = db.collection(collection_name).document(record['id'])
+                        record = dict(reassemble_document(doc_ref, record), id=record['id'])
+                    writer.write(_export_partition(record, date_field), _export_row(record))
+                rows += len(records)
+                if progress_callback:
+                    progress_callback(collection_name, rows)
+                if cursor is None:
+                    break
+        finally:
+            writer.close()
+        total = count_records(db, collection_name)
+        summary[collection_name] = {'rows': rows, 'files': len(writer.files), 'skipped': max(total - rows, 0)}
+    return summary
+
+# ===================
+# Import danych (Parquet / JSONL)
+# ===================
+
+# Dokumenty czytane i zapisywane grupami; po każdej grupie zapisywany jest punkt kontrolny
+IMPORT_GROUP_SIZE = 400
+IMPORT_WORKERS = BULK_WORKERS
+# Limit zapisów (dokumentów/s) rosnący o 50% co 5 minut – reguła 500/50/5 z dokumentacji Firestore
+IMPORT_MAX_RATE = float(os.environ.get('IMPORT_MAX_RATE', 500))
+IMPORT_RAMP_SECONDS = 300
+
+class _RateLimiter:
+    """Wspólny dla wątków limit dokumentów na sekundę (każdy commit rezerwuje swój przedział czasu)"""
+
+    def __init__(self, rate, ramp_seconds=None):
+        self.rate = rate
+        self.ramp_seconds = ramp_seconds
+        self._started = time.monotonic()
+        self._next = self._started
+        self._lock = threading.Lock()
+
+    def current_rate(self):
+        if not self.ramp_seconds:
+            return self.rate
+        steps = int((time.monotonic() - self._started) // self.ramp_seconds)
+        return self.rate * 1.5 ** min(steps, 20)
+
+    def acquire(self, count):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(self._next, now)
+            self._next = start + count / self.current_rate()
+        if start > now:
+            time.sleep(start - now)
+
+def _import_sources(source):
+    """
+    Pliki do importu: [(kolekcja, ścieżka, klucz punktu kontrolnego)], w stałej kolejności.
+    Parquet – układ eksportu (kolekcja=<nazwa>/miesiac=…/*.parquet),
+    JSONL – pliki <kolekcja>.jsonl (jeden dokument z polem 'id' w wierszu).
+    """
+    if os.path.isfile(source):
+        paths, root = [source], os.path.dirname(source)
+    else:
+        paths, root = [], source
+        for directory, _, files in os.walk(source):
+            paths.extend(os.path.join(directory, name) for name in files)
+    sources = []
+    for path in sorted(paths):
+        if path.endswith('.parquet'):
+            parts = [p.split('=', 1)[1] for p in os.path.normpath(path).split(os.sep) if p.startswith('kolekcja=')]
+            if not parts:
+                raise ValueError(f"Brak katalogu kolekcja=<nazwa> w ścieżce {path}")
+            collection_name = parts[-1]
+        elif path.endswith('.jsonl'):
+            collection_name = os.path.basename(path)[:-len('.jsonl')]
+        else:
+            continue
+        sources.append((collection_name, path, os.path.relpath(path, root)))
+    return sources
+
+def _import_timestamps(doc):
+    """Daty zapisane tekstem (JSONL, pola w 'pozostale') -> datetime"""
+    for name in _EXPORT_TIMESTAMP_FIELDS:
+        if isinstance(doc.get(name), str):
+            doc[name] = datetime.fromisoformat(doc[name])
+    for img in doc.get('zdjecia') or []:
+        if isinstance(img, dict) and isinstance(img.get('data_dodania'), str):
+            img['data_dodania'] = datetime.fromisoformat(img['data_dodania'])
+    return doc
+
+def _document_from_row(row):
+    """Wiersz EXPORT_SCHEMA -> dokument (odwrotność _export_row; puste kolumny są pomijane)"""
+    rest = json.loads(row.pop('pozostale', None) or '{}')
+    so = row.pop('strona_otwierania', None)
+    refs = row.pop('zdjecia_referencje', None)
+    ids = row.pop('zdjecia', None)
+    row.pop('liczba_zdjec', None)
+    doc = {k: v for k, v in row.items() if v is not None}
+    if so is not None:
+        doc['strona_otwierania'] = json.loads(so)
+    if refs:
+        doc['zdjecia'] = json.loads(refs)
+    elif ids:
+        doc['zdjecia'] = [{'id': image_id, 'hash': image_id} for image_id in ids]
+    doc.update(rest)
+    return _import_timestamps(doc)
+
+def _read_import_groups(path, skip):
+    """Kolejne grupy po IMPORT_GROUP_SIZE dokumentów, z pominięciem pierwszych `skip`"""
+    if path.endswith('.parquet'):
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=IMPORT_GROUP_SIZE):
+            if skip >= batch.num_rows:
+                skip -= batch.num_rows
+                continue
+            yield [_document_from_row(row) for row in batch.to_pylist()[skip:]]
+            skip = 0
+        return
+    group = []
+    with open(path, encoding='utf-8') as handle:
+        for line in handle:
+            if not line.strip():
+                continue
+            if skip:
+                skip -= 1
+                continue
+            group.append(_import_timestamps(json.loads(line)))
+            if len(group) >= IMPORT_GROUP_SIZE:
+                yield group
+                group = []
+    if group:
+        yield group
+
+def _import_group(db, collection_name, docs, overwrite, limiter):
+    """
+    Zapisuje grupę dokumentów (WriteBatch po maks. BATCH_MAX_OPERATIONS operacji).
+    Istniejące dokumenty są pomijane albo, przy overwrite, aktualizowane polami z importu.
+    Zwraca (zapisane, pominięte).
+    """
+    collection_ref = db.collection(collection_name)
+    refs = [collection_ref.document(doc['id']) for doc in docs]
+    existing = {snap.id: snap.to_dict() or {}
+                for snap in call_firestore('read', lambda **options: list(db.get_all(refs, **options)))
+                if snap.exists}
+    plans = []
+    for doc, doc_ref in zip(docs, refs):
+        current = existing.get(doc_ref.id)
+        if current is not None and not overwrite:
+            continue
+        data = {k: v for k, v in doc.items() if k not in ('id', UPDATED_AT_FIELD, OVERFLOW_FIELD)}
+        writes = _RecordedWrites()
+        write_with_budget(db, doc_ref, data, existing=current, writer=writes)
+        kod = data.get('kod_dostepu')
+        if kod and collection_name in DRAFT_TARGETS:
+            # set, nie create – wpis indeksu mógł zostać usunięty razem z protokołem
+            writes.set(db.collection(ACCESS_CODE_INDEX).document(kod), {
+                'collection': collection_name,
+                'doc_id': doc_ref.id,
+                'data_utworzenia': datetime.now(),
+            })
+        plans.append((None, writes))
+
+    for chunk in _chunk_plans(plans):
+        limiter.acquire(len(chunk))
+        batch = db.batch()
+        for _, writes in chunk:
+            writes.apply_to(batch)
+        # Same set/update – ponowienie commitu jest bezpieczne
+        call_firestore('write', batch.commit)
+    return len(plans), len(docs) - len(plans)
+
+def import_collections(db, source, collections=None, checkpoint_id=None, overwrite=False, restart=False,
+                       max_rate=IMPORT_MAX_RATE, max_workers=IMPORT_WORKERS, progress_callback=None):
+    """
+    Importuje dokumenty z eksportu Parquet (export_collections_parquet) lub plików
+    JSONL. Grupy dokumentów zapisywane są równolegle (max_workers) z limitem
+    max_rate dokumentów/s; po każdej grupie zapisywany jest punkt kontrolny
+    (migracje/import_<checkpoint_id>), więc przerwany import wznawia się od
+    ostatniej zapisanej grupy. Dokumenty dostają nowy updated_at, a protokoły
+    wpis w indeksie folderów i kodów dostępu.
+    progress_callback(statystyki) wywoływany jest po każdej grupie.
+    Zwraca statystyki: {'documents', 'written', 'skipped', 'seconds', 'docs_per_second'}.
+    """
+    sources = [s for s in _import_sources(source) if collections is None or s[0] in collections]
+    checkpoint_id = checkpoint_id or os.path.basename(os.path.normpath(source))
+    checkpoint_ref = db.collection(MIGRATION_COLLECTION).document(f"import_{checkpoint_id}")
+    snap = call_firestore('read', checkpoint_ref.get)
+    files = {} if restart or not snap.exists else dict((snap.to_dict() or {}).get('pliki') or {})
+    stats = {'documents': 0, 'written': 0, 'skipped': 0, 'seconds': 0.0, 'docs_per_second': 0.0}
+    limiter = _RateLimiter(max_rate, IMPORT_RAMP_SECONDS)
+    started = time.perf_counter()
+
+    def save_checkpoint():
+        # Cały dokument naraz – klucze (ścieżki plików) zawierają kropki i ukośniki
+        call_firestore('write', checkpoint_ref.set, {'zrodlo': source, 'pliki': files,
+                                                     UPDATED_AT_FIELD: firestore.SERVER_TIMESTAMP})
+
+    def complete(key, end, future):
+        written, skipped = future.result()
+        files[key] = end
+        save_checkpoint()
+        stats['documents'] += written + skipped
+        stats['written'] += written
+        stats['skipped'] += skipped
+        stats['seconds'] = time.perf_counter() - started
+        stats['docs_per_second'] = stats['documents'] / max(stats['seconds'], 1e-9)
+        if progress_callback:
+            progress_callback(stats)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for collection_name, path, key in sources:
+            done = files.get(key, 0)
+            if done == MIGRATION_DONE:
+                continue
+            # Punkt kontrolny przesuwa się tylko po ciągłym prefiksie zakończonych grup
+            pending = deque()
+            for group in _read_import_groups(path, done):
+                done += len(group)
+                pending.append((done, executor.submit(_import_group, db, collection_name, group, overwrite, limiter)))
+                if len(pending) >= 2 * max_workers:
+                    complete(key, *pending.popleft())
+            while pending:
+                complete(key, *pending.popleft())
+            files[key] = MIGRATION_DONE
+            save_checkpoint()
+            invalidate_collection_cache(collection_name)
+
+    stats['seconds'] = time.perf_counter() - started
+    stats['docs_per_second'] = stats['documents'] / max(stats['seconds'], 1e-9)
+    return stats
@@ -0,0 +1,75 @@
+from typing import Protocol, runtime_checkable
+
+# ===================
+# Interfejs backendu bazy danych
+# ===================
+#
+# Podzbiór API klienta Firestore, z którego korzysta aplikacja. Spełniają go
+# klient Firestore (firebase_admin.firestore.client(), produkcja) oraz
+# sqlite_backend.SqliteClient (praca offline, testy obciążeniowe).
+# Kod aplikacji powinien używać wyłącznie tych metod – nowa metoda klienta
+# musi zostać dodana tutaj i zaimplementowana w obu backendach.
+#
+# Wartości specjalne (DELETE_FIELD, SERVER_TIMESTAMP, ArrayUnion, ArrayRemove,
+# Increment), filtry (FieldFilter) i dekorator @firestore.transactional
+# pochodzą z biblioteki Firestore i działają z obydwoma backendami.
+# Metody odczytu i zapisu przyjmują opcje timeout/retry (call_firestore).
+
+
+class Query(Protocol):
+    """Zapytanie: filtry, sortowanie, projekcja, stronicowanie i listener"""
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None): ...
+    def order_by(self, field_path, direction=...): ...
+    def select(self, field_paths): ...
+    def limit(self, count): ...
+    def start_after(self, document_fields_or_snapshot): ...
+    def get(self, transaction=None, **options): ...
+    def stream(self, transaction=None, **options): ...
+    def count(self, alias=None): ...
+    def on_snapshot(self, callback): ...
+
+
+class CollectionReference(Query, Protocol):
+    id: str
+
+    def document(self, document_id=None): ...
+    def add(self, document_data, document_id=None, **options): ...
+    def list_documents(self, page_size=None, **options): ...
+
+
+class DocumentReference(Protocol):
+    id: str
+    path: str
+
+    @property
+    def parent(self): ...
+    def collection(self, collection_id): ...
+    def get(self, field_paths=None, transaction=None, **options): ...
+    def set(self, document_data, merge=False, **options): ...
+    def create(self, document_data, **options): ...
+    def update(self, field_updates, option=None, **options): ...
+    def delete(self, option=None, **options): ...
+
+
+class WriteBatch(Protocol):
+    """WriteBatch i Transaction (zapisy commitowane razem)"""
+
+    def set(self, reference, document_data, merge=False): ...
+    def create(self, reference, document_data): ...
+    def update(self, reference, field_updates, option=None): ...
+    def delete(self, reference, option=None): ...
+    def commit(self, **options): ...
+
+
+@runtime_checkable
+class DatabaseBackend(Protocol):
+    """Klient bazy danych zwracany przez firebase_config.initialize_firebase()"""
+
+    def collection(self, collection_path): ...
+    def document(self, document_path): ...
+    def collections(self): ...
+    def batch(self) -> WriteBatch: ...
+    def transaction(self, max_attempts=5, read_only=False, **options): ...
+    def write_option(self, last_update_time=None, exists=None): ...
+    def get_all(self, references, field_paths=None, transaction=None, **options): ...
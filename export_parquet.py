@@ -0,0 +1,46 @@
+"""
+Eksportuje protokoły (drzwi, drzwi_wejsciowe, podlogi) i szkice do plików Parquet
+partycjonowanych po kolekcji i miesiącu.
+
+Użycie:
+    python export_parquet.py --out eksport
+    python export_parquet.py --out eksport --collections drzwi podlogi
+    STORAGE_BACKEND=sqlite SQLITE_DB_PATH=monterapp.db python export_parquet.py --out eksport
+
+Wynik można wczytać np. przez pyarrow.dataset.dataset('eksport', partitioning='hive').
+"""
+import argparse
+import os
+import time
+from datetime import datetime
+
+from data_transfer import EXPORT_COLLECTIONS, export_collections_parquet
+from firebase_config import initialize_firebase
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--out', default=f"eksport_{datetime.now():%Y%m%d_%H%M%S}", help="katalog docelowy")
+    parser.add_argument('--collections', nargs='+', default=EXPORT_COLLECTIONS, choices=EXPORT_COLLECTIONS)
+    args = parser.parse_args()
+
+    if os.path.isdir(args.out) and os.listdir(args.out):
+        parser.error(f"katalog {args.out} nie jest pusty")
+    db = initialize_firebase()
+    if db is None:
+        raise SystemExit("Nie udało się połączyć z bazą danych")
+
+    started = time.perf_counter()
+    summary = export_collections_parquet(
+        db, args.out, args.collections,
+        progress_callback=lambda name, rows: print(f"\r{name}: {rows} dok.", end='', flush=True))
+    print()
+    elapsed = time.perf_counter() - started
+    for name, info in summary.items():
+        print(f"{name}: {info['rows']} dok. w {info['files']} plikach, pominięte (bez daty): {info['skipped']}")
+    total = sum(info['rows'] for info in summary.values())
+    print(f"Wyeksportowano {total} dokumentów w {elapsed:.1f} s ({total / max(elapsed, 1e-9):.0f} dok./s) -> {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,17 +1,49 @@
 import firebase_admin
-from firebase_admin import credentials, firestore, storage
+from firebase_admin import credentials, firestore, firestore_async
+from google.api_core import exceptions as google_exceptions
+from google.cloud.firestore_v1.field_path import FieldPath
 import streamlit as st
-from datetime import datetime
-import json
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
 import os
+import random
+import re
 import secrets
 import string
-import base64
-from PIL import Image
+import unicodedata
+import asyncio
+import atexit
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import io
+from image_store import (
+    store_image, load_image_bytes, thumbnail_id, open_image_reduced,
+    is_embedded, externalize_image, set_image_store, LocalImageStore, get_image_store,
+    needs_migration, delete_image, IMAGE_COLLECTIONS, MIGRATION_COLLECTION, MIGRATION_DONE,
+)
+import sqlite_backend
+from snapshot_store import open_snapshot_store
+
+# Backend bazy danych: 'firestore' (domyślnie) albo 'sqlite' – lokalny plik
+# zgodny z API klienta Firestore (praca offline, testy obciążeniowe)
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'firestore')
+
+def _initialize_sqlite():
+    """Otwiera lokalną bazę SQLite; zdjęcia trafiają do katalogu obok bazy"""
+    db = sqlite_backend.open_database()
+    if not os.environ.get('IMAGE_STORE_DIR'):
+        set_image_store(LocalImageStore(os.path.splitext(db.path)[0] + '_zdjecia'))
+    return db
 
 def initialize_firebase():
-    """Inicjalizuje połączenie z Firebase Firestore bez pliku na dysku."""
+    """
+    Inicjalizuje połączenie z Firebase Firestore bez pliku na dysku.
+    Zwraca klienta zgodnego z db_backend.DatabaseBackend (albo None).
+    """
+    if STORAGE_BACKEND == 'sqlite':
+        return _initialize_sqlite()
+
     if firebase_admin._apps:
         return firestore.client()
 
@@ -39,17 +71,9 @@ def initialize_firebase():
                 # st.info(f"🔧 Inicjalizacja Firebase z pliku: {credentials_file}")
                 cred = credentials.Certificate(credentials_file)
                 firebase_admin.initialize_app(cred)
-                db = firestore.client()
-                
-                # Test połączenia
-                try:
-                    # Sprawdź czy można się połączyć
-                    collections = list(db.collections())
-                    # st.success("✅ Połączenie z Firebase Firestore nawiązane")
-                    return db
-                except Exception as test_error:
-                    st.error(f"❌ Problemy z połączeniem Firestore: {test_error}")
-                    return None
+                # Klient łączy się dopiero przy pierwszym zapytaniu – bez testu
+                # listującego kolekcje, którego koszt rośnie z ich liczbą
+                return firestore.client()
             else:
                 st.error(f"❌ Nie znaleziono pliku credentials: {credentials_file}")
                 st.error("Upewnij się, że plik istnieje w katalogu projektu")
@@ -69,26 +93,218 @@ def initialize_firebase():
 
 @st.cache_resource
 def setup_database():
-    """Inicjalizuje bazę danych z pełną obsługą błędów"""
+    """Inicjalizuje bazę danych z pełną obsługą błędów (raz na proces)"""
+    started = time.perf_counter()
     try:
         db = initialize_firebase()
         if db is None:
             st.error("❌ Nie udało się zainicjalizować bazy danych Firebase!")
             st.error("🔧 Sprawdź konfigurację Firebase")
             return None
-        
-        # Test czy baza faktycznie działa
-        try:
-            # Sprawdź czy możemy się połączyć
-            collections = list(db.collections())
-            return db
-        except Exception as test_error:
-            st.error(f"❌ Problemy z połączeniem z bazą: {test_error}")
-            return None
+        return db
             
     except Exception as e:
         st.error(f"❌ Krytyczny błąd inicjalizacji: {e}")
         return None
+    finally:
+        _record_startup_phase('inicjalizacja klienta', started)
+
+# ============================================================================
+# START APLIKACJI (jednorazowy bootstrap)
+# ============================================================================
+
+_startup_timings = {}  # faza startu -> czas trwania (s)
+_default_users_ready = False
+_bootstrap_lock = threading.Lock()
+
+def _record_startup_phase(phase, started):
+    elapsed = time.perf_counter() - started
+    _startup_timings[phase] = round(elapsed, 3)
+    print(f"⏱️ Start – {phase}: {elapsed * 1000:.0f} ms")
+
+def get_startup_timings():
+    """Czasy faz startu procesu (do wyświetlenia w panelu administratora)"""
+    return dict(_startup_timings)
+
+def ensure_default_users(db):
+    """
+    Wywołuje init_default_users raz na proces – kolejne przebiegi skryptu
+    nie wykonują żadnych odczytów. Po błędzie sprawdzenie jest ponawiane.
+    """
+    global _default_users_ready
+    if _default_users_ready:
+        return True
+    with _bootstrap_lock:
+        if not _default_users_ready:
+            started = time.perf_counter()
+            _default_users_ready = init_default_users(db)
+            _record_startup_phase('użytkownicy domyślni', started)
+    return _default_users_ready
+
+# ============================================================================
+# ODPORNOŚĆ NA AWARIE (deadline, ponowienia, circuit breaker)
+# ============================================================================
+
+# Deadline całej operacji łącznie z ponowieniami (sekundy)
+OPERATION_DEADLINES = {'read': 10, 'query': 20, 'count': 10, 'write': 15}
+RETRY_MAX_ATTEMPTS = 4
+RETRY_INITIAL_DELAY = 0.2
+RETRY_MAX_DELAY = 3.0
+# Błędy przejściowe – ponawiane tylko dla operacji idempotentnych
+RETRYABLE_ERRORS = (
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+    google_exceptions.TooManyRequests,
+    google_exceptions.Aborted,
+)
+# Po tylu kolejnych nieudanych wywołaniach obwód otwiera się na BREAKER_COOLDOWN_SECONDS
+BREAKER_FAILURE_THRESHOLD = 3
+BREAKER_COOLDOWN_SECONDS = 30
+
+class FirestoreUnavailable(Exception):
+    """Obwód otwarty – zapytanie nie zostało wysłane do bazy"""
+
+class CircuitBreaker:
+    """
+    Circuit breaker wspólny dla procesu: closed -> open po serii błędów,
+    po czasie ochłodzenia half_open przepuszcza jedno zapytanie próbne.
+    """
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, cooldown=BREAKER_COOLDOWN_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self.state = 'closed'
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probe_in_flight = False
+        self.trips = 0
+        self.rejected = 0
+        self.retries = 0
+        self.last_error = None
+
+    def allow(self):
+        with self._lock:
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.cooldown:
+                self.state = 'half_open'
+                self.probe_in_flight = False
+            if self.state == 'closed' or (self.state == 'half_open' and not self.probe_in_flight):
+                self.probe_in_flight = self.state == 'half_open'
+                return True
+            self.rejected += 1
+            return False
+
+    def retry_in(self):
+        """Sekundy do kolejnej próby połączenia (0, gdy obwód nie jest otwarty)"""
+        with self._lock:
+            if self.state != 'open':
+                return 0
+            return max(0, round(self.cooldown - (time.monotonic() - self.opened_at)))
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self.consecutive_failures = 0
+            self.probe_in_flight = False
+
+    def record_failure(self, error):
+        with self._lock:
+            self.consecutive_failures += 1
+            self.last_error = f"{type(error).__name__}: {error}"
+            self.probe_in_flight = False
+            if self.state == 'half_open' or self.consecutive_failures >= self.failure_threshold:
+                if self.state != 'open':
+                    self.trips += 1
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "trips": self.trips,
+                "rejected": self.rejected,
+                "retries": self.retries,
+                "last_error": self.last_error,
+            }
+
+_breaker = CircuitBreaker()
+
+def get_breaker_stats():
+    """Stan circuit breakera (do wyświetlenia w panelu administratora)"""
+    stats = _breaker.stats()
+    stats["retry_in_s"] = _breaker.retry_in()
+    return stats
+
+def _before_call():
+    if not _breaker.allow():
+        raise FirestoreUnavailable(
+            f"Baza danych chwilowo niedostępna – ponowna próba za {_breaker.retry_in()} s")
+    return 0, RETRY_INITIAL_DELAY
+
+def _retry_delay(error, attempt, delay, deadline, idempotent):
+    """Czas oczekiwania przed ponowieniem albo None, gdy błąd trzeba zgłosić"""
+    if not isinstance(error, RETRYABLE_ERRORS):
+        # Baza odpowiedziała (np. NotFound) – to nie jest awaria połączenia
+        _breaker.record_success()
+        return None
+    # Wykładniczy backoff z pełnym jitterem
+    sleep = random.uniform(0, delay)
+    if not idempotent or attempt >= RETRY_MAX_ATTEMPTS or time.monotonic() + sleep >= deadline:
+        _breaker.record_failure(error)
+        return None
+    _breaker.record_retry()
+    return sleep
+
+def call_firestore(operation, method, *args, idempotent=True, **kwargs):
+    """
+    Wywołuje metodę klienta Firestore (np. query.get, doc_ref.set, batch.commit)
+    z deadline'em operacji, ponowieniami błędów przejściowych i circuit breakerem.
+    operation to klucz OPERATION_DEADLINES; idempotent=False wyłącza ponowienia.
+    """
+    attempt, delay = _before_call()
+    deadline = time.monotonic() + OPERATION_DEADLINES[operation]
+    while True:
+        attempt += 1
+        try:
+            result = method(*args, timeout=max(deadline - time.monotonic(), 0.1), retry=None, **kwargs)
+        except Exception as e:
+            sleep = _retry_delay(e, attempt, delay, deadline, idempotent)
+            if sleep is None:
+                raise
+            time.sleep(sleep)
+            delay = min(delay * 2, RETRY_MAX_DELAY)
+            continue
+        _breaker.record_success()
+        return result
+
+async def call_firestore_async(operation, method, *args, idempotent=True, **kwargs):
+    """Wersja call_firestore dla metod AsyncClient"""
+    attempt, delay = _before_call()
+    deadline = time.monotonic() + OPERATION_DEADLINES[operation]
+    while True:
+        attempt += 1
+        try:
+            result = await method(*args, timeout=max(deadline - time.monotonic(), 0.1), retry=None, **kwargs)
+        except Exception as e:
+            sleep = _retry_delay(e, attempt, delay, deadline, idempotent)
+            if sleep is None:
+                raise
+            await asyncio.sleep(sleep)
+            delay = min(delay * 2, RETRY_MAX_DELAY)
+            continue
+        _breaker.record_success()
+        return result
+
+def is_backend_degraded(error):
+    """Czy błąd oznacza niedostępność bazy (wtedy można pokazać dane z cache)"""
+    return isinstance(error, (FirestoreUnavailable,) + RETRYABLE_ERRORS)
 
 # ============================================================================
 # FUNKCJE ZARZĄDZANIA UŻYTKOWNIKAMI
@@ -103,7 +319,7 @@ def get_all_users(db):
     """Pobiera wszystkich użytkowników z bazy danych"""
     try:
         users_ref = db.collection('users')
-        users = users_ref.stream()
+        users = call_firestore('query', users_ref.get)
         users_dict = {}
         for user in users:
             users_dict[user.id] = user.to_dict()
@@ -116,7 +332,7 @@ def get_user_by_username(db, username):
     """Pobiera użytkownika po nazwie użytkownika"""
     try:
         user_ref = db.collection('users').document(username)
-        user_doc = user_ref.get()
+        user_doc = call_firestore('read', user_ref.get)
         if user_doc.exists:
             return user_doc.to_dict()
         return None
@@ -152,11 +368,12 @@ def create_user(db, username, password, role, name, created_by=None):
             "name": name,
             "created_by": created_by,
             "created_at": datetime.now(),
-            "last_login": None
+            "last_login": None,
+            UPDATED_AT_FIELD: firestore.SERVER_TIMESTAMP,
         }
         
         # Zapisz użytkownika
-        db.collection('users').document(username).set(user_data)
+        call_firestore('write', db.collection('users').document(username).set, user_data)
         return True, "Użytkownik został utworzony pomyślnie"
         
     except Exception as e:
@@ -166,7 +383,7 @@ def update_user(db, username, **kwargs):
     """Aktualizuje dane użytkownika"""
     try:
         user_ref = db.collection('users').document(username)
-        user_doc = user_ref.get()
+        user_doc = call_firestore('read', user_ref.get)
         
         if not user_doc.exists:
             return False, "Użytkownik nie istnieje"
@@ -180,7 +397,7 @@ def update_user(db, username, **kwargs):
                 update_data[key] = value
         
         if update_data:
-            user_ref.update(update_data)
+            call_firestore('write', user_ref.update, stamp_updated_at(update_data))
         
         return True, "Użytkownik został zaktualizowany pomyślnie"
         
@@ -191,7 +408,7 @@ def delete_user(db, username):
     """Usuwa użytkownika z bazy danych"""
     try:
         user_ref = db.collection('users').document(username)
-        user_doc = user_ref.get()
+        user_doc = call_firestore('read', user_ref.get)
         
         if not user_doc.exists:
             return False, "Użytkownik nie istnieje"
@@ -201,7 +418,7 @@ def delete_user(db, username):
         if user_data.get("role") == "admin" and username == "admin":
             return False, "Nie można usunąć głównego administratora"
         
-        user_ref.delete()
+        call_firestore('write', user_ref.delete)
         return True, "Użytkownik został usunięty pomyślnie"
         
     except Exception as e:
@@ -210,8 +427,9 @@ def delete_user(db, username):
 def update_last_login(db, username):
     """Aktualizuje datę ostatniego logowania użytkownika"""
     try:
-        db.collection('users').document(username).update({
-            "last_login": datetime.now()
+        call_firestore('write', db.collection('users').document(username).update, {
+            "last_login": datetime.now(),
+            UPDATED_AT_FIELD: firestore.SERVER_TIMESTAMP,
         })
         return True
     except Exception as e:
@@ -221,7 +439,8 @@ def update_last_login(db, username):
 def init_default_users(db):
     """Inicjalizuje domyślnych użytkowników jeśli baza jest pusta"""
     try:
-        users = get_all_users(db)
+        # Wystarczy sprawdzić istnienie jednego dokumentu – bez pobierania wszystkich
+        users = call_firestore('read', db.collection('users').limit(1).get)
         
         if not users:
             # Utwórz domyślnego administratora
@@ -397,26 +616,26 @@ def create_tables_if_not_exist(db):
     try:
         # Sprawdź czy kolekcja 'drzwi' istnieje
         drzwi_ref = db.collection('drzwi')
-        drzwi_docs = drzwi_ref.limit(1).get()
+        drzwi_docs = call_firestore('read', drzwi_ref.limit(1).get)
         
         if len(drzwi_docs) == 0:
             # Utwórz przykładowy dokument w kolekcji drzwi
             sample_drzwi = drzwi_schema.copy()
             sample_drzwi["pomieszczenie"] = "Przykład - Salon"
             sample_drzwi["uwagi_klienta"] = "Kolekcja utworzona automatycznie"
-            drzwi_ref.add(sample_drzwi)
+            call_firestore('write', drzwi_ref.add, stamp_updated_at(sample_drzwi), idempotent=False)
             print("✅ Kolekcja 'drzwi' została utworzona")
         
         # Sprawdź czy kolekcja 'podlogi' istnieje
         podlogi_ref = db.collection('podlogi')
-        podlogi_docs = podlogi_ref.limit(1).get()
+        podlogi_docs = call_firestore('read', podlogi_ref.limit(1).get)
         
         if len(podlogi_docs) == 0:
             # Utwórz przykładowy dokument w kolekcji podlogi
             sample_podlogi = podlogi_schema.copy()
             sample_podlogi["pomieszczenie"] = "Przykład - Pokój"
             sample_podlogi["uwagi"] = "Kolekcja utworzona automatycznie"
-            podlogi_ref.add(sample_podlogi)
+            call_firestore('write', podlogi_ref.add, stamp_updated_at(sample_podlogi), idempotent=False)
             print("✅ Kolekcja 'podlogi' została utworzona")
             
     except Exception as e:
@@ -432,10 +651,11 @@ def save_drzwi_data(db, dane_formularza):
         dane_formularza["status"] = "aktywny"
         
         # Zapisz do kolekcji 'drzwi'
-        doc_ref = db.collection('drzwi').add(dane_formularza)
+        doc_ref = db.collection('drzwi').document()
+        write_with_budget(db, doc_ref, dane_formularza)
+        invalidate_collection_cache('drzwi')
         
-        # doc_ref to tuple (timestamp, DocumentReference)
-        document_id = doc_ref[1].id
+        document_id = doc_ref.id
         print(f"✅ Zapisano dane drzwi z ID: {document_id}")
         return document_id
         
@@ -453,10 +673,11 @@ def save_podlogi_data(db, dane_formularza):
         dane_formularza["status"] = "aktywny"
         
         # Zapisz do kolekcji 'podlogi'
-        doc_ref = db.collection('podlogi').add(dane_formularza)
+        doc_ref = db.collection('podlogi').document()
+        write_with_budget(db, doc_ref, dane_formularza)
+        invalidate_collection_cache('podlogi')
         
-        # doc_ref to tuple (timestamp, DocumentReference)
-        document_id = doc_ref[1].id
+        document_id = doc_ref.id
         print(f"✅ Zapisano dane podłóg z ID: {document_id}")
         return document_id
         
@@ -464,216 +685,1576 @@ def save_podlogi_data(db, dane_formularza):
         print(f"❌ Błąd podczas zapisywania danych podłóg: {e}")
         return None
 
-def get_all_drzwi(db):
+# ============================================================================
+# PROJEKCJE (odczyty skrócone dla list)
+# ============================================================================
+
+# Pola wyświetlane w tabelach list protokołów (bez zdjęć i danych produktu)
+PROTOCOL_SUMMARY_FIELDS = [
+    'data_utworzenia', 'data_pomiary', 'pomieszczenie', 'imie_nazwisko', 'nazwisko',
+    'telefon', 'szerokosc_otworu', 'wysokosc_otworu', 'system_montazu', 'mdf_mozliwy',
+    'nw', 'nz', 'l', 'zl', 'zp', 'monter_id', 'status', 'etap_formularza', 'kod_dostepu',
+    'updated_at',
+]
+
+# Pola wyświetlane w tabelach szkiców (przechowalnia)
+DRAFT_SUMMARY_FIELDS = [
+    'collection_target', 'monter_id', 'imie_nazwisko', 'telefon', 'pomieszczenie',
+    'status', 'created_at', 'updated_at',
+]
+
+def summary_fields(collection_name):
+    """Zwraca listę pól projekcji "summary" dla danej kolekcji"""
+    if collection_name == 'wymiary_draft':
+        return DRAFT_SUMMARY_FIELDS
+    return PROTOCOL_SUMMARY_FIELDS
+
+# ============================================================================
+# BUDŻET ROZMIARU DOKUMENTU
+# ============================================================================
+
+# Firestore odrzuca dokumenty większe niż 1 MiB; budżet zostawia zapas
+DOCUMENT_SIZE_BUDGET = int(os.environ.get('DOCUMENT_SIZE_BUDGET', 900 * 1024))
+FIRESTORE_MAX_DOCUMENT_SIZE = 1024 * 1024 - 1
+
+# Pola przeniesione poza dokument zapisywane są w podkolekcji,
+# a ich nazwy w polu OVERFLOW_FIELD dokumentu głównego
+OVERFLOW_FIELD = '_przepelnienie'
+OVERFLOW_SUBCOLLECTION = 'przepelnienie'
+# Identyfikatory zdjęć dokumentu (także tych w przepełnieniu) – zapytanie
+# array_contains sprawdza, czy jakiś dokument odwołuje się jeszcze do zdjęcia
+IMAGE_IDS_FIELD = 'zdjecia_id'
+
+# Pól list i metadanych nigdy nie przenosimy (projekcje muszą je widzieć)
+_NEVER_SPILL = set(PROTOCOL_SUMMARY_FIELDS) | set(DRAFT_SUMMARY_FIELDS) | {
+    'collection_target', 'wypelnil_monter', 'wypelnil_sprzedawca', 'data_sprzedaz',
+    'sprzedawca_id', OVERFLOW_FIELD, 'folder', IMAGE_IDS_FIELD,
+}
+
+class DocumentTooLargeError(ValueError):
+    """Dokument nie mieści się w budżecie nawet po przeniesieniu danych"""
+
+def _value_size(value):
+    """Rozmiar wartości wg zasad liczenia rozmiaru dokumentów Firestore"""
+    if value is None or isinstance(value, bool):
+        return 1
+    if isinstance(value, (int, float, datetime)):
+        return 8
+    if isinstance(value, str):
+        return len(value.encode('utf-8')) + 1
+    if isinstance(value, bytes):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(len(str(k).encode('utf-8')) + 1 + _value_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(_value_size(v) for v in value)
+    if hasattr(value, 'path'):  # DocumentReference
+        return len(value.path.encode('utf-8')) + 16
+    return 8  # znaczniki (SERVER_TIMESTAMP, ArrayUnion itp.)
+
+def estimate_document_size(data, doc_path=''):
+    """Szacuje rozmiar dokumentu w bajtach (nazwa + pola + 32 B narzutu)"""
+    return len(doc_path.encode('utf-8')) + 16 + _value_size(data) + 32
+
+def fit_document_to_budget(data, doc_path='', budget=None):
     """
-    Pobiera wszystkie rekordy drzwi z bazy danych
+    Dopasowuje dokument do budżetu rozmiaru.
+    Najpierw przenosi zdjęcia base64 do magazynu zdjęć, potem (jeśli dalej
+    za duży) wynosi największe pola – w pierwszej kolejności 'zdjecia' – do
+    podkolekcji. Zwraca (dokument, {pole: wartość przeniesiona}).
     """
-    if db is None:
-        st.error("❌ Baza danych nie jest zainicjalizowana")
-        return []
-        
-    try:
-        docs = db.collection('drzwi').order_by('data_utworzenia', direction=firestore.Query.DESCENDING).get()
-        drzwi_list = []
-        for doc in docs:
-            data = doc.to_dict()
-            data['id'] = doc.id
-            drzwi_list.append(data)
-        return drzwi_list
-    except Exception as e:
-        st.error(f"Błąd podczas pobierania danych drzwi: {e}")
-        return []
+    budget = budget or DOCUMENT_SIZE_BUDGET
+    fitted = dict(data)
+    overflow = {}
+    if estimate_document_size(fitted, doc_path) <= budget:
+        return fitted, overflow
+
+    # 1. Zdjęcia base64 -> magazyn zdjęć (w dokumencie zostają referencje)
+    images = fitted.get('zdjecia')
+    if images and any(is_embedded(img) for img in images):
+        fitted['zdjecia'] = [externalize_image(img) if is_embedded(img) else img for img in images]
+
+    # 2. Największe pola (zdjęcia jako pierwsze) -> podkolekcja
+    candidates = sorted(
+        (k for k in fitted if k not in _NEVER_SPILL),
+        key=lambda k: (k != 'zdjecia', -_value_size(fitted[k]))
+    )
+    for field in candidates:
+        if estimate_document_size(fitted, doc_path) <= budget:
+            break
+        value = fitted.pop(field)
+        if estimate_document_size({'wartosc': value}, doc_path) > FIRESTORE_MAX_DOCUMENT_SIZE:
+            raise DocumentTooLargeError(
+                f"Pole '{field}' jest za duże, aby zapisać je w bazie "
+                f"({_value_size(value) / 1024:.0f} KB)"
+            )
+        overflow[field] = value
+
+    if estimate_document_size(fitted, doc_path) > budget:
+        raise DocumentTooLargeError(
+            f"Dokument przekracza budżet rozmiaru ({budget / 1024:.0f} KB)"
+        )
+    return fitted, overflow
 
-def get_all_podlogi(db):
+def image_ids(images):
+    """Identyfikatory zdjęć z referencji (zdjęcia base64 nie mają id)"""
+    return sorted({img['id'] for img in images or [] if isinstance(img, dict) and img.get('id')})
+
+def write_with_budget(db, doc_ref, data, existing=None, writer=None):
     """
-    Pobiera wszystkie rekordy podłóg z bazy danych
+    Zapisuje dokument (existing=None) lub aktualizuje pola z `data`
+    (existing = aktualna, surowa treść dokumentu) z kontrolą budżetu rozmiaru.
+    Przepełnienie trafia do podkolekcji w tym samym batchu/transakcji.
+    writer – WriteBatch lub Transaction; bez niego zapis jest commitowany od razu.
+    Każdy zapis otrzymuje serwerowy znacznik updated_at.
     """
-    if db is None:
-        st.error("❌ Baza danych nie jest zainicjalizowana")
-        return []
-        
-    try:
-        docs = db.collection('podlogi').order_by('data_utworzenia', direction=firestore.Query.DESCENDING).get()
-        podlogi_list = []
-        for doc in docs:
-            data = doc.to_dict()
-            data['id'] = doc.id
-            podlogi_list.append(data)
-        return podlogi_list
-    except Exception as e:
-        st.error(f"Błąd podczas pobierania danych podłóg: {e}")
-        return []
+    data = stamp_updated_at(dict(data))
+    create = existing is None
+    merged = dict(existing or {})
+    merged.update(data)
+    batch = writer if writer is not None else db.batch()
+    _update_folder_index(batch, db, doc_ref, data, merged, None if create else existing.get(FOLDER_FIELD))
+    previously_spilled = set(merged.pop(OVERFLOW_FIELD, None) or [])
+    still_spilled = previously_spilled - set(data)
+
+    fitted, overflow = fit_document_to_budget(merged, doc_ref.path)
+    if 'zdjecia' in data:
+        # Po przeniesieniu zdjęć base64 do magazynu – wtedy znane są już ich id
+        fitted[IMAGE_IDS_FIELD] = image_ids(fitted.get('zdjecia', overflow.get('zdjecia')))
+    spilled = sorted(still_spilled | set(overflow))
+    if spilled:
+        fitted[OVERFLOW_FIELD] = spilled
 
-def get_all_drzwi_wejsciowe(db):
+    if create:
+        batch.set(doc_ref, fitted)
+    else:
+        # Tylko zmienione pola: nowe dane, zdjęcia przeniesione do magazynu, przepełnienie
+        update = {k: v for k, v in fitted.items() if k in data or v is not merged.get(k)}
+        for field in overflow:
+            if field in (existing or {}):
+                update[field] = firestore.DELETE_FIELD
+        if spilled:
+            update[OVERFLOW_FIELD] = spilled
+        elif previously_spilled:
+            update[OVERFLOW_FIELD] = firestore.DELETE_FIELD
+        batch.update(doc_ref, update)
+
+    overflow_ref = doc_ref.collection(OVERFLOW_SUBCOLLECTION)
+    for field, value in overflow.items():
+        batch.set(overflow_ref.document(field), {'wartosc': value})
+    for field in (previously_spilled - still_spilled) - set(overflow):
+        batch.delete(overflow_ref.document(field))
+
+    if writer is None:
+        call_firestore('write', batch.commit)
+    return fitted
+
+def reassemble_document(doc_ref, data, transaction=None, **options):
     """
-    Pobiera wszystkie rekordy drzwi wejściowych z bazy danych
+    Zwraca kopię dokumentu z polami dołączonymi z podkolekcji przepełnienia.
+    W transakcji deadline (options) przekazuje funkcja transakcyjna.
     """
-    if db is None:
-        st.error("❌ Baza danych nie jest zainicjalizowana")
-        return []
-        
-    try:
-        docs = db.collection('drzwi_wejsciowe').order_by('data_utworzenia', direction=firestore.Query.DESCENDING).get()
-        drzwi_wejsciowe_list = []
-        for doc in docs:
-            data = doc.to_dict()
-            data['id'] = doc.id
-            drzwi_wejsciowe_list.append(data)
-        return drzwi_wejsciowe_list
-    except Exception as e:
-        st.error(f"Błąd podczas pobierania danych drzwi wejściowych: {e}")
-        return []
+    spilled = data.get(OVERFLOW_FIELD)
+    if not spilled:
+        return data
+    full = {k: v for k, v in data.items() if k != OVERFLOW_FIELD}
+    overflow = doc_ref.collection(OVERFLOW_SUBCOLLECTION)
+    if transaction is None:
+        snaps = call_firestore('read', overflow.get)
+    else:
+        snaps = overflow.get(transaction=transaction, **options)
+    for snap in snaps:
+        if snap.id in spilled:
+            full[snap.id] = (snap.to_dict() or {}).get('wartosc')
+    return full
 
-def update_record_status(db, collection_name, doc_id, new_status):
+@firestore.transactional
+def _delete_with_overflow_transaction(transaction, db, doc_ref, refs, folder, **options):
+    # Odczyt folderu musi poprzedzać zapisy transakcji
+    if folder:
+        _remove_folder_member(transaction, db, folder, doc_ref, transaction=transaction, **options)
+    for ref in refs:
+        transaction.delete(ref)
+    transaction.delete(doc_ref)
+    record_deletion(transaction, db, doc_ref)
+
+def delete_with_overflow(db, doc_ref, also_delete=(), folder=None):
     """
-    Aktualizuje status rekordu (aktywny, zakończony, anulowany)
+    Usuwa dokument razem z podkolekcją przepełnienia (i also_delete w tej samej
+    transakcji) oraz zapisuje znacznik usunięcia dla synchronizacji przyrostowej.
+    folder – klucz folderu klienta, z którego należy usunąć dokument
+    (folder bez pozostałych protokołów jest usuwany w tej samej transakcji).
     """
-    try:
-        db.collection(collection_name).document(doc_id).update({
-            'status': new_status,
-            'data_modyfikacji': datetime.now()
-        })
-        return True
-    except Exception as e:
-        st.error(f"Błąd podczas aktualizacji statusu: {e}")
-        return False
+    overflow_refs = call_firestore('read', lambda **options: list(
+        doc_ref.collection(OVERFLOW_SUBCOLLECTION).list_documents(**options)))
+    refs = list(also_delete) + overflow_refs
+    call_firestore('write', lambda **options: _delete_with_overflow_transaction(
+        db.transaction(), db, doc_ref, refs, folder, **options))
 
-def delete_record(db, collection_name, doc_id):
+# ============================================================================
+# ZNACZNIK MODYFIKACJI (updated_at) I SYNCHRONIZACJA PRZYROSTOWA
+# ============================================================================
+
+UPDATED_AT_FIELD = 'updated_at'
+# Znaczniki usunięć – delta nie widzi usuniętych dokumentów bez nich
+DELETIONS_COLLECTION = 'usuniete'
+# Kolekcje objęte synchronizacją przyrostową i migracją updated_at
+SYNC_COLLECTIONS = ['drzwi', 'drzwi_wejsciowe', 'podlogi', 'wymiary_draft']
+DELTA_PAGE_SIZE = 500
+UPDATED_AT_MIGRATION_BATCH = 400
+
+def stamp_updated_at(data):
+    """Ustawia w `data` serwerowy znacznik updated_at (in place) i zwraca `data`"""
+    data[UPDATED_AT_FIELD] = firestore.SERVER_TIMESTAMP
+    return data
+
+def record_deletion(writer, db, doc_ref):
+    """Dodaje do batcha/transakcji znacznik usunięcia dokumentu doc_ref"""
+    collection_name = doc_ref.parent.id
+    writer.set(db.collection(DELETIONS_COLLECTION).document(f"{collection_name}__{doc_ref.id}"), {
+        'collection': collection_name,
+        'doc_id': doc_ref.id,
+        UPDATED_AT_FIELD: firestore.SERVER_TIMESTAMP,
+    })
+
+def _query_since(query, since):
+    """Wszystkie dokumenty zapytania z updated_at > since, stronami po DELTA_PAGE_SIZE"""
+    if since is not None:
+        query = query.where(filter=firestore.FieldFilter(UPDATED_AT_FIELD, '>', since))
+    query = query.order_by(UPDATED_AT_FIELD).order_by(FieldPath.document_id())
+    docs, cursor = [], None
+    while True:
+        page = query.limit(DELTA_PAGE_SIZE)
+        if cursor is not None:
+            page = page.start_after({UPDATED_AT_FIELD: cursor[0], '__name__': cursor[1]})
+        batch = call_firestore('query', page.get)
+        docs.extend(batch)
+        if len(batch) < DELTA_PAGE_SIZE:
+            return docs
+        cursor = (batch[-1].get(UPDATED_AT_FIELD), batch[-1].id)
+
+def get_changes_since(db, collection_name, since=None, fields=None):
     """
-    Usuwa rekord z bazy danych
+    Zwraca zmiany w kolekcji od znacznika `since`: (rekordy, usunięte_id, watermark).
+    rekordy – dokumenty z updated_at > since (rosnąco), usunięte_id – dokumenty
+    usunięte po since, watermark – wartość `since` dla następnego wywołania.
+    fields ogranicza odczyt do projekcji (np. summary_fields), None – pełne dokumenty.
+    since=None zwraca wszystkie dokumenty mające updated_at (zob. migrate_updated_at).
     """
-    try:
-        db.collection(collection_name).document(doc_id).delete()
-        return True
-    except Exception as e:
-        st.error(f"Błąd podczas usuwania rekordu: {e}")
-        return False
+    query = db.collection(collection_name)
+    if fields is not None:
+        query = query.select(list(fields) if UPDATED_AT_FIELD in fields else list(fields) + [UPDATED_AT_FIELD])
+    changed = _records_from_docs(_query_since(query, since))
+    tombstones = _query_since(
+        db.collection(DELETIONS_COLLECTION)
+        .where(filter=firestore.FieldFilter('collection', '==', collection_name)), since)
 
+    watermark = since
+    latest = {}
+    for record in changed:
+        watermark = record[UPDATED_AT_FIELD] if watermark is None else max(watermark, record[UPDATED_AT_FIELD])
+        latest[record['id']] = record[UPDATED_AT_FIELD]
+    deleted = []
+    for snap in tombstones:
+        data = snap.to_dict() or {}
+        deleted_at = data.get(UPDATED_AT_FIELD)
+        watermark = deleted_at if watermark is None else max(watermark, deleted_at)
+        # Dokument utworzony ponownie po usunięciu (to samo ID) nie jest usunięty
+        if data.get('doc_id') not in latest or latest[data['doc_id']] < deleted_at:
+            deleted.append(data.get('doc_id'))
+    deleted_ids = set(deleted)
+    return [r for r in changed if r['id'] not in deleted_ids], deleted, watermark
 
+def migrate_updated_at(db, collections=None, batch_size=UPDATED_AT_MIGRATION_BATCH,
+                       restart=False, progress_callback=None):
+    """
+    Uzupełnia updated_at w dokumentach zapisanych przed jego wprowadzeniem
+    (serwerowy znacznik czasu migracji). Dokumenty czytane są partiami po
+    batch_size (projekcja samego updated_at), punkt kontrolny zapisywany jest
+    w tym samym batchu – przerwana migracja wznawia się od ostatniej partii.
+    progress_callback(kolekcja, statystyki) wywoływany jest po każdej partii.
+    Zwraca statystyki: {'documents', 'updated'}.
+    """
+    collections = collections or SYNC_COLLECTIONS
+    checkpoint_ref = db.collection(MIGRATION_COLLECTION).document(UPDATED_AT_FIELD)
+    snap = call_firestore('read', checkpoint_ref.get)
+    checkpoint = {} if restart or not snap.exists else (snap.to_dict() or {})
+    stats = {'documents': 0, 'updated': 0}
 
-def generate_access_code():
-    """Generuje unikalny kod dostępu dla formularza"""
-    return ''.join(secrets.choice(string.ascii_uppercase + string.digits) for _ in range(8))
+    for collection_name in collections:
+        last_id = checkpoint.get(collection_name)
+        if last_id == MIGRATION_DONE:
+            continue
 
-def save_pomiary_data(db, collection_name, dane_formularza, monter_id):
+        while True:
+            query = (db.collection(collection_name)
+                     .select([UPDATED_AT_FIELD])
+                     .order_by(FieldPath.document_id())
+                     .limit(batch_size))
+            if last_id:
+                query = query.start_after({'__name__': last_id})
+            docs = call_firestore('query', query.get)
+            if not docs:
+                break
+
+            batch = db.batch()
+            for doc in docs:
+                stats['documents'] += 1
+                if (doc.to_dict() or {}).get(UPDATED_AT_FIELD) is None:
+                    batch.update(doc.reference, {UPDATED_AT_FIELD: firestore.SERVER_TIMESTAMP})
+                    stats['updated'] += 1
+            last_id = docs[-1].id
+            batch.set(checkpoint_ref, {collection_name: last_id}, merge=True)
+            call_firestore('write', batch.commit)
+            if progress_callback:
+                progress_callback(collection_name, stats)
+
+        call_firestore('write', checkpoint_ref.set, {collection_name: MIGRATION_DONE}, merge=True)
+        invalidate_collection_cache(collection_name)
+
+    return stats
+
+# Punkt kontrolny migracji zdjęć (wersja 2 – z uzupełnianiem IMAGE_IDS_FIELD)
+IMAGE_MIGRATION_CHECKPOINT = 'zdjecia_do_magazynu_2'
+
+def migrate_embedded_images(db, collections=None, batch_size=20, store=None,
+                            restart=False, progress_callback=None):
     """
-    Zapisuje część formularza wypełnioną przez montera (pomiary)
+    Przenosi zdjęcia zapisane jako base64 w dokumentach do magazynu zdjęć,
+    dogenerowuje miniatury dla referencji, które ich nie mają, i uzupełnia
+    IMAGE_IDS_FIELD (dopiero po zakończeniu migracji usuwane są nieużywane zdjęcia).
+
+    Dokumenty przetwarzane są partiami po batch_size (jeden WriteBatch na partię);
+    zdjęcia z podkolekcji przepełnienia są dołączane przed migracją, a zapis
+    przechodzi przez write_with_budget (updated_at, budżet rozmiaru).
+    Punkt kontrolny (ostatnie ID w kolekcji) zapisywany jest w tym samym batchu,
+    więc przerwana migracja wznawia się od pierwszej nieprzetworzonej partii.
+    progress_callback(kolekcja, statystyki) wywoływany jest po każdej partii.
+    Zwraca statystyki: {'documents', 'images', 'bytes'}.
     """
-    try:
-        # Dodaj metadane dla etapu pomiarów
-        dane_formularza["data_utworzenia"] = datetime.now()
-        dane_formularza["etap_formularza"] = "pomiary"
-        dane_formularza["wypelnil_monter"] = True
-        dane_formularza["data_pomiary"] = datetime.now()
-        dane_formularza["monter_id"] = monter_id
-        dane_formularza["kod_dostepu"] = generate_access_code()
-        dane_formularza["status"] = "pomiary_wykonane"
-        
-        # Zapisz do odpowiedniej kolekcji
-        doc_ref = db.collection(collection_name).add(dane_formularza)
-        document_id = doc_ref[1].id
-        
-        print(f"✅ Zapisano pomiary {collection_name} z ID: {document_id}")
-        return document_id, dane_formularza["kod_dostepu"]
-        
-    except Exception as e:
-        print(f"❌ Błąd podczas zapisywania pomiarów {collection_name}: {e}")
-        return None, None
+    store = store or get_image_store()
+    collections = collections or IMAGE_COLLECTIONS
+    checkpoint_ref = db.collection(MIGRATION_COLLECTION).document(IMAGE_MIGRATION_CHECKPOINT)
+    snap = call_firestore('read', checkpoint_ref.get)
+    checkpoint = {} if restart or not snap.exists else (snap.to_dict() or {})
+    stats = {'documents': 0, 'images': 0, 'bytes': 0}
 
-def complete_form_by_seller(db, collection_name, doc_id, dane_sprzedawcy, sprzedawca_id):
+    for collection_name in collections:
+        last_id = checkpoint.get(collection_name)
+        if last_id == MIGRATION_DONE:
+            continue
+
+        while True:
+            query = (db.collection(collection_name)
+                     .order_by(FieldPath.document_id())
+                     .limit(batch_size))
+            if last_id:
+                query = query.start_after({'__name__': last_id})
+            docs = call_firestore('query', query.get)
+            if not docs:
+                break
+
+            batch = db.batch()
+            for doc in docs:
+                raw = doc.to_dict() or {}
+                data = reassemble_document(doc.reference, raw) if 'zdjecia' in (raw.get(OVERFLOW_FIELD) or []) else raw
+                images = data.get('zdjecia') or []
+                if not any(needs_migration(img) for img in images) and (
+                        not images or IMAGE_IDS_FIELD in raw):
+                    continue
+                new_images = []
+                for img in images:
+                    if needs_migration(img):
+                        ref = externalize_image(img, store)
+                        stats['images'] += 1
+                        stats['bytes'] += ref['rozmiar']
+                        new_images.append(ref)
+                    else:
+                        new_images.append(img)
+                write_with_budget(db, doc.reference, {'zdjecia': new_images}, existing=raw, writer=batch)
+                stats['documents'] += 1
+
+            last_id = docs[-1].id
+            batch.set(checkpoint_ref, {collection_name: last_id}, merge=True)
+            call_firestore('write', batch.commit)
+            if progress_callback:
+                progress_callback(collection_name, stats)
+
+        call_firestore('write', checkpoint_ref.set, {collection_name: MIGRATION_DONE}, merge=True)
+        invalidate_collection_cache(collection_name)
+
+    return stats
+
+# ============================================================================
+# CACHE KOLEKCJI (repozytorium odczytów)
+# ============================================================================
+
+# Czas życia wpisu w cache (sekundy). Zapisy przez funkcje tego modułu
+# unieważniają cache natychmiast, TTL chroni przed zmianami z zewnątrz.
+CACHE_TTL_SECONDS = 60
+
+_cache_lock = threading.Lock()
+_count_cache = {}  # nazwa kolekcji -> (czas pobrania, liczniki)
+_cache_generation = {}  # nazwa kolekcji -> licznik unieważnień
+_cache_stats = {"hits": 0, "misses": 0, "invalidations": 0, "mirror_hits": 0, "stale_hits": 0}
+
+def _records_from_docs(docs):
+    records = []
+    for doc in docs:
+        data = doc.to_dict()
+        data['id'] = doc.id
+        records.append(data)
+    return records
+
+def _cache_get(cache, collection_name):
+    """Zwraca (wartość lub None, generacja) z cache bez pobierania danych"""
+    now = time.monotonic()
+    with _cache_lock:
+        entry = cache.get(collection_name)
+        if entry and now - entry[0] < CACHE_TTL_SECONDS:
+            _cache_stats["hits"] += 1
+            return entry[1], None
+        _cache_stats["misses"] += 1
+        return None, (now, _cache_generation.get(collection_name, 0))
+
+def _cache_get_stale(cache, collection_name):
+    """Wpis z cache niezależnie od TTL (gdy baza jest niedostępna) albo None"""
+    with _cache_lock:
+        entry = cache.get(collection_name)
+        if entry is None:
+            return None
+        _cache_stats["stale_hits"] += 1
+        return entry[1]
+
+def _warn_stale(collection_name):
+    st.warning(f"⚠️ Baza danych nie odpowiada – {collection_name}: wyświetlane są ostatnio pobrane dane")
+
+def _cache_put(cache, collection_name, token, value):
+    """Zapisuje wynik, jeśli w trakcie pobierania nie nastąpił zapis do kolekcji"""
+    fetched_at, generation = token
+    with _cache_lock:
+        if _cache_generation.get(collection_name, 0) == generation:
+            cache[collection_name] = (fetched_at, value)
+
+def invalidate_collection_cache(collection_name=None):
+    """Unieważnia cache jednej kolekcji (lub wszystkich, gdy collection_name=None)"""
+    with _cache_lock:
+        names = set(_count_cache) | set(_cache_generation) if collection_name is None else [collection_name]
+        for name in names:
+            _count_cache.pop(name, None)
+            _cache_generation[name] = _cache_generation.get(name, 0) + 1
+            # Mirror musi najpierw odebrać snapshot z tym zapisem
+            _local_write_times[name] = time.monotonic()
+        _cache_stats["invalidations"] += 1
+
+def get_cache_stats():
+    """Zwraca statystyki cache kolekcji (do wyświetlenia w panelu administratora)"""
+    now = time.monotonic()
+    with _cache_lock:
+        stats = dict(_cache_stats)
+        stats["collections"] = {
+            name: {"records": counts['total'], "age_s": round(now - ts, 1)}
+            for name, (ts, counts) in _count_cache.items()
+        }
+    stats["ttl_s"] = CACHE_TTL_SECONDS
+    stats["mirror"] = {}
+    if MIRROR_ENABLED:
+        try:
+            mirrors = get_collection_mirrors(setup_database())
+            stats["mirror"] = {name: mirror.stats() for name, mirror in mirrors.items()}
+        except Exception:
+            pass
+    return stats
+
+# ============================================================================
+# MIRROR KOLEKCJI (listenery on_snapshot)
+# ============================================================================
+
+# Kolekcje utrzymywane w pamięci procesu przez listenery Firestore.
+# Jeden zestaw listenerów obsługuje wszystkie sesje Streamlit (st.cache_resource),
+# więc każdą zmianę w bazie odbieramy raz, a nie przy każdym kliknięciu.
+MIRRORED_COLLECTIONS = ['drzwi', 'podlogi', 'drzwi_wejsciowe', 'wymiary_draft']
+MIRROR_ENABLED = os.environ.get('FIRESTORE_MIRROR', '1') != '0'
+# Pola spoza projekcji "summary" potrzebne do filtrowania w pamięci
+MIRROR_EXTRA_FIELDS = ['wypelnil_monter']
+# Czas oczekiwania na pierwszy snapshot i na snapshot po własnym zapisie (s)
+MIRROR_READY_TIMEOUT = 5
+MIRROR_SETTLE_TIMEOUT = 1
+# Snapshot mirrorów na dysku – szybki start po restarcie ('0' wyłącza)
+SNAPSHOT_CACHE_ENABLED = os.environ.get('SNAPSHOT_CACHE', '1') != '0'
+
+_local_write_times = {}  # nazwa kolekcji -> czas ostatniego zapisu z tego procesu
+
+class CollectionMirror:
     """
-    Uzupełnia formularz danymi od sprzedawcy
+    Kopia kolekcji (projekcja "summary") w pamięci, aktualizowana przez on_snapshot.
+    Ze snapshotem na dysku (snapshot_store) mirror jest gotowy od razu po starcie,
+    a listenery pobierają tylko dokumenty i usunięcia od zapisanego watermarku.
     """
-    try:
-        # Aktualizuj dokument o dane sprzedawcy
-        update_data = dane_sprzedawcy.copy()
-        update_data.update({
-            "wypelnil_sprzedawca": True,
-            "data_sprzedaz": datetime.now(),
-            "sprzedawca_id": sprzedawca_id,
-            "etap_formularza": "kompletny",
-            "status": "aktywny"
-        })
-        
-        db.collection(collection_name).document(doc_id).update(update_data)
-        
-        print(f"✅ Formularz {collection_name} został ukończony przez sprzedawcę")
+
+    def __init__(self, db, collection_name, snapshot_store=None):
+        self.collection_name = collection_name
+        self._db = db
+        self._fields = summary_fields(collection_name) + MIRROR_EXTRA_FIELDS
+        self._snapshot_store = snapshot_store
+        self._records = {}
+        self._condition = threading.Condition()
+        self._ready = False
+        self._watch = None
+        self._tombstone_watch = None
+        self._loader = None
+        # Czas odczytu ostatniego snapshotu każdego listenera (watermark na dysk)
+        self._read_times = {}
+        self.source = None  # 'dysk' albo 'firestore'
+        self.last_snapshot = None  # time.monotonic() ostatniego snapshotu
+        self.snapshots = 0
+        self.start()
+
+    def start(self):
+        """
+        Rejestruje listener. Bez snapshotu na dysku pierwszy snapshot zawiera
+        całą kolekcję; ze snapshotem rekordy wczytywane są z dysku w tle,
+        a listenery pobierają tylko zmiany od jego watermarku.
+        """
+        with self._condition:
+            self._records = {}
+            self._ready = False
+            self._read_times = {}
+            self.source = None
+        if self._snapshot_store is None:
+            self._listen(None)
+            return
+        self._loader = threading.Thread(target=self._load_snapshot, daemon=True,
+                                        name=f"snapshot-{self.collection_name}")
+        self._loader.start()
+
+    def _load_snapshot(self):
+        started = time.perf_counter()
+        records, watermark = None, None
+        try:
+            records, watermark = self._snapshot_store.load(self.collection_name, self._fields)
+        except Exception as e:
+            print(f"⚠️ Snapshot {self.collection_name} nieczytelny: {e}")
+        if records is None or watermark is None:
+            self._listen(None)
+            return
+        with self._condition:
+            self._records = records
+            self._ready = True
+            self._read_times = {'docs': watermark, 'tombstones': watermark}
+            self.last_snapshot = time.monotonic()
+            self._condition.notify_all()
+        _record_startup_phase(f'snapshot {self.collection_name} z dysku', started)
+        self._listen(watermark)
+
+    def _listen(self, watermark):
+        """Listener całej kolekcji (watermark=None) albo zmian od watermarku"""
+        self.source = 'firestore' if watermark is None else 'dysk'
+        query = self._db.collection(self.collection_name)
+        if watermark is not None:
+            query = query.where(filter=firestore.FieldFilter(UPDATED_AT_FIELD, '>=', watermark))
+            # Usunięcia dokumentów spoza zapytania widać tylko w znacznikach usunięć
+            self._tombstone_watch = (
+                self._db.collection(DELETIONS_COLLECTION)
+                .where(filter=firestore.FieldFilter('collection', '==', self.collection_name))
+                .where(filter=firestore.FieldFilter(UPDATED_AT_FIELD, '>=', watermark))
+                .on_snapshot(self._on_tombstones))
+        self._watch = query.on_snapshot(self._on_snapshot)
+
+    def stop(self):
+        for watch in (self._watch, self._tombstone_watch):
+            if watch is not None:
+                watch.unsubscribe()
+        self._watch = self._tombstone_watch = None
+
+    @property
+    def is_active(self):
+        if self._loader is not None and self._loader.is_alive():
+            return True
+        return (self._watch is not None and self._watch.is_active
+                and (self._tombstone_watch is None or self._tombstone_watch.is_active))
+
+    def _summary(self, snap):
+        data = snap.to_dict() or {}
+        record = {k: data[k] for k in self._fields if k in data}
+        record['id'] = snap.id
+        return record
+
+    def _on_snapshot(self, docs, changes, read_time):
+        # Wywoływane w wątku listenera Firestore
+        upserts, deleted = {}, []
+        with self._condition:
+            full = not self._ready
+            for change in changes:
+                if change.type.name == 'REMOVED':
+                    self._records.pop(change.document.id, None)
+                    deleted.append(change.document.id)
+                else:
+                    record = self._summary(change.document)
+                    self._records[change.document.id] = record
+                    upserts[change.document.id] = record
+            self._ready = True
+            self.last_snapshot = time.monotonic()
+            self.snapshots += 1
+            self._read_times['docs'] = read_time
+            if full:
+                upserts = dict(self._records)
+            self._condition.notify_all()
+        self._persist(upserts, deleted, full=full)
+
+    def _on_tombstones(self, docs, changes, read_time):
+        deleted = []
+        with self._condition:
+            for change in changes:
+                if change.type.name == 'REMOVED':
+                    continue
+                tombstone = change.document.to_dict() or {}
+                doc_id = tombstone.get('doc_id')
+                record = self._records.get(doc_id)
+                # Dokument utworzony ponownie po usunięciu ma nowszy updated_at
+                if record is not None and _not_newer(record.get(UPDATED_AT_FIELD), tombstone.get(UPDATED_AT_FIELD)):
+                    del self._records[doc_id]
+                    deleted.append(doc_id)
+            self._read_times['tombstones'] = read_time
+            if deleted:
+                self.last_snapshot = time.monotonic()
+                self._condition.notify_all()
+        self._persist({}, deleted)
+
+    def _persist(self, upserts, deleted, full=False):
+        """Zapisuje zmiany do snapshotu na dysku (w wątku listenera)"""
+        if self._snapshot_store is None:
+            return
+        with self._condition:
+            read_times = [t for t in self._read_times.values() if t is not None]
+            # Obie kolejki muszą dojść do watermarku, inaczej restart zgubiłby zmiany
+            watermark = min(read_times) if read_times else None
+        if watermark is None:
+            return
+        try:
+            if full:
+                self._snapshot_store.save(self.collection_name, upserts, watermark, self._fields)
+            else:
+                self._snapshot_store.apply(self.collection_name, upserts, deleted, watermark, self._fields)
+        except Exception as e:
+            print(f"⚠️ Nie udało się zapisać snapshotu {self.collection_name}: {e}")
+
+    def records(self, written_after=None):
+        """
+        Zwraca kopie rekordów lub None, gdy mirror nie nadąża (brak pierwszego
+        snapshotu albo brak snapshotu po zapisie z written_after) – wtedy
+        wywołujący odczytuje dane bezpośrednio z Firestore.
+        """
+        if not self.is_active:
+            self.stop()
+            self.start()
+        with self._condition:
+            self._condition.wait_for(lambda: self._ready, timeout=MIRROR_READY_TIMEOUT)
+            if written_after is not None:
+                self._condition.wait_for(
+                    lambda: self.last_snapshot is not None and self.last_snapshot >= written_after,
+                    timeout=MIRROR_SETTLE_TIMEOUT)
+                if self.last_snapshot is None or self.last_snapshot < written_after:
+                    return None
+            if not self._ready:
+                return None
+            return [dict(r) for r in self._records.values()]
+
+    def stats(self):
+        with self._condition:
+            return {
+                "records": len(self._records),
+                "ready": self._ready,
+                "active": self.is_active,
+                "source": self.source,
+                "snapshots": self.snapshots,
+                "age_s": round(time.monotonic() - self.last_snapshot, 1) if self.last_snapshot else None,
+            }
+
+def _not_newer(value, reference):
+    """Czy znacznik value nie jest późniejszy niż reference (brak znacznika = starszy)"""
+    if value is None or reference is None:
         return True
-        
-    except Exception as e:
-        print(f"❌ Błąd podczas uzupełniania formularza: {e}")
-        return False
+    return value <= reference
 
-def get_form_by_access_code(db, collection_name, kod_dostepu):
-    """
-    Pobiera formularz na podstawie kodu dostępu
-    """
+@st.cache_resource
+def get_snapshot_store():
+    """Snapshot mirrorów na dysku albo None, gdy wyłączony lub niedostępny"""
+    if not SNAPSHOT_CACHE_ENABLED:
+        return None
     try:
-        docs = db.collection(collection_name).where(filter=firestore.FieldFilter('kod_dostepu', '==', kod_dostepu)).limit(1).get()
-        
-        if docs:
-            doc = docs[0]
-            data = doc.to_dict()
-            data['id'] = doc.id
-            return data
-        else:
-            return None
-            
+        return open_snapshot_store()
     except Exception as e:
-        st.error(f"Błąd podczas wyszukiwania formularza: {e}")
+        print(f"⚠️ Snapshot na dysku niedostępny: {e}")
         return None
 
-def get_forms_for_completion(db, collection_name):
+@st.cache_resource
+def get_collection_mirrors(_db):
+    """Listenery kolekcji – jeden zestaw na proces, współdzielony przez sesje"""
+    started = time.perf_counter()
+    store = get_snapshot_store()
+    mirrors = {name: CollectionMirror(_db, name, store) for name in MIRRORED_COLLECTIONS}
+    _record_startup_phase('mirror kolekcji', started)
+    return mirrors
+
+def start_collection_mirrors(db):
     """
-    Pobiera formularze gotowe do uzupełnienia przez sprzedawcę
-    Używa prostszego zapytania aby uniknąć problemów z indeksami
+    Uruchamia mirrory przy starcie procesu, zanim pierwsze strony zaczną
+    czytać kolekcje – ze snapshotem na dysku są gotowe w milisekundach.
     """
+    if db is None or not MIRROR_ENABLED:
+        return None
     try:
-        # Najpierw pobierz wszystkie dokumenty gdzie monter wypełnił
-        docs = db.collection(collection_name).where(filter=firestore.FieldFilter('wypelnil_monter', '==', True)).get()
-        
-        forms_list = []
-        for doc in docs:
-            data = doc.to_dict()
-            # Filtruj tylko te w etapie pomiarów
-            if data.get('etap_formularza') == 'pomiary':
-                data['id'] = doc.id
-                forms_list.append(data)
-        
-        # Sortuj według daty (najnowsze pierwsze)
-        forms_list.sort(key=lambda x: x.get('data_utworzenia', datetime.min), reverse=True)
-        return forms_list
-        
+        return get_collection_mirrors(db)
     except Exception as e:
-        st.error(f"Błąd podczas pobierania formularzy do uzupełnienia: {e}")
-        return []
+        print(f"⚠️ Nie udało się uruchomić mirrorów: {e}")
+        return None
 
-def get_document_by_id(db, collection_name, doc_id):
-    """
-    Pobiera pojedynczy dokument z bazy danych po ID
-    """
+def _mirror_records(db, collection_name):
+    """Rekordy kolekcji z mirrora albo None, gdy mirror jest niedostępny"""
+    if not MIRROR_ENABLED or collection_name not in MIRRORED_COLLECTIONS:
+        return None
     try:
-        doc_ref = db.collection(collection_name).document(doc_id)
-        doc = doc_ref.get()
-        
-        if doc.exists:
-            data = doc.to_dict()
-            data['id'] = doc.id
-            return data
-        else:
-            return None
-            
+        mirror = get_collection_mirrors(db)[collection_name]
+        records = mirror.records(written_after=_local_write_times.get(collection_name))
     except Exception as e:
-        st.error(f"Błąd podczas pobierania dokumentu: {e}")
+        print(f"⚠️ Mirror {collection_name} niedostępny: {e}")
         return None
+    if records is None:
+        # Snapshot z zapisem mógł dotrzeć przed oznaczeniem zapisu – ten odczyt
+        # idzie do Firestore, kolejne znów korzystają z mirrora
+        _local_write_times.pop(collection_name, None)
+    else:
+        with _cache_lock:
+            _cache_stats["mirror_hits"] += 1
+    return records
 
-def update_document(db, collection_name, doc_id, updated_data):
+def _sorted_desc(records, order_field):
+    """Sortuje malejąco po (order_field, id); pomija rekordy bez pola (jak order_by)"""
+    records = [r for r in records if r.get(order_field) is not None]
+    records.sort(key=lambda r: (r[order_field], r['id']), reverse=True)
+    return records
+
+# ============================================================================
+# STRONICOWANIE (keyset pagination)
+# ============================================================================
+
+DEFAULT_PAGE_SIZE = 25
+PAGE_SIZE_OPTIONS = [10, 25, 50, 100]
+
+def get_records_page(db, collection_name, page_size=DEFAULT_PAGE_SIZE, cursor=None,
+                     order_field='data_utworzenia', date_from=None, date_to=None, summary=True):
+    """
+    Pobiera jedną stronę rekordów posortowanych malejąco po (order_field, id).
+    cursor to para (wartość order_field, id) ostatniego rekordu poprzedniej strony.
+    Domyślnie zwraca projekcję "summary" (summary=False pobiera pełne dokumenty).
+    Zwraca (rekordy, kursor następnej strony); kursor jest None na ostatniej stronie.
+    """
+    return get_pages_for_collections(db, [collection_name], page_size, cursor, order_field,
+                                     date_from, date_to, summary)[collection_name]
+
+def _page_query(client, collection_name, page_size, cursor, order_field, date_from, date_to, summary):
+    """Zapytanie o stronę (dla Client i AsyncClient – API budowania zapytań jest wspólne)"""
+    query = client.collection(collection_name)
+    if summary:
+        fields = summary_fields(collection_name)
+        query = query.select(fields if order_field in fields else fields + [order_field])
+    if date_from is not None:
+        query = query.where(filter=firestore.FieldFilter(order_field, '>=', date_from))
+    if date_to is not None:
+        query = query.where(filter=firestore.FieldFilter(order_field, '<=', date_to))
+    query = (query
+             .order_by(order_field, direction=firestore.Query.DESCENDING)
+             .order_by(FieldPath.document_id(), direction=firestore.Query.DESCENDING))
+    if cursor is not None:
+        query = query.start_after({order_field: cursor[0], '__name__': cursor[1]})
+    # Pobierz o jeden rekord więcej, aby wiedzieć czy istnieje następna strona
+    return query.limit(page_size + 1)
+
+def _fetch_page(db, collection_name, page_size=DEFAULT_PAGE_SIZE, cursor=None,
+                order_field='data_utworzenia', date_from=None, date_to=None, summary=True):
+    query = _page_query(db, collection_name, page_size, cursor, order_field, date_from, date_to, summary)
+    return _page_result(call_firestore('query', query.get), page_size, order_field)
+
+def _page_result(docs, page_size, order_field):
+    """(rekordy, kursor następnej strony) z wyniku _page_query"""
+    records = _records_from_docs(docs)
+    next_cursor = None
+    if len(records) > page_size:
+        records = records[:page_size]
+        last = records[-1]
+        next_cursor = (last.get(order_field), last['id'])
+    return records, next_cursor
+
+def _page_from_records(records, page_size, cursor, order_field, date_from, date_to):
+    """Strona rekordów z pamięci – ta sama semantyka co zapytanie w get_records_page"""
+    if date_from is not None:
+        records = [r for r in records if r.get(order_field) is not None and r[order_field] >= date_from]
+    if date_to is not None:
+        records = [r for r in records if r.get(order_field) is not None and r[order_field] <= date_to]
+    records = _sorted_desc(records, order_field)
+    if cursor is not None:
+        records = [r for r in records if (r[order_field], r['id']) < tuple(cursor)]
+    next_cursor = None
+    if len(records) > page_size:
+        records = records[:page_size]
+        last = records[-1]
+        next_cursor = (last.get(order_field), last['id'])
+    return records, next_cursor
+
+def paginated_records(key, fetch_page, reset_token=None):
+    """
+    Renderuje kontrolki stronicowania i zwraca rekordy bieżącej strony.
+    fetch_page(page_size, cursor) -> (rekordy, kursor następnej strony).
+    Stos kursorów odwiedzonych stron trzymany jest w st.session_state.
+    Zmiana reset_token (np. filtrów) wraca do pierwszej strony.
+    """
+    state_key = f"{key}_pagination"
+    state = st.session_state.get(state_key)
+    
+    col_prev, col_info, col_size, col_next = st.columns([1, 2, 1, 1])
+    with col_size:
+        page_size = st.selectbox(
+            "Na stronie:",
+            PAGE_SIZE_OPTIONS,
+            index=PAGE_SIZE_OPTIONS.index(DEFAULT_PAGE_SIZE),
+            key=f"{key}_page_size"
+        )
+    
+    if (state is None or state['page_size'] != page_size
+            or state['reset_token'] != reset_token):
+        state = {'cursors': [None], 'page': 0, 'page_size': page_size, 'reset_token': reset_token}
+        st.session_state[state_key] = state
+    
+    records, next_cursor = fetch_page(page_size, state['cursors'][state['page']])
+    
+    with col_prev:
+        if st.button("⬅️ Poprzednia", key=f"{key}_prev", disabled=state['page'] == 0):
+            state['page'] -= 1
+            st.rerun()
+    with col_info:
+        st.caption(f"Strona {state['page'] + 1} · {len(records)} rekord(ów)")
+    with col_next:
+        if st.button("Następna ➡️", key=f"{key}_next", disabled=next_cursor is None):
+            del state['cursors'][state['page'] + 1:]
+            state['cursors'].append(next_cursor)
+            state['page'] += 1
+            st.rerun()
+    
+    return records
+
+# ============================================================================
+# FOLDERY KLIENTÓW (indeks zmaterializowany)
+# ============================================================================
+
+# Jeden dokument na folder (klient + dzień pomiaru); protokół zapamiętuje
+# klucz swojego folderu w polu FOLDER_FIELD, aby przy zmianie nazwiska
+# lub daty można było go przenieść bez przeszukiwania folderów
+FOLDERS_COLLECTION = 'foldery'
+FOLDER_FIELD = 'folder'
+FOLDER_DATE_FIELD = 'data_folderu'
+FOLDER_COLLECTIONS = ['drzwi', 'drzwi_wejsciowe', 'podlogi']
+# Strefa, w której liczony jest dzień folderu (protokół z 00:30 czasu polskiego
+# należy do tego samego dnia, choć w UTC to jeszcze dzień poprzedni)
+FOLDER_TIMEZONE = ZoneInfo('Europe/Warsaw')
+# Maksymalna liczba zapytań na jedną stronę folderów przy filtrach po stronie odczytu
+FOLDER_SCAN_MAX_QUERIES = 10
+# Pola protokołu, od których zależy wpis w folderze
+_FOLDER_SOURCE_FIELDS = {'imie_nazwisko', 'nazwisko', 'data_pomiary', 'data_utworzenia', 'monter_id'}
+
+def normalize_client_name(text):
+    """Nazwa klienta bez znaków diakrytycznych, małymi literami, z '_' zamiast separatorów"""
+    if not text:
+        return "nieznany_klient"
+    norm = unicodedata.normalize('NFKD', text)
+    norm = norm.encode('ascii', 'ignore').decode('ascii')
+    norm = re.sub(r'[^a-zA-Z0-9]+', '_', norm).strip('_').lower()
+    return norm or "nieznany_klient"
+
+def _folder_date(record):
+    """
+    Data folderu: data_pomiary, a bez niej data_utworzenia (None, gdy brak),
+    w strefie FOLDER_TIMEZONE. Daty bez strefy traktowane są jak UTC – tak
+    zapisuje je Firestore, więc zapis i późniejszy odczyt dają ten sam dzień.
+    """
+    value = record.get('data_pomiary') or record.get('data_utworzenia')
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return None
+    if not isinstance(value, datetime):
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(FOLDER_TIMEZONE)
+
+def folder_day(dt):
+    """
+    Wartość FOLDER_DATE_FIELD dla daty folderu: północ UTC polskiego dnia
+    kalendarzowego (odczytana z bazy data wyświetla się jako właściwy dzień)
+    """
+    return datetime(dt.year, dt.month, dt.day, tzinfo=timezone.utc)
+
+def folder_key(record):
+    """Klucz folderu protokołu: <klient>_<dd>_<mm>_<rrrr>"""
+    name = normalize_client_name(record.get('imie_nazwisko') or record.get('nazwisko') or '')
+    dt = _folder_date(record)
+    return f"{name}_{dt.strftime('%d_%m_%Y') if dt else '00_00_0000'}"
+
+def _folder_member_id(doc_ref):
+    return f"{doc_ref.parent.id}__{doc_ref.id}"
+
+def _folder_entry(collection_name, doc_id, record):
+    """Treść dokumentu folderu z jednym członkiem (do zapisu z merge=True)"""
+    dt = _folder_date(record)
+    return {
+        'klient': record.get('imie_nazwisko') or record.get('nazwisko') or '',
+        # Dzień folderu – sortowanie i filtr zakresu dat
+        FOLDER_DATE_FIELD: folder_day(dt) if dt else None,
+        'czlonkowie': {
+            f"{collection_name}__{doc_id}": {
+                'typ': collection_name,
+                'id': doc_id,
+                'monter_id': record.get('monter_id', ''),
+                'data': dt,
+            },
+        },
+        UPDATED_AT_FIELD: firestore.SERVER_TIMESTAMP,
+    }
+
+def _remove_folder_member(writer, db, folder, doc_ref, transaction=None, **options):
+    """
+    Usuwa protokół z folderu; folder bez pozostałych członków jest usuwany.
+    W transakcji odczyt folderu należy do niej; poza transakcją usunięcie
+    folderu ma warunek niezmienionego update_time, więc równoległe dodanie
+    protokołu do folderu odrzuca zapis zamiast zgubić nowego członka.
+    """
+    folder_ref = db.collection(FOLDERS_COLLECTION).document(folder)
+    if transaction is None:
+        snap = call_firestore('read', folder_ref.get, field_paths=['czlonkowie'])
+    else:
+        snap = folder_ref.get(field_paths=['czlonkowie'], transaction=transaction, **options)
+    if not snap.exists:
+        return
+    member_id = _folder_member_id(doc_ref)
+    if not set((snap.to_dict() or {}).get('czlonkowie') or {}) - {member_id}:
+        option = None if transaction is not None else db.write_option(last_update_time=snap.update_time)
+        writer.delete(folder_ref, option=option)
+        return
+    writer.set(folder_ref, {
+        'czlonkowie': {member_id: firestore.DELETE_FIELD},
+        UPDATED_AT_FIELD: firestore.SERVER_TIMESTAMP,
+    }, merge=True)
+
+def _update_folder_index(writer, db, doc_ref, data, merged, previous_folder):
+    """
+    Dodaje do batcha/transakcji zapisu protokołu aktualizację jego folderu
+    (i usunięcie z poprzedniego, jeśli klucz się zmienił). Zapisy są
+    idempotentne (merge), więc ponowienie batcha nie psuje indeksu.
+    """
+    if doc_ref.parent.id not in FOLDER_COLLECTIONS:
+        return
+    key = folder_key(merged)
+    if key == previous_folder and not (_FOLDER_SOURCE_FIELDS & set(data)):
+        return
+    data[FOLDER_FIELD] = key
+    merged[FOLDER_FIELD] = key
+    if previous_folder and previous_folder != key:
+        _remove_folder_member(writer, db, previous_folder, doc_ref)
+    writer.set(db.collection(FOLDERS_COLLECTION).document(key),
+               _folder_entry(doc_ref.parent.id, doc_ref.id, merged), merge=True)
+
+def folder_counts(members):
+    """Liczba protokołów według typu dla wpisów członków folderu: {'drzwi': n, ...}"""
+    counts = {name: 0 for name in FOLDER_COLLECTIONS}
+    for member in members:
+        if member.get('typ') in counts:
+            counts[member['typ']] += 1
+    return counts
+
+def _filter_folder(folder, types=None, monter=None, klient=None):
+    """Folder z członkami spełniającymi filtry albo None, gdy żaden nie pasuje"""
+    if klient and klient.lower() not in str(folder.get('klient', '')).lower():
+        return None
+    members = {member_id: m for member_id, m in (folder.get('czlonkowie') or {}).items()
+               if (types is None or m.get('typ') in types)
+               and (not monter or monter.lower() in str(m.get('monter_id', '')).lower())}
+    return {**folder, 'czlonkowie': members} if members else None
+
+def get_folders_page(db, page_size=DEFAULT_PAGE_SIZE, cursor=None, date_from=None, date_to=None,
+                     types=None, monter=None, klient=None):
+    """
+    Strona folderów posortowanych malejąco po dacie (zapytanie po FOLDER_DATE_FIELD,
+    zakres dat zawężany w zapytaniu; date_from/date_to w postaci folder_day()).
+    Filtry typu, montera i klienta ("zawiera") nie mają odpowiednika w zapytaniach
+    Firestore – stosowane są do kolejnych stron zapytania, dopóki strona nie
+    zostanie zapełniona (najwyżej FOLDER_SCAN_MAX_QUERIES zapytań). 'czlonkowie'
+    zawiera tylko pasujących członków; foldery bez członków są pomijane.
+    """
+    filtered = []
+    for _ in range(FOLDER_SCAN_MAX_QUERIES):
+        folders, next_cursor = get_records_page(db, FOLDERS_COLLECTION, page_size, cursor,
+                                                order_field=FOLDER_DATE_FIELD, date_from=date_from,
+                                                date_to=date_to, summary=False)
+        for index, folder in enumerate(folders):
+            folder = _filter_folder(folder, types, monter, klient)
+            if folder is None:
+                continue
+            filtered.append(folder)
+            if len(filtered) == page_size:
+                # Kolejna strona zaczyna się za ostatnim zwróconym folderem
+                has_more = index < len(folders) - 1 or next_cursor is not None
+                return filtered, (folder.get(FOLDER_DATE_FIELD), folder['id']) if has_more else None
+        if next_cursor is None:
+            return filtered, None
+        cursor = next_cursor
+    return filtered, cursor
+
+def get_folder_members(db, members):
+    """
+    Protokoły dla wpisów członków folderu (projekcja "summary", pole '__type'
+    z nazwą kolekcji), pobierane jednym odczytem wsadowym – dopiero po otwarciu folderu
+    """
+    if not members:
+        return []
+    refs = [db.collection(m['typ']).document(m['id']) for m in members]
+    snaps = call_firestore('read', lambda **options: list(db.get_all(
+        refs, field_paths=PROTOCOL_SUMMARY_FIELDS, **options)))
+    records = []
+    for snap in snaps:
+        if not snap.exists:
+            continue
+        data = snap.to_dict() or {}
+        data['id'] = snap.id
+        data['__type'] = snap.reference.parent.id
+        records.append(data)
+    oldest = datetime.min.replace(tzinfo=timezone.utc)
+    records.sort(key=lambda r: (_folder_date(r) or oldest, r['id']), reverse=True)
+    return records
+
+def rebuild_folder_index(db, progress_callback=None):
+    """
+    Przebudowuje kolekcję folderów od zera na podstawie protokołów (pierwsze
+    wdrożenie lub naprawa) i uzupełnia w protokołach pole FOLDER_FIELD.
+    Zapisy protokołów w trakcie przebudowy mogą zostać pominięte – uruchamiać
+    przy małym ruchu. progress_callback(etap, liczba) wywoływany jest po każdym batchu.
+    Zwraca statystyki: {'protocols', 'folders', 'removed'}.
+    """
+    fields = ['imie_nazwisko', 'nazwisko', 'data_pomiary', 'data_utworzenia', 'monter_id', FOLDER_FIELD]
+    folders = {}
+    moved = []
+    for collection_name in FOLDER_COLLECTIONS:
+        docs = call_firestore('query', db.collection(collection_name).select(fields).get)
+        for doc in docs:
+            record = doc.to_dict() or {}
+            key = folder_key(record)
+            entry = _folder_entry(collection_name, doc.id, record)
+            folder = folders.setdefault(key, entry)
+            folder['czlonkowie'].update(entry['czlonkowie'])
+            if record.get(FOLDER_FIELD) != key:
+                moved.append((doc.reference, key))
+
+    existing = [ref.id for ref in call_firestore('read', lambda **options: list(
+        db.collection(FOLDERS_COLLECTION).list_documents(**options)))]
+    stale = [folder_id for folder_id in existing if folder_id not in folders]
+    operations = ([('set', db.collection(FOLDERS_COLLECTION).document(key), folder)
+                   for key, folder in folders.items()]
+                  + [('update', ref, {FOLDER_FIELD: key}) for ref, key in moved]
+                  + [('delete', db.collection(FOLDERS_COLLECTION).document(folder_id), None)
+                     for folder_id in stale])
+    for start in range(0, len(operations), BATCH_MAX_OPERATIONS):
+        batch = db.batch()
+        for kind, ref, data in operations[start:start + BATCH_MAX_OPERATIONS]:
+            if kind == 'delete':
+                batch.delete(ref)
+            else:
+                getattr(batch, kind)(ref, data)
+        call_firestore('write', batch.commit)
+        if progress_callback:
+            progress_callback('zapis', min(start + BATCH_MAX_OPERATIONS, len(operations)))
+
+    invalidate_collection_cache(FOLDERS_COLLECTION)
+    return {'protocols': sum(len(f['czlonkowie']) for f in folders.values()),
+            'folders': len(folders), 'removed': len(stale)}
+
+# ============================================================================
+# LICZNIKI (zapytania agregujące)
+# ============================================================================
+
+# Statusy protokołów w kolejności wyświetlania
+PROTOCOL_STATUSES = ['pomiary_wykonane', 'aktywny', 'zakończony', 'anulowany']
+
+def _aggregate_count(count_query):
+    """Wykonuje zapytanie COUNT po stronie serwera i zwraca liczbę dokumentów"""
+    result = call_firestore('count', count_query.get)
+    return int(result[0][0].value)
+
+def count_records(db, collection_name, status=None):
+    """
+    Zwraca liczbę dokumentów w kolekcji (opcjonalnie o danym statusie)
+    bez pobierania treści dokumentów
+    """
+    return _aggregate_count(_count_query(db, collection_name, status))
+
+def _count_query(client, collection_name, status=None):
+    query = client.collection(collection_name)
+    if status is not None:
+        query = query.where(filter=firestore.FieldFilter('status', '==', status))
+    return query.count(alias='liczba')
+
+def _empty_counts():
+    return {'total': 0, 'by_status': {s: 0 for s in PROTOCOL_STATUSES}}
+
+def _counts_from_records(records):
+    counts = _empty_counts()
+    counts['total'] = len(records)
+    for r in records:
+        if r.get('status') in counts['by_status']:
+            counts['by_status'][r['status']] += 1
+    return counts
+
+def _fetch_counts(db, collection_name):
+    """Liczniki kolekcji zapytaniami COUNT (synchronicznie)"""
+    return {
+        'total': count_records(db, collection_name),
+        'by_status': {s: count_records(db, collection_name, s) for s in PROTOCOL_STATUSES},
+    }
+
+def get_collection_counts(db, collection_name):
+    """
+    Zwraca liczniki kolekcji: {'total': n, 'by_status': {status: n, ...}}.
+    Wynik jest przechowywany w cache i unieważniany razem z cache kolekcji.
+    """
+    return get_counts_for_collections(db, [collection_name])[collection_name]
+
+# ============================================================================
+# ODCZYTY WSPÓŁBIEŻNE (AsyncClient)
+# ============================================================================
+
+# FIRESTORE_ASYNC_READS=0 wyłącza AsyncClient – kolekcje pobierane są wtedy
+# równolegle w wątkach (tak jak zawsze dla backendu SQLite)
+ASYNC_READS_ENABLED = os.environ.get('FIRESTORE_ASYNC_READS', '1') != '0'
+
+class _AsyncRunner:
+    """Pętla asyncio w osobnym wątku wraz z klientem AsyncClient"""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name='firestore-async', daemon=True).start()
+        # Kanał gRPC klienta jest związany z pętlą, w której powstał
+        self.client = self.run(self._create_client())
+
+    async def _create_client(self):
+        return firestore_async.client()
+
+    def run(self, coro):
+        """Wykonuje korutynę w pętli runnera i czeka na wynik (z dowolnego wątku)"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+_async_runner = None
+_async_runner_lock = threading.Lock()
+
+def get_async_runner():
+    """Runner AsyncClient – jeden na proces, tworzony przy pierwszym użyciu"""
+    global _async_runner
+    with _async_runner_lock:
+        if _async_runner is None:
+            _async_runner = _AsyncRunner()
+        return _async_runner
+
+async def get_records_page_async(client, collection_name, page_size=DEFAULT_PAGE_SIZE, cursor=None,
+                                 order_field='data_utworzenia', date_from=None, date_to=None, summary=True):
+    """Async: jedna strona rekordów (semantyka jak get_records_page, bez mirrora)"""
+    query = _page_query(client, collection_name, page_size, cursor, order_field, date_from, date_to, summary)
+    return _page_result(await call_firestore_async('query', query.get), page_size, order_field)
+
+async def count_records_async(client, collection_name, status=None):
+    """Async: liczba dokumentów kolekcji (opcjonalnie o danym statusie)"""
+    result = await call_firestore_async('count', _count_query(client, collection_name, status).get)
+    return int(result[0][0].value)
+
+async def get_collection_counts_async(client, collection_name):
+    """Async: liczniki kolekcji – wszystkie zapytania COUNT wysyłane naraz"""
+    total, *by_status = await asyncio.gather(
+        count_records_async(client, collection_name),
+        *(count_records_async(client, collection_name, s) for s in PROTOCOL_STATUSES))
+    return {'total': total, 'by_status': dict(zip(PROTOCOL_STATUSES, by_status))}
+
+def _fan_out(db, collection_names, fetch, fetch_async):
+    """
+    Wykonuje fetch dla każdej kolekcji współbieżnie: {nazwa: wynik lub wyjątek}.
+    Dla Firestore używa AsyncClient, dla innych backendów – puli wątków.
+    """
+    if not collection_names:
+        return {}
+    if ASYNC_READS_ENABLED and isinstance(db, firestore.Client):
+        runner = get_async_runner()
+
+        async def _gather():
+            return await asyncio.gather(
+                *(fetch_async(runner.client, name) for name in collection_names),
+                return_exceptions=True)
+        return dict(zip(collection_names, runner.run(_gather())))
+
+    def _call(name):
+        try:
+            return fetch(db, name)
+        except Exception as e:
+            return e
+    if len(collection_names) == 1:
+        return {collection_names[0]: _call(collection_names[0])}
+    with ThreadPoolExecutor(max_workers=len(collection_names)) as executor:
+        return dict(zip(collection_names, executor.map(_call, collection_names)))
+
+def get_pages_for_collections(db, collection_names, page_size=DEFAULT_PAGE_SIZE, cursor=None,
+                              order_field='data_utworzenia', date_from=None, date_to=None, summary=True):
+    """
+    Zwraca {nazwa: (rekordy, kursor następnej strony)} – strony kilku kolekcji
+    pobierane współbieżnie (semantyka jak get_records_page).
+    """
+    if db is None:
+        st.error("❌ Baza danych nie jest zainicjalizowana")
+        return {name: ([], None) for name in collection_names}
+
+    pages = {}
+    missing = []
+    for name in collection_names:
+        records = None
+        if summary and order_field in summary_fields(name):
+            records = _mirror_records(db, name)
+        if records is not None:
+            pages[name] = _page_from_records(records, page_size, cursor, order_field, date_from, date_to)
+        else:
+            missing.append(name)
+
+    options = dict(page_size=page_size, cursor=cursor, order_field=order_field,
+                   date_from=date_from, date_to=date_to, summary=summary)
+    fetched = _fan_out(
+        db, missing,
+        lambda client, name: _fetch_page(client, name, **options),
+        lambda client, name: get_records_page_async(client, name, **options))
+    for name, page in fetched.items():
+        if isinstance(page, Exception):
+            st.error(f"Błąd podczas pobierania strony {name}: {page}")
+            page = ([], None)
+        pages[name] = page
+    return pages
+
+def get_counts_for_collections(db, collection_names):
+    """
+    Zwraca {nazwa: {'total': n, 'by_status': {...}}} dla kilku kolekcji.
+    Zapytania COUNT wszystkich kolekcji wykonywane są współbieżnie.
+    """
+    if db is None:
+        st.error("❌ Baza danych nie jest zainicjalizowana")
+        return {name: _empty_counts() for name in collection_names}
+
+    result, tokens = {}, {}
+    for name in collection_names:
+        records = _mirror_records(db, name)
+        if records is not None:
+            result[name] = _counts_from_records(records)
+            continue
+        counts, token = _cache_get(_count_cache, name)
+        if counts is not None:
+            result[name] = {'total': counts['total'], 'by_status': dict(counts['by_status'])}
+        else:
+            tokens[name] = token
+
+    fetched = _fan_out(db, list(tokens), _fetch_counts, get_collection_counts_async)
+    for name, counts in fetched.items():
+        if isinstance(counts, Exception):
+            stale = _cache_get_stale(_count_cache, name) if is_backend_degraded(counts) else None
+            if stale is not None:
+                _warn_stale(name)
+                result[name] = {'total': stale['total'], 'by_status': dict(stale['by_status'])}
+            else:
+                st.error(f"Błąd podczas liczenia rekordów {name}: {counts}")
+                result[name] = _empty_counts()
+            continue
+        _cache_put(_count_cache, name, tokens[name], counts)
+        result[name] = {'total': counts['total'], 'by_status': dict(counts['by_status'])}
+    return result
+
+def update_record_status(db, collection_name, doc_id, new_status):
+    """
+    Aktualizuje status rekordu (aktywny, zakończony, anulowany)
+    """
+    try:
+        call_firestore('write', db.collection(collection_name).document(doc_id).update, {
+            'status': new_status,
+            'data_modyfikacji': datetime.now(),
+            UPDATED_AT_FIELD: firestore.SERVER_TIMESTAMP,
+        })
+        invalidate_collection_cache(collection_name)
+        return True
+    except Exception as e:
+        st.error(f"Błąd podczas aktualizacji statusu: {e}")
+        return False
+
+def delete_record(db, collection_name, doc_id):
+    """
+    Usuwa rekord z bazy danych
+    """
+    try:
+        doc_ref = db.collection(collection_name).document(doc_id)
+        current = call_firestore('read', doc_ref.get, field_paths=['kod_dostepu', FOLDER_FIELD]).to_dict() or {}
+        kod = current.get('kod_dostepu')
+        index_refs = [db.collection(ACCESS_CODE_INDEX).document(kod)] if kod else []
+        delete_with_overflow(db, doc_ref, also_delete=index_refs, folder=current.get(FOLDER_FIELD))
+        invalidate_collection_cache(collection_name)
+        return True
+    except Exception as e:
+        st.error(f"Błąd podczas usuwania rekordu: {e}")
+        return False
+
+
+
+# Indeks kodów dostępu: kody_dostepu/{kod} -> {collection, doc_id}.
+# Zapisywany w tej samej transakcji co protokół, więc kod jest unikalny
+# we wszystkich kolekcjach, a wyszukiwanie to jeden odczyt punktowy.
+ACCESS_CODE_INDEX = 'kody_dostepu'
+ACCESS_CODE_ATTEMPTS = 5
+
+def generate_access_code():
+    """Generuje losowy kod dostępu (unikalność zapewnia _reserve_access_code)"""
+    return ''.join(secrets.choice(string.ascii_uppercase + string.digits) for _ in range(8))
+
+def _reserve_access_code(db, transaction, **options):
+    """
+    Losuje kod nieobecny w indeksie. Odczyt odbywa się w transakcji, więc
+    równoległe zajęcie tego samego kodu przerywa commit i ponawia transakcję.
+    options – timeout/retry z call_firestore wywołującego transakcję.
+    """
+    for _ in range(ACCESS_CODE_ATTEMPTS):
+        kod = generate_access_code()
+        if not db.collection(ACCESS_CODE_INDEX).document(kod).get(transaction=transaction, **options).exists:
+            return kod
+    raise RuntimeError("Nie udało się wygenerować unikalnego kodu dostępu")
+
+def _index_access_code(writer, db, kod, collection_name, doc_id):
+    """Dodaje wpis indeksu kodu dostępu (create – nie nadpisuje cudzego kodu)"""
+    writer.create(db.collection(ACCESS_CODE_INDEX).document(kod), {
+        'collection': collection_name,
+        'doc_id': doc_id,
+        'data_utworzenia': datetime.now(),
+    })
+
+def _add_pomiary_metadata(dane_formularza, monter_id, kod_dostepu=None):
+    """Uzupełnia dane formularza o metadane etapu pomiarów (w miejscu)"""
+    now = datetime.now()
+    dane_formularza["data_utworzenia"] = now
+    dane_formularza["etap_formularza"] = "pomiary"
+    dane_formularza["wypelnil_monter"] = True
+    dane_formularza["data_pomiary"] = now
+    dane_formularza["monter_id"] = monter_id
+    dane_formularza["kod_dostepu"] = kod_dostepu or generate_access_code()
+    dane_formularza["status"] = "pomiary_wykonane"
+    return dane_formularza
+
+@firestore.transactional
+def _save_pomiary_transaction(transaction, db, doc_ref, dane_formularza, monter_id, **options):
+    """Zapis protokołu i wpisu indeksu kodu dostępu w jednej transakcji"""
+    kod = _reserve_access_code(db, transaction, **options)
+    _add_pomiary_metadata(dane_formularza, monter_id, kod)
+    write_with_budget(db, doc_ref, dane_formularza, writer=transaction)
+    _index_access_code(transaction, db, kod, doc_ref.parent.id, doc_ref.id)
+    return kod
+
+def save_pomiary_data(db, collection_name, dane_formularza, monter_id):
+    """
+    Zapisuje część formularza wypełnioną przez montera (pomiary)
+    """
+    try:
+        # Zapisz do odpowiedniej kolekcji (z kontrolą rozmiaru dokumentu)
+        # razem z unikalnym kodem dostępu w indeksie
+        doc_ref = db.collection(collection_name).document()
+        # Nowa transakcja przy każdej próbie; bez ponowień – po niejednoznacznym
+        # błędzie commitu ponowienie zarezerwowałoby drugi kod dla tego samego dokumentu
+        kod = call_firestore('write', lambda **options: _save_pomiary_transaction(
+            db.transaction(), db, doc_ref, dane_formularza, monter_id, **options), idempotent=False)
+        document_id = doc_ref.id
+        invalidate_collection_cache(collection_name)
+        
+        print(f"✅ Zapisano pomiary {collection_name} z ID: {document_id}")
+        return document_id, kod
+        
+    except DocumentTooLargeError as e:
+        st.error(f"❌ {e}")
+        return None, None
+    except Exception as e:
+        print(f"❌ Błąd podczas zapisywania pomiarów {collection_name}: {e}")
+        return None, None
+
+def complete_form_by_seller(db, collection_name, doc_id, dane_sprzedawcy, sprzedawca_id):
+    """
+    Uzupełnia formularz danymi od sprzedawcy
+    """
+    try:
+        # Aktualizuj dokument o dane sprzedawcy
+        update_data = dane_sprzedawcy.copy()
+        update_data.update({
+            "wypelnil_sprzedawca": True,
+            "data_sprzedaz": datetime.now(),
+            "sprzedawca_id": sprzedawca_id,
+            "etap_formularza": "kompletny",
+            "status": "aktywny"
+        })
+        
+        doc_ref = db.collection(collection_name).document(doc_id)
+        existing = call_firestore('read', doc_ref.get).to_dict() or {}
+        write_with_budget(db, doc_ref, update_data, existing=existing)
+        invalidate_collection_cache(collection_name)
+        
+        print(f"✅ Formularz {collection_name} został ukończony przez sprzedawcę")
+        return True
+        
+    except DocumentTooLargeError as e:
+        st.error(f"❌ {e}")
+        return False
+    except Exception as e:
+        print(f"❌ Błąd podczas uzupełniania formularza: {e}")
+        return False
+
+def find_form_by_access_code(db, kod_dostepu):
+    """
+    Wyszukuje formularz po kodzie dostępu we wszystkich typach protokołów
+    (odczyt punktowy indeksu + dokumentu). Zwraca dane z polem '__type'
+    (nazwa kolekcji) lub None.
+    """
+    kod = (kod_dostepu or '').strip().upper()
+    if not kod:
+        return None
+    try:
+        entry = call_firestore('read', db.collection(ACCESS_CODE_INDEX).document(kod).get)
+        if entry.exists:
+            target = entry.to_dict()
+            doc_ref = db.collection(target['collection']).document(target['doc_id'])
+            doc = call_firestore('read', doc_ref.get)
+            if doc.exists:
+                data = reassemble_document(doc_ref, doc.to_dict())
+                data['id'] = doc.id
+                data['__type'] = target['collection']
+                return data
+
+        # Protokoły sprzed indeksu – zapytanie po kolekcjach i uzupełnienie indeksu
+        for collection_name in ['drzwi', 'drzwi_wejsciowe', 'podlogi']:
+            docs = call_firestore('query', db.collection(collection_name)
+                                  .where(filter=firestore.FieldFilter('kod_dostepu', '==', kod))
+                                  .limit(1).get)
+            if docs:
+                doc = docs[0]
+                call_firestore('write', db.collection(ACCESS_CODE_INDEX).document(kod).set, {
+                    'collection': collection_name,
+                    'doc_id': doc.id,
+                    'data_utworzenia': datetime.now(),
+                })
+                data = reassemble_document(doc.reference, doc.to_dict())
+                data['id'] = doc.id
+                data['__type'] = collection_name
+                return data
+        return None
+
+    except Exception as e:
+        st.error(f"Błąd podczas wyszukiwania formularza: {e}")
+        return None
+
+def get_form_by_access_code(db, collection_name, kod_dostepu):
+    """
+    Pobiera formularz na podstawie kodu dostępu (tylko z podanej kolekcji)
+    """
+    form = find_form_by_access_code(db, kod_dostepu)
+    if form and form['__type'] == collection_name:
+        return form
+    return None
+
+# Limit listy formularzy oczekujących na sprzedawcę (najnowsze pierwsze)
+FORMS_FOR_COMPLETION_LIMIT = 200
+
+def _forms_for_completion_indexed(db, collection_name, limit):
+    """
+    Filtrowanie i sortowanie po stronie serwera – wymaga indeksu złożonego
+    (wypelnil_monter, etap_formularza, data_utworzenia DESC) z firestore.indexes.json
+    """
+    return call_firestore('query', db.collection(collection_name)
+                          .where(filter=firestore.FieldFilter('wypelnil_monter', '==', True))
+                          .where(filter=firestore.FieldFilter('etap_formularza', '==', 'pomiary'))
+                          .select(summary_fields(collection_name))
+                          .order_by('data_utworzenia', direction=firestore.Query.DESCENDING)
+                          .limit(limit)
+                          .get)
+
+def _forms_for_completion_unindexed(db, collection_name, limit):
+    """Zapytanie bez indeksu złożonego (gdy indeks jeszcze się buduje)"""
+    docs = call_firestore('query', db.collection(collection_name)
+                          .where(filter=firestore.FieldFilter('etap_formularza', '==', 'pomiary'))
+                          .select(summary_fields(collection_name) + ['wypelnil_monter'])
+                          .get)
+    docs = [d for d in docs if d.to_dict().get('wypelnil_monter') is True]
+    # Daty z Firestore mają strefę czasową – wartownik też musi ją mieć
+    oldest = datetime.min.replace(tzinfo=timezone.utc)
+    docs.sort(key=lambda d: d.to_dict().get('data_utworzenia') or oldest, reverse=True)
+    return docs[:limit]
+
+def get_forms_for_completion(db, collection_name, limit=FORMS_FOR_COMPLETION_LIMIT):
+    """
+    Pobiera formularze gotowe do uzupełnienia przez sprzedawcę (projekcja "summary"),
+    najnowsze pierwsze, maksymalnie `limit`
+    """
+    records = _mirror_records(db, collection_name)
+    if records is not None:
+        forms_list = [r for r in records
+                      if r.get('wypelnil_monter') is True and r.get('etap_formularza') == 'pomiary']
+        return _sorted_desc(forms_list, 'data_utworzenia')[:limit]
+
+    try:
+        try:
+            docs = _forms_for_completion_indexed(db, collection_name, limit)
+        except google_exceptions.FailedPrecondition as e:
+            # Brak indeksu (lub indeks w trakcie budowy) – zapytanie zastępcze
+            print(f"⚠️ Brak indeksu dla {collection_name}, używam zapytania zastępczego: {e}")
+            docs = _forms_for_completion_unindexed(db, collection_name, limit)
+        
+        forms_list = []
+        for doc in docs:
+            data = doc.to_dict()
+            data['id'] = doc.id
+            forms_list.append(data)
+        return forms_list
+        
+    except Exception as e:
+        st.error(f"Błąd podczas pobierania formularzy do uzupełnienia: {e}")
+        return []
+
+def get_document_by_id(db, collection_name, doc_id):
+    """
+    Pobiera pojedynczy dokument z bazy danych po ID
+    """
+    try:
+        doc_ref = db.collection(collection_name).document(doc_id)
+        doc = call_firestore('read', doc_ref.get)
+        
+        if doc.exists:
+            data = reassemble_document(doc_ref, doc.to_dict())
+            data['id'] = doc.id
+            return data
+        else:
+            return None
+            
+    except Exception as e:
+        st.error(f"Błąd podczas pobierania dokumentu: {e}")
+        return None
+
+def update_document(db, collection_name, doc_id, updated_data):
     """
     Aktualizuje dokument w bazie danych
     """
     try:
         doc_ref = db.collection(collection_name).document(doc_id)
-        doc_ref.update(updated_data)
+        existing = call_firestore('read', doc_ref.get).to_dict() or {}
+        write_with_budget(db, doc_ref, updated_data, existing=existing)
+        invalidate_collection_cache(collection_name)
         return True
         
     except Exception as e:
@@ -694,44 +2275,62 @@ def save_draft_data(db, collection_target, dane_formularza, monter_id):
         return None
 
     try:
-        now = datetime.now()
         dane = dane_formularza.copy()
-        dane.update({
-            "collection_target": collection_target,
-            "status": "draft",
-            "created_at": now,
-            "updated_at": now,
-            "monter_id": monter_id,
-        })
-        doc_ref = db.collection('wymiary_draft').add(dane)
-        draft_id = doc_ref[1].id
+        dane.update(_draft_metadata(collection_target, monter_id))
+        doc_ref = db.collection('wymiary_draft').document()
+        write_with_budget(db, doc_ref, dane)
+        draft_id = doc_ref.id
+        invalidate_collection_cache('wymiary_draft')
         print(f"✅ Zapisano szkic {collection_target} z ID: {draft_id}")
         return draft_id
     except Exception as e:
         st.error(f"❌ Błąd podczas zapisywania szkicu: {e}")
         return None
 
+def _draft_metadata(collection_target, monter_id):
+    """Metadane nowego szkicu"""
+    return {
+        "collection_target": collection_target,
+        "status": "draft",
+        "created_at": datetime.now(),
+        "monter_id": monter_id,
+    }
+
 def get_drafts_for_monter(db, monter_id=None):
     """
     Pobiera szkice (kwarantanna). Jeśli podano monter_id – filtruje po monterze.
+    Zwraca projekcję "summary" bez zdjęć – pełny szkic pobiera się po ID.
     """
     if db is None:
         st.error("❌ Baza danych nie jest zainicjalizowana")
         return []
 
+    records = _mirror_records(db, 'wymiary_draft')
+    if records is not None:
+        if monter_id:
+            records = [r for r in records if r.get('monter_id') == monter_id]
+        return _sorted_desc(records, 'updated_at')
+
     try:
         ref = db.collection('wymiary_draft')
         if monter_id:
             query = ref.where(filter=firestore.FieldFilter('monter_id', '==', monter_id))
         else:
             query = ref
-        docs = query.order_by('updated_at', direction=firestore.Query.DESCENDING).get()
+        query = query.select(DRAFT_SUMMARY_FIELDS)
+        try:
+            # Filtr po monterze + sortowanie wymaga indeksu (monter_id, updated_at DESC)
+            docs = call_firestore('query', query.order_by('updated_at', direction=firestore.Query.DESCENDING).get)
+            presorted = True
+        except google_exceptions.FailedPrecondition:
+            docs = call_firestore('query', query.get)
+            presorted = False
         results = []
         for doc in docs:
             data = doc.to_dict()
             data['id'] = doc.id
             results.append(data)
-        return results
+        return results if presorted else _sorted_desc(results, 'updated_at')
     except Exception as e:
         st.error(f"❌ Błąd podczas pobierania szkiców: {e}")
         return []
@@ -742,9 +2341,10 @@ def update_draft_data(db, draft_id, updates):
         st.error("❌ Baza danych nie jest zainicjalizowana")
         return False
     try:
-        updates = updates.copy()
-        updates['updated_at'] = datetime.now()
-        db.collection('wymiary_draft').document(draft_id).update(updates)
+        doc_ref = db.collection('wymiary_draft').document(draft_id)
+        existing = call_firestore('read', doc_ref.get).to_dict() or {}
+        write_with_budget(db, doc_ref, updates, existing=existing)
+        invalidate_collection_cache('wymiary_draft')
         return True
     except Exception as e:
         st.error(f"❌ Błąd podczas aktualizacji szkicu: {e}")
@@ -756,50 +2356,550 @@ def delete_draft(db, draft_id):
         st.error("❌ Baza danych nie jest zainicjalizowana")
         return False
     try:
-        db.collection('wymiary_draft').document(draft_id).delete()
+        get_draft_autosaver(db).discard(draft_id)
+        delete_with_overflow(db, db.collection('wymiary_draft').document(draft_id))
+        invalidate_collection_cache('wymiary_draft')
         return True
     except Exception as e:
         st.error(f"❌ Błąd podczas usuwania szkicu: {e}")
         return False
 
+DRAFT_TARGETS = ['drzwi', 'drzwi_wejsciowe', 'podlogi']
+
+def _draft_payload(data):
+    """Kopia szkicu bez metadanych szkicu – dane do zapisania jako pomiary"""
+    payload = data.copy()
+    for meta_key in ['collection_target', 'status', 'created_at', 'updated_at', 'id']:
+        payload.pop(meta_key, None)
+    return payload
+
+@firestore.transactional
+def _finalize_draft_transaction(transaction, db, draft_id, **options):
+    """
+    Finalizacja szkicu w transakcji. Dokument docelowy ma to samo ID co szkic,
+    więc ponowne wywołanie (retry, podwójne kliknięcie) jest tanim no-op
+    zwracającym już zapisany dokument. Zwraca (collection_name, doc_id, kod_dostepu).
+    """
+    draft_ref = db.collection('wymiary_draft').document(draft_id)
+    target_refs = [db.collection(name).document(draft_id) for name in DRAFT_TARGETS]
+    # Wszystkie odczyty przed zapisami (wymóg transakcji)
+    snap = draft_ref.get(transaction=transaction, **options)
+    targets = [t for t in db.get_all(target_refs, transaction=transaction, **options) if t.exists]
+    raw = (snap.to_dict() or {}) if snap.exists else {}
+    overflow_refs = []
+    if raw.get(OVERFLOW_FIELD):
+        overflow_snaps = list(draft_ref.collection(OVERFLOW_SUBCOLLECTION).get(transaction=transaction, **options))
+        overflow_refs = [s.reference for s in overflow_snaps]
+
+    if targets:
+        # Już sfinalizowany – dokończ ewentualne usunięcie szkicu
+        target = targets[0]
+        if snap.exists:
+            for sub_ref in overflow_refs:
+                transaction.delete(sub_ref)
+            transaction.delete(draft_ref)
+            record_deletion(transaction, db, draft_ref)
+        return target.reference.parent.id, target.id, (target.to_dict() or {}).get('kod_dostepu')
+
+    if not snap.exists:
+        raise LookupError("Szkic nie istnieje")
+
+    data = reassemble_document(draft_ref, raw, transaction=transaction, **options)
+    collection_target = data.get('collection_target')
+    if collection_target not in DRAFT_TARGETS:
+        raise ValueError("Nieprawidłowy typ szkicu")
+
+    # Usuń meta szkicu i zapisz jako pomiary (monter)
+    kod = _reserve_access_code(db, transaction, **options)
+    payload = _add_pomiary_metadata(_draft_payload(data), data.get('monter_id', ''), kod)
+    doc_ref = db.collection(collection_target).document(draft_id)
+    write_with_budget(db, doc_ref, payload, writer=transaction)
+    _index_access_code(transaction, db, kod, collection_target, doc_ref.id)
+    for sub_ref in overflow_refs:
+        transaction.delete(sub_ref)
+    transaction.delete(draft_ref)
+    record_deletion(transaction, db, draft_ref)
+    return collection_target, doc_ref.id, payload['kod_dostepu']
+
+def _run_finalize_transaction(db, draft_id):
+    """
+    Finalizacja w transakcji z deadline'em i circuit breakerem. Każda próba
+    używa nowej transakcji; finalizacja jest idempotentna, więc można ponawiać.
+    """
+    return call_firestore('write', lambda **options: _finalize_draft_transaction(
+        db.transaction(), db, draft_id, **options))
+
 def finalize_draft(db, draft_id):
     """
     Finalizuje szkic: przenosi dane do docelowej kolekcji ('drzwi', 'drzwi_wejsciowe' lub 'podlogi')
-    i usuwa szkic. Zwraca (doc_id, kod_dostepu) lub (None, None) w razie błędu.
+    i usuwa szkic w jednej transakcji. Dokument docelowy ma ID szkicu, więc ponowna
+    finalizacja zwraca ten sam dokument i kod. Zwraca (doc_id, kod_dostepu) lub (None, None).
     """
     if db is None:
         st.error("❌ Baza danych nie jest zainicjalizowana")
         return None, None
     try:
-        snap = db.collection('wymiary_draft').document(draft_id).get()
-        if not snap.exists:
-            st.error("❌ Szkic nie istnieje")
-            return None, None
-
-        data = snap.to_dict()
-        collection_target = data.get('collection_target')
-        monter_id = data.get('monter_id', '')
-        if collection_target not in ['drzwi', 'drzwi_wejsciowe', 'podlogi']:
-            st.error("❌ Nieprawidłowy typ szkicu")
-            return None, None
-
-        # Usuń meta szkicu
-        payload = data.copy()
-        for meta_key in ['collection_target', 'status', 'created_at', 'updated_at', 'id']:
-            payload.pop(meta_key, None)
-
-        # Zapisz jako pomiary (monter)
-        doc_id, kod = save_pomiary_data(db, collection_target, payload, monter_id)
-        if doc_id:
-            # Usuń szkic
-            db.collection('wymiary_draft').document(draft_id).delete()
-            return doc_id, kod
-        else:
-            return None, None
+        # Niewysłane zmiany z autozapisu muszą trafić do szkicu przed finalizacją
+        get_draft_autosaver(db).flush([draft_id])
+        collection_name, doc_id, kod = _run_finalize_transaction(db, draft_id)
+        invalidate_collection_cache(collection_name)
+        invalidate_collection_cache('wymiary_draft')
+        print(f"✅ Sfinalizowano szkic {draft_id} do {collection_name}")
+        return doc_id, kod
+    except (LookupError, ValueError, DocumentTooLargeError) as e:
+        st.error(f"❌ {e}")
+        return None, None
     except Exception as e:
         st.error(f"❌ Błąd podczas finalizacji szkicu: {e}")
         return None, None
 
+# =====================
+# Autozapis szkiców (write-behind)
+# =====================
+
+# Zmiany są wysyłane, gdy szkic nie zmieniał się przez tyle sekund
+AUTOSAVE_DEBOUNCE_SECONDS = float(os.environ.get('AUTOSAVE_DEBOUNCE_SECONDS', 5))
+# Maksymalna liczba szkiców czekających na zapis (również po nieudanych próbach)
+AUTOSAVE_MAX_PENDING = int(os.environ.get('AUTOSAVE_MAX_PENDING', 200))
+AUTOSAVE_RETRY_MAX_DELAY = 60
+
+_MISSING = object()
+
+class DraftAutosaver:
+    """
+    Kolejka zapisu opóźnionego szkiców, wspólna dla procesu. Zmienione pola
+    są scalane per szkic i wysyłane jednym zapisem przez wątek w tle, gdy
+    szkic nie zmieniał się przez `debounce` sekund. Nieudane zapisy wracają
+    do ograniczonego bufora i są ponawiane z rosnącym odstępem. Zapisy jednego
+    szkicu idą po kolei, różne szkice zapisywane są niezależnie.
+    """
+
+    def __init__(self, db, debounce=AUTOSAVE_DEBOUNCE_SECONDS, max_pending=AUTOSAVE_MAX_PENDING):
+        self._db = db
+        self.debounce = debounce
+        self.max_pending = max_pending
+        # draft_id -> {'fields', 'create', 'changed_at', 'attempts', 'retry_at'}
+        self._pending = {}
+        self._saved_at = {}
+        # draft_id -> (metadane utworzenia albo None, opis błędu) dla porzuconych zapisów
+        self._failed = {}
+        self._lock = threading.Lock()
+        # Szkice, których zapis jest w toku – nowsze pola nie wyprzedzą starszych
+        self._in_flight = set()
+        self._write_done = threading.Condition(self._lock)
+        self._wake = threading.Event()
+        self._stats = {'staged': 0, 'coalesced': 0, 'writes': 0, 'failures': 0, 'rejected': 0, 'dropped': 0}
+        self.last_error = None
+        threading.Thread(target=self._run, name="draft-autosave", daemon=True).start()
+
+    def stage(self, draft_id, fields, create=None):
+        """
+        Dodaje zmienione pola szkicu do kolejki. create – metadane, jeśli szkic
+        nie istnieje jeszcze w bazie. Zwraca False, gdy bufor jest pełny.
+        """
+        with self._lock:
+            entry = self._pending.get(draft_id)
+            if entry is None:
+                if len(self._pending) >= self.max_pending:
+                    self._stats['rejected'] += 1
+                    return False
+                entry = self._pending[draft_id] = {'fields': {}, 'create': None, 'attempts': 0, 'retry_at': 0}
+            else:
+                self._stats['coalesced'] += 1
+            failed = self._failed.pop(draft_id, None)
+            if create is None and failed is not None:
+                # Szkic nie powstał – kolejne zmiany ponawiają jego utworzenie
+                create = failed[0]
+            self._stats['staged'] += 1
+            entry['fields'].update(fields)
+            if create is not None and entry['create'] is None:
+                entry['create'] = create
+            entry['changed_at'] = time.monotonic()
+        self._wake.set()
+        return True
+
+    def discard(self, draft_id):
+        """Porzuca niewysłane zmiany (np. szkic usunięty)"""
+        with self._lock:
+            self._pending.pop(draft_id, None)
+            self._failed.pop(draft_id, None)
+
+    def flush(self, draft_ids=None):
+        """Wysyła od razu zmiany wskazanych (domyślnie wszystkich) szkiców. Zwraca True, gdy nic nie czeka"""
+        with self._lock:
+            ids = list(self._pending) if draft_ids is None else [d for d in draft_ids if d in self._pending]
+        for draft_id in ids:
+            self._write(draft_id, wait=True)
+        with self._lock:
+            return not any(d in self._pending for d in ids)
+
+    def status(self, draft_id):
+        """'pending', 'retrying', 'failed', 'saved' albo None"""
+        with self._lock:
+            entry = self._pending.get(draft_id)
+            if entry is not None:
+                return 'retrying' if entry['attempts'] else 'pending'
+            if draft_id in self._failed:
+                return 'failed'
+        return 'saved' if draft_id in self._saved_at else None
+
+    def error(self, draft_id):
+        """Opis błędu porzuconego zapisu szkicu (None, gdy nie było błędu)"""
+        failed = self._failed.get(draft_id)
+        return failed[1] if failed else None
+
+    def saved_at(self, draft_id):
+        return self._saved_at.get(draft_id)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, pending=len(self._pending),
+                        retrying=sum(1 for e in self._pending.values() if e['attempts']))
+
+    def _due(self, now):
+        with self._lock:
+            return [d for d, e in self._pending.items()
+                    if now - e['changed_at'] >= self.debounce and now >= e['retry_at']
+                    and d not in self._in_flight]
+
+    def _run(self):
+        while True:
+            self._wake.wait(timeout=max(self.debounce / 2, 0.1))
+            self._wake.clear()
+            for draft_id in self._due(time.monotonic()):
+                self._write(draft_id)
+
+    def _write(self, draft_id, wait=False):
+        """
+        Wysyła zebrane pola szkicu. Pola są zdejmowane z bufora pod blokadą,
+        a zapis do bazy odbywa się już bez niej. Gdy zapis tego szkicu jest
+        w toku, wait=True czeka na jego koniec, a wait=False pomija szkic.
+        """
+        with self._lock:
+            while draft_id in self._in_flight:
+                if not wait:
+                    return
+                self._write_done.wait()
+            entry = self._pending.pop(draft_id, None)
+            if entry is None:
+                return
+            self._in_flight.add(draft_id)
+        try:
+            doc_ref = self._db.collection('wymiary_draft').document(draft_id)
+            if entry['create'] is not None:
+                write_with_budget(self._db, doc_ref, {**entry['create'], **entry['fields']})
+            else:
+                snap = call_firestore('read', doc_ref.get)
+                # Szkic sfinalizowany lub usunięty – zmiany nie mają już celu
+                if snap.exists:
+                    write_with_budget(self._db, doc_ref, entry['fields'], existing=snap.to_dict() or {})
+        except Exception as e:
+            self._requeue(draft_id, entry, e)
+        else:
+            invalidate_collection_cache('wymiary_draft')
+            with self._lock:
+                self._stats['writes'] += 1
+                self._saved_at[draft_id] = datetime.now()
+        finally:
+            with self._lock:
+                self._in_flight.discard(draft_id)
+                self._write_done.notify_all()
+
+    def _requeue(self, draft_id, entry, error):
+        """Przywraca nieudany zapis do bufora; nowsze zmiany mają pierwszeństwo"""
+        self.last_error = f"{type(error).__name__}: {error}"
+        with self._lock:
+            self._stats['failures'] += 1
+            newer = self._pending.get(draft_id)
+            if not is_backend_degraded(error):
+                # Błąd danych (np. za duży dokument) – ponawianie nic nie da. Nieutworzony
+                # szkic zostaje zapamiętany, aby kolejne zmiany mogły go utworzyć
+                self._stats['dropped'] += 1
+                print(f"⚠️ Autozapis szkicu {draft_id} porzucony: {self.last_error}")
+                if newer is not None:
+                    if newer['create'] is None:
+                        newer['create'] = entry['create']
+                else:
+                    self._failed[draft_id] = (entry['create'], self.last_error)
+                return
+            if newer is not None:
+                entry['fields'].update(newer['fields'])
+                entry['changed_at'] = newer['changed_at']
+            elif len(self._pending) >= self.max_pending and entry['create'] is None:
+                # Utworzenie szkicu zostaje w buforze ponad limit – bez niego
+                # przepadłyby też wszystkie późniejsze zmiany
+                self._stats['dropped'] += 1
+                print(f"⚠️ Bufor autozapisu pełny – porzucono zmiany szkicu {draft_id}")
+                self._failed[draft_id] = (None, "bufor autozapisu pełny")
+                return
+            entry['attempts'] += 1
+            entry['retry_at'] = time.monotonic() + min(self.debounce * 2 ** entry['attempts'], AUTOSAVE_RETRY_MAX_DELAY)
+            self._pending[draft_id] = entry
+
+@st.cache_resource
+def get_draft_autosaver(_db):
+    """Kolejka autozapisu – jedna na proces, współdzielona przez sesje"""
+    saver = DraftAutosaver(_db)
+    atexit.register(saver.flush)
+    return saver
+
+def autosave_draft(db, state_key, fields, draft_id=None, collection_target=None, monter_id=''):
+    """
+    Kolejkuje zmienione pola formularza szkicu. Stan startowy (pierwsze wywołanie
+    dla state_key) nie jest zapisywany. Bez draft_id szkic powstaje przy
+    pierwszej zmianie. Zwraca ID szkicu albo None, gdy nic jeszcze nie zapisano.
+    """
+    if db is None:
+        return draft_id
+    if collection_target:
+        fields = dict(fields, monter_id=monter_id)
+    state = st.session_state.get(state_key)
+    if state is None:
+        state = st.session_state[state_key] = {'draft_id': draft_id, 'saved': dict(fields)}
+        return draft_id
+    changed = {k: v for k, v in fields.items() if state['saved'].get(k, _MISSING) != v}
+    if not changed:
+        return state['draft_id']
+
+    saver = get_draft_autosaver(db)
+    if state['draft_id'] is None:
+        new_id = db.collection('wymiary_draft').document().id
+        if not saver.stage(new_id, fields, create=_draft_metadata(collection_target, monter_id)):
+            return None
+        state['draft_id'] = new_id
+    elif not saver.stage(state['draft_id'], changed):
+        return state['draft_id']
+    state['saved'] = dict(fields)
+    st.session_state.setdefault('_autosave_keys', set()).add(state_key)
+    return state['draft_id']
+
+def save_autosaved_draft(db, state_key, collection_target, fields, monter_id):
+    """
+    Jawny zapis szkicu z formularza montera przez kolejkę autozapisu – szkic
+    utworzony wcześniej przez autozapis jest uzupełniany, a nie duplikowany.
+    Kolejna zmiana w formularzu zaczyna nowy szkic.
+    Zwraca (draft_id, zapisano) – zapisano=False oznacza zapis czekający w buforze.
+    """
+    if db is None:
+        st.error("❌ Baza danych nie jest zainicjalizowana")
+        return None, False
+    saver = get_draft_autosaver(db)
+    state = st.session_state.get(state_key) or {}
+    draft_id = state.get('draft_id')
+    payload = dict(fields, monter_id=monter_id)
+    if draft_id is None:
+        draft_id = db.collection('wymiary_draft').document().id
+        staged = saver.stage(draft_id, payload, create=_draft_metadata(collection_target, monter_id))
+    else:
+        staged = saver.stage(draft_id, payload)
+    if not staged:
+        st.error("❌ Bufor zapisu jest pełny – sprawdź połączenie i spróbuj ponownie")
+        return None, False
+    st.session_state[state_key] = {'draft_id': None, 'saved': payload}
+    return draft_id, saver.flush([draft_id])
+
+def flush_autosave_on_navigation(db, view):
+    """
+    Wysyła zmiany szkiców tej sesji przy zmianie strony lub widoku (view)
+    i zamyka ich stan autozapisu – powrót do formularza zaczyna nowy szkic.
+    """
+    if db is None or st.session_state.get('_autosave_view') == view:
+        return
+    st.session_state['_autosave_view'] = view
+    keys = st.session_state.pop('_autosave_keys', set())
+    draft_ids = [st.session_state.pop(key, {}).get('draft_id') for key in keys]
+    draft_ids = [d for d in draft_ids if d]
+    if draft_ids:
+        get_draft_autosaver(db).flush(draft_ids)
+
+def autosave_caption(db, draft_id):
+    """Krótki opis stanu autozapisu szkicu do st.caption"""
+    if db is None or not draft_id:
+        return "💾 Autozapis włączony – szkic powstanie przy pierwszej zmianie"
+    saver = get_draft_autosaver(db)
+    status = saver.status(draft_id)
+    if status == 'pending':
+        return "💾 Autozapis: zmiany czekają na wysłanie"
+    if status == 'retrying':
+        return "⚠️ Autozapis: brak połączenia – zmiany są w buforze i zostaną wysłane ponownie"
+    if status == 'failed':
+        return f"❌ Autozapis: ostatnie zmiany nie zostały zapisane ({saver.error(draft_id)})"
+    saved_at = saver.saved_at(draft_id)
+    if saved_at:
+        return f"✅ Autozapis: zapisano o {saved_at.strftime('%H:%M:%S')}"
+    return "💾 Autozapis włączony"
+
+# =====================
+# Masowa finalizacja szkiców
+# =====================
+
+# Limit operacji w jednym WriteBatch (ograniczenie Firestore)
+BATCH_MAX_OPERATIONS = 500
+# Liczba batchy commitowanych równolegle
+BULK_WORKERS = 4
+
+class _RecordedWrites:
+    """Zbiera operacje zapisu (interfejs WriteBatch), aby policzyć je przed podziałem na batche"""
+
+    def __init__(self):
+        self.operations = []
+
+    def set(self, doc_ref, data, merge=False):
+        self.operations.append(('set', doc_ref, (data,), {'merge': merge}))
+
+    def create(self, doc_ref, data):
+        self.operations.append(('create', doc_ref, (data,), {}))
+
+    def update(self, doc_ref, data):
+        self.operations.append(('update', doc_ref, (data,), {}))
+
+    def delete(self, doc_ref, option=None):
+        self.operations.append(('delete', doc_ref, (), {'option': option}))
+
+    def apply_to(self, batch):
+        for kind, doc_ref, args, kwargs in self.operations:
+            getattr(batch, kind)(doc_ref, *args, **kwargs)
+
+def _plan_draft_finalization(db, snap):
+    """
+    Przygotowuje operacje finalizacji jednego szkicu (zapis pomiarów + usunięcie
+    szkicu z przepełnieniem). Zwraca (wynik, operacje).
+    """
+    draft_ref = snap.reference
+    raw = snap.to_dict() or {}
+    data = reassemble_document(draft_ref, raw)
+    collection_target = data.get('collection_target')
+    result = {'draft_id': snap.id, 'typ': collection_target or ''}
+    if collection_target not in DRAFT_TARGETS:
+        raise ValueError("Nieprawidłowy typ szkicu")
+
+    payload = _add_pomiary_metadata(_draft_payload(data), data.get('monter_id', ''))
+    # To samo ID co szkic (jak w finalize_draft); usunięcie szkicu z warunkiem
+    # niezmienionego update_time odrzuca batch, jeśli szkic sfinalizowano równolegle
+    doc_ref = db.collection(collection_target).document(snap.id)
+    writes = _RecordedWrites()
+    write_with_budget(db, doc_ref, payload, writer=writes)
+    # create odrzuci batch przy (skrajnie mało prawdopodobnej) kolizji kodu
+    _index_access_code(writes, db, payload['kod_dostepu'], collection_target, doc_ref.id)
+    if raw.get(OVERFLOW_FIELD):
+        overflow_refs = call_firestore('read', lambda **options: list(
+            draft_ref.collection(OVERFLOW_SUBCOLLECTION).list_documents(**options)))
+        for sub_ref in overflow_refs:
+            writes.delete(sub_ref)
+    writes.delete(draft_ref, option=db.write_option(last_update_time=snap.update_time))
+    record_deletion(writes, db, draft_ref)
+
+    result.update({'doc_id': doc_ref.id, 'kod': payload['kod_dostepu']})
+    return result, writes
+
+def _chunk_plans(plans, max_operations=BATCH_MAX_OPERATIONS):
+    """Dzieli plany na porcje mieszczące się w jednym batchu (szkic nigdy nie jest dzielony)"""
+    chunks, current, count = [], [], 0
+    for result, writes in plans:
+        size = len(writes.operations)
+        if current and count + size > max_operations:
+            chunks.append(current)
+            current, count = [], 0
+        current.append((result, writes))
+        count += size
+    if current:
+        chunks.append(current)
+    return chunks
+
+def _commit_chunk(db, chunk):
+    """Commituje jedną porcję szkiców jako pojedynczy WriteBatch"""
+    batch = db.batch()
+    for _, writes in chunk:
+        writes.apply_to(batch)
+    # create() i warunek update_time – ponowienie mogłoby zgłosić fałszywy konflikt
+    call_firestore('write', batch.commit, idempotent=False)
+
+def _finalize_chunk(db, chunk):
+    """
+    Finalizuje porcję jednym batchem. Odrzucony batch (kolizja kodu, szkic zmieniony
+    przez autozapis lub sfinalizowany w innej karcie) nie przesądza o wszystkich
+    szkicach porcji – każdy jest wtedy finalizowany osobno transakcją jak w finalize_draft.
+    Zwraca wyniki szkiców porcji.
+    """
+    try:
+        _commit_chunk(db, chunk)
+    except Exception as e:
+        if is_backend_degraded(e):
+            # Baza niedostępna – pojedyncze transakcje też by się nie powiodły
+            return [_draft_error(result, e) for result, _ in chunk]
+        return [_finalize_one(db, result) for result, _ in chunk]
+    return [dict(result, status='success') for result, _ in chunk]
+
+def _draft_error(result, error):
+    """Wynik niesfinalizowanego szkicu (bez doc_id i kodu z odrzuconego planu)"""
+    failed = {k: v for k, v in result.items() if k not in ('doc_id', 'kod')}
+    failed.update(status='error', error=str(error))
+    return failed
+
+def _finalize_one(db, result):
+    try:
+        collection_name, doc_id, kod = _run_finalize_transaction(db, result['draft_id'])
+    except Exception as e:
+        return _draft_error(result, e)
+    return dict(result, status='success', typ=collection_name, doc_id=doc_id, kod=kod)
+
+def finalize_drafts_bulk(db, draft_ids, progress_callback=None, max_workers=BULK_WORKERS):
+    """
+    Finalizuje wiele szkiców naraz. Szkice pobierane są jednym zapytaniem
+    get_all, a pary zapis pomiarów + usunięcie szkicu grupowane w WriteBatch
+    po maksymalnie BATCH_MAX_OPERATIONS operacji; batche commitowane są równolegle.
+    Szkice z odrzuconego batcha są finalizowane pojedynczo (transakcja finalize_draft).
+    progress_callback(gotowe_porcje, wszystkie_porcje, gotowe_szkice, wszystkie_szkice)
+    wywoływany jest w wątku wywołującym po każdej porcji.
+    Zwraca listę wyników: {'draft_id', 'status', 'doc_id', 'kod', 'typ', 'error'}.
+    """
+    if db is None:
+        st.error("❌ Baza danych nie jest zainicjalizowana")
+        return []
+
+    results = []
+    plans = []
+    get_draft_autosaver(db).flush(draft_ids)
+    drafts_ref = db.collection('wymiary_draft')
+    # get_all zwraca generator – lista, aby deadline obejmował cały odczyt
+    snaps = call_firestore('read', lambda **options: list(db.get_all(
+        [drafts_ref.document(draft_id) for draft_id in draft_ids], **options)))
+    found = set()
+    for snap in snaps:
+        found.add(snap.id)
+        if not snap.exists:
+            results.append({'draft_id': snap.id, 'status': 'error', 'error': "Szkic nie istnieje"})
+            continue
+        try:
+            plans.append(_plan_draft_finalization(db, snap))
+        except Exception as e:
+            results.append({'draft_id': snap.id, 'status': 'error', 'error': str(e),
+                            'typ': (snap.to_dict() or {}).get('collection_target', '')})
+    for draft_id in draft_ids:
+        if draft_id not in found:
+            results.append({'draft_id': draft_id, 'status': 'error', 'error': "Szkic nie istnieje"})
+
+    chunks = _chunk_plans(plans)
+    total_drafts = len(plans)
+    done_chunks = done_drafts = 0
+    if progress_callback:
+        progress_callback(0, len(chunks), 0, total_drafts)
+
+    workers = max(1, min(max_workers, len(chunks)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(_finalize_chunk, db, chunk): chunk for chunk in chunks}
+        for future in as_completed(futures):
+            chunk = futures[future]
+            results.extend(future.result())
+            done_chunks += 1
+            done_drafts += len(chunk)
+            if progress_callback:
+                progress_callback(done_chunks, len(chunks), done_drafts, total_drafts)
+
+    for collection_name in {result['typ'] for result, _ in plans} | {'wymiary_draft'}:
+        invalidate_collection_cache(collection_name)
+    return results
+
 def generate_share_link(doc_id, kod_dostepu, collection_name):
     """
     Generuje link do udostępnienia formularza
@@ -811,54 +2911,49 @@ def generate_share_link(doc_id, kod_dostepu, collection_name):
 # Obsługa zdjęć
 # ===================
 
-def upload_image_to_firebase(uploaded_file, folder_name, doc_id):
+# Liczba wątków przetwarzających zdjęcia równolegle (Pillow zwalnia GIL)
+IMAGE_WORKERS = 4
+
+def _prepare_image(uploaded_file):
     """
-    Przesyła zdjęcie do Firebase Storage
-    Zwraca URL zdjęcia lub None w przypadku błędu
+    Waliduje, zmniejsza i zapisuje zdjęcie w magazynie; zwraca referencję.
+    Nie korzysta ze Streamlit, więc może działać w wątku roboczym.
+    Błędy zgłaszane są wyjątkami (ValueError dla nieprawidłowych plików).
     """
-    try:
-        if uploaded_file is None:
-            return None
-            
-        # Sprawdź format pliku
-        if not uploaded_file.type.startswith('image/'):
-            st.error("❌ Można przesyłać tylko pliki obrazów!")
-            return None
-            
-        # Sprawdź rozmiar (maksymalnie 5MB)
-        if uploaded_file.size > 5 * 1024 * 1024:
-            st.error("❌ Plik jest za duży! Maksymalny rozmiar to 5MB")
-            return None
-            
-        # Utwórz unikalną nazwę pliku
-        file_extension = uploaded_file.name.split('.')[-1]
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        file_name = f"{folder_name}/{doc_id}/{timestamp}_{uploaded_file.name}"
+    # Sprawdź format pliku
+    if not uploaded_file.type.startswith('image/'):
+        raise ValueError("Można przesyłać tylko pliki obrazów!")
         
-        # Konwertuj i zmniejsz obraz jeśli potrzeba
-        image = Image.open(uploaded_file)
+    # Sprawdź rozmiar (maksymalnie 5MB)
+    if uploaded_file.size > 5 * 1024 * 1024:
+        raise ValueError("Plik jest za duży! Maksymalny rozmiar to 5MB")
         
-        # Zmniejsz obraz jeśli jest za duży (maksymalnie 1920x1080)
-        max_width = 1920
-        max_height = 1080
-        if image.width > max_width or image.height > max_height:
-            image.thumbnail((max_width, max_height), Image.Resampling.LANCZOS)
-        
-        # Konwertuj do JPEG dla zmniejszenia rozmiaru
-        if image.mode in ("RGBA", "P"):
-            image = image.convert("RGB")
-            
-        # Zapisz do bufora
-        buffer = io.BytesIO()
-        image.save(buffer, format='JPEG', quality=85, optimize=True)
-        buffer.seek(0)
-        
-        # Przesyłanie do Firebase Storage wymaga konfiguracji bucket
-        # Na razie zapisujemy jako base64 w bazie danych
-        img_base64 = base64.b64encode(buffer.getvalue()).decode()
-        
-        return img_base64
+    # Zdekoduj od razu w zmniejszonej skali (maksymalnie 1920x1080) z orientacją EXIF
+    image = open_image_reduced(uploaded_file, 1920, 1080)
+    
+    # Konwertuj do JPEG dla zmniejszenia rozmiaru
+    if image.mode in ("RGBA", "P"):
+        image = image.convert("RGB")
         
+    # Zapisz do bufora
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=85, optimize=True)
+    
+    # Zapisz w magazynie zdjęć – dokument dostaje tylko referencję
+    return store_image(buffer.getvalue(), uploaded_file.name, image.width, image.height, image=image)
+
+def upload_image_to_firebase(uploaded_file, folder_name, doc_id):
+    """
+    Przesyła zdjęcie do magazynu zdjęć (Firebase Storage)
+    Zwraca referencję zdjęcia do zapisania w dokumencie lub None w przypadku błędu
+    """
+    if uploaded_file is None:
+        return None
+    try:
+        return _prepare_image(uploaded_file)
+    except ValueError as e:
+        st.error(f"❌ {e}")
+        return None
     except Exception as e:
         st.error(f"❌ Błąd podczas przesyłania zdjęcia: {e}")
         return None
@@ -868,18 +2963,37 @@ def save_images_to_database(db, collection_name, doc_id, images_data):
     Zapisuje dane zdjęć do dokumentu w bazie danych
     """
     try:
-        db.collection(collection_name).document(doc_id).update({
+        doc_ref = db.collection(collection_name).document(doc_id)
+        existing = call_firestore('read', doc_ref.get).to_dict() or {}
+        write_with_budget(db, doc_ref, {
             'zdjecia': images_data,
             'data_aktualizacji_zdjec': datetime.now()
-        })
+        }, existing=existing)
+        invalidate_collection_cache(collection_name)
         return True
     except Exception as e:
         st.error(f"❌ Błąd podczas zapisywania zdjęć: {e}")
         return False
 
-def display_images(images_data, max_width=300):
+def _show_gallery_image(img_data, idx, max_width, zoom_key):
+    """
+    Wyświetla miniaturę zdjęcia; pełne zdjęcie wczytywane jest dopiero
+    po włączeniu powiększenia
+    """
+    caption = img_data.get('nazwa', f'Zdjęcie {idx+1}')
+    has_thumbnail = thumbnail_id(img_data, max_width) is not None
+    
+    if has_thumbnail and st.session_state.get(zoom_key, False):
+        st.image(load_image_bytes(img_data), caption=caption, use_container_width=True)
+    else:
+        st.image(load_image_bytes(img_data, width=max_width), caption=caption, width=max_width)
+    
+    if has_thumbnail:
+        st.toggle("🔍 Powiększ", key=zoom_key)
+
+def display_images(images_data, max_width=300, key_prefix="gallery"):
     """
-    Wyświetla zdjęcia z danych base64
+    Wyświetla zdjęcia (miniatury z magazynu lub starsze dane base64)
     """
     if not images_data:
         st.info("📷 Brak zdjęć dla tego pomiaru")
@@ -892,11 +3006,8 @@ def display_images(images_data, max_width=300):
     for i, img_data in enumerate(images_data):
         with cols[i % 3]:
             try:
-                # Dekoduj base64
-                img_bytes = base64.b64decode(img_data['data'])
-                
                 # Wyświetl zdjęcie
-                st.image(img_bytes, caption=img_data.get('nazwa', f'Zdjęcie {i+1}'), width=max_width)
+                _show_gallery_image(img_data, i, max_width, f"{key_prefix}_zoom_{img_data.get('id', '')}_{i}")
                 
                 # Pokaż informacje o zdjęciu
                 if 'data_dodania' in img_data:
@@ -932,7 +3043,7 @@ def create_image_uploader(key_prefix, max_files=5):
         for i, uploaded_file in enumerate(uploaded_files):
             with cols[i % 3]:
                 try:
-                    image = Image.open(uploaded_file)
+                    image = open_image_reduced(uploaded_file, 400, 400)
                     st.image(image, caption=uploaded_file.name, width=200)
                     st.write(f"Rozmiar: {uploaded_file.size/1024:.1f} KB")
                 except Exception as e:
@@ -946,31 +3057,36 @@ def process_uploaded_images(uploaded_files, folder_name, doc_id):
     """
     if not uploaded_files:
         return []
-        
-    images_data = []
     
-    for uploaded_file in uploaded_files:
-        with st.spinner(f"Przetwarzanie {uploaded_file.name}..."):
-            img_base64 = upload_image_to_firebase(uploaded_file, folder_name, doc_id)
-            
-            if img_base64:
-                images_data.append({
-                    'nazwa': uploaded_file.name,
-                    'data': img_base64,
-                    'rozmiar': uploaded_file.size,
-                    'typ': uploaded_file.type,
-                    'data_dodania': datetime.now()
-                })
+    def _process(uploaded_file):
+        try:
+            return _prepare_image(uploaded_file), None
+        except Exception as e:
+            return None, e
+    
+    # Zdjęcia przetwarzane są równolegle; map zachowuje kolejność plików
+    workers = min(IMAGE_WORKERS, len(uploaded_files))
+    with st.spinner(f"Przetwarzanie {len(uploaded_files)} zdjęć..."):
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_process, uploaded_files))
+    
+    images_data = []
+    for uploaded_file, (img_ref, error) in zip(uploaded_files, results):
+        if error is not None:
+            st.error(f"❌ {uploaded_file.name}: {error}")
+        elif img_ref:
+            images_data.append(img_ref)
                 
     return images_data
 
 def display_images_with_edit(images_data, draft_id, max_width=300):
     """
-    Wyświetla zdjęcia z możliwością usuwania (dla przechowalni)
+    Wyświetla zdjęcia z możliwością usuwania (dla przechowalni).
+    Zwraca listę zdjęć zaznaczonych do usunięcia.
     """
     if not images_data:
         st.info("📷 Brak zdjęć dla tego szkicu")
-        return images_data
+        return []
         
     st.subheader("📸 Zdjęcia w szkicu")
     
@@ -988,11 +3104,8 @@ def display_images_with_edit(images_data, draft_id, max_width=300):
                 img_data = images_data[idx]
                 with cols[j]:
                     try:
-                        # Dekoduj base64
-                        img_bytes = base64.b64decode(img_data['data'])
-                        
                         # Wyświetl zdjęcie
-                        st.image(img_bytes, caption=img_data.get('nazwa', f'Zdjęcie {idx+1}'), width=max_width)
+                        _show_gallery_image(img_data, idx, max_width, f"zoom_img_{draft_id}_{idx}")
                         
                         # Pokaż informacje o zdjęciu
                         if 'data_dodania' in img_data:
@@ -1007,62 +3120,160 @@ def display_images_with_edit(images_data, draft_id, max_width=300):
                         
                         # Przycisk usuwania
                         if st.button(f"🗑️ Usuń", key=f"delete_img_{draft_id}_{idx}", help=f"Usuń zdjęcie: {img_data.get('nazwa', f'Zdjęcie {idx+1}')}"):
-                            images_to_delete.append(idx)
+                            images_to_delete.append(img_data)
                             
                     except Exception as e:
                         st.error(f"❌ Błąd wyświetlania zdjęcia {idx+1}: {e}")
     
-    # Jeśli jakieś zdjęcie zostało zaznaczone do usunięcia
-    if images_to_delete:
-        # Utwórz nową listę bez usuniętych zdjęć
-        images_to_keep = [img for i, img in enumerate(images_data) if i not in images_to_delete]
-        return images_to_keep
-    
-    # Jeśli nic nie zostało usunięte, zwróć oryginalne dane
-    return images_data
+    return images_to_delete
+
+def _draft_images_location(draft_ref):
+    """
+    Zwraca (dokument, pole) przechowujące tablicę zdjęć szkicu – sam szkic
+    albo dokument przepełnienia, jeśli 'zdjecia' zostały wyniesione.
+    Odczytuje wyłącznie pole przepełnienia, bez zdjęć.
+    """
+    snap = call_firestore('read', draft_ref.get, field_paths=[OVERFLOW_FIELD])
+    if not snap.exists:
+        raise LookupError("Szkic nie istnieje")
+    if 'zdjecia' in ((snap.to_dict() or {}).get(OVERFLOW_FIELD) or []):
+        return draft_ref.collection(OVERFLOW_SUBCOLLECTION).document('zdjecia'), 'wartosc'
+    return draft_ref, 'zdjecia'
+
+def _append_draft_images(db, draft_id, new_images, location=None):
+    """
+    Dopisuje zdjęcia do szkicu (ArrayUnion – także ich id w IMAGE_IDS_FIELD)
+    i odświeża daty modyfikacji.
+    location – (dokument, pole) z _draft_images_location, jeśli już znane.
+    """
+    draft_ref = db.collection('wymiary_draft').document(draft_id)
+    images_ref, field = location or _draft_images_location(draft_ref)
+    draft_update = {
+        IMAGE_IDS_FIELD: firestore.ArrayUnion(image_ids(new_images)),
+        'data_aktualizacji_zdjec': datetime.now(),
+        UPDATED_AT_FIELD: firestore.SERVER_TIMESTAMP,
+    }
+    batch = db.batch()
+    if images_ref is draft_ref:
+        batch.update(draft_ref, {field: firestore.ArrayUnion(new_images), **draft_update})
+    else:
+        batch.update(images_ref, {field: firestore.ArrayUnion(new_images)})
+        batch.update(draft_ref, draft_update)
+    call_firestore('write', batch.commit)
+
+def _stored_image(img):
+    """Referencja zdjęcia w postaci odczytywanej z bazy (daty bez strefy zapisywane są jako UTC)"""
+    if not isinstance(img, dict):
+        return img
+    return {k: v.replace(tzinfo=timezone.utc) if isinstance(v, datetime) and v.tzinfo is None else v
+            for k, v in img.items()}
+
+@firestore.transactional
+def _remove_draft_images_transaction(transaction, db, draft_id, images_to_remove, **options):
+    """
+    Usuwa zdjęcia ze szkicu (ArrayRemove) i przelicza IMAGE_IDS_FIELD z pozostałych
+    zdjęć – ten sam plik mógł zostać dodany do szkicu dwa razy.
+    Zwraca id zdjęć, do których szkic już się nie odwołuje.
+    """
+    draft_ref = db.collection('wymiary_draft').document(draft_id)
+    snap = draft_ref.get(field_paths=[OVERFLOW_FIELD, 'zdjecia'], transaction=transaction, **options)
+    if not snap.exists:
+        raise LookupError("Szkic nie istnieje")
+    images_ref, field = draft_ref, 'zdjecia'
+    current = snap.to_dict() or {}
+    if 'zdjecia' in (current.get(OVERFLOW_FIELD) or []):
+        images_ref, field = draft_ref.collection(OVERFLOW_SUBCOLLECTION).document('zdjecia'), 'wartosc'
+        current = images_ref.get(field_paths=[field], transaction=transaction, **options).to_dict() or {}
+    removed = [_stored_image(img) for img in images_to_remove]
+    remaining = [img for img in current.get(field) or [] if _stored_image(img) not in removed]
+    draft_update = {
+        IMAGE_IDS_FIELD: image_ids(remaining),
+        'data_aktualizacji_zdjec': datetime.now(),
+        UPDATED_AT_FIELD: firestore.SERVER_TIMESTAMP,
+    }
+    if images_ref is draft_ref:
+        transaction.update(draft_ref, {field: firestore.ArrayRemove(images_to_remove), **draft_update})
+    else:
+        transaction.update(images_ref, {field: firestore.ArrayRemove(images_to_remove)})
+        transaction.update(draft_ref, draft_update)
+    return set(image_ids(images_to_remove)) - set(image_ids(remaining))
+
+def _image_references_complete(db):
+    """Czy migracja zdjęć uzupełniła IMAGE_IDS_FIELD we wszystkich kolekcjach"""
+    snap = call_firestore('read', db.collection(MIGRATION_COLLECTION).document(IMAGE_MIGRATION_CHECKPOINT).get)
+    checkpoint = (snap.to_dict() or {}) if snap.exists else {}
+    return all(checkpoint.get(name) == MIGRATION_DONE for name in IMAGE_COLLECTIONS)
+
+def delete_unreferenced_images(db, ids, store=None):
+    """
+    Usuwa z magazynu zdjęcia (z miniaturami), do których nie odwołuje się już
+    żaden protokół ani szkic. Dopóki migracja zdjęć nie uzupełni IMAGE_IDS_FIELD
+    w starszych dokumentach, niczego nie usuwa. Zwraca id usuniętych zdjęć.
+    """
+    if not ids or not _image_references_complete(db):
+        return []
+    deleted = []
+    for image_id in sorted(ids):
+        referenced = any(
+            call_firestore('query', db.collection(name)
+                           .where(filter=firestore.FieldFilter(IMAGE_IDS_FIELD, 'array_contains', image_id))
+                           .select([IMAGE_IDS_FIELD]).limit(1).get)
+            for name in IMAGE_COLLECTIONS)
+        if not referenced:
+            delete_image(image_id, store)
+            deleted.append(image_id)
+    return deleted
 
 def add_images_to_draft(db, draft_id, new_images_data):
     """
-    Dodaje nowe zdjęcia do istniejącego szkicu
+    Dodaje nowe zdjęcia do istniejącego szkicu zapisem ArrayUnion – przesyłane
+    są tylko nowe referencje, a równoległe dodawania się nie nadpisują. Odczyt
+    przed zapisem obejmuje jedynie pole przepełnienia; zapas między budżetem
+    a limitem Firestore mieści kolejne referencje. Dopiero gdy Firestore odrzuci
+    zbyt duży dokument, zdjęcia trafiają do przepełnienia przez write_with_budget.
     """
     try:
-        # Pobierz obecne dane szkicu
-        draft_doc = db.collection('wymiary_draft').document(draft_id).get()
-        if not draft_doc.exists:
-            st.error("❌ Szkic nie istnieje")
-            return False
-            
-        draft_data = draft_doc.to_dict()
-        existing_images = draft_data.get('zdjecia', [])
-        
-        # Dodaj nowe zdjęcia do istniejących
-        all_images = existing_images + new_images_data
-        
-        # Aktualizuj szkic
-        db.collection('wymiary_draft').document(draft_id).update({
-            'zdjecia': all_images,
-            'data_aktualizacji_zdjec': datetime.now(),
-            'updated_at': datetime.now()
-        })
+        draft_ref = db.collection('wymiary_draft').document(draft_id)
+        location = _draft_images_location(draft_ref)
+        try:
+            _append_draft_images(db, draft_id, new_images_data, location)
+        except google_exceptions.InvalidArgument:
+            snap = call_firestore('read', draft_ref.get)
+            if not snap.exists:
+                raise LookupError("Szkic nie istnieje")
+            draft_data = snap.to_dict() or {}
+            existing_images = reassemble_document(draft_ref, draft_data).get('zdjecia') or []
+            write_with_budget(db, draft_ref, {
+                'zdjecia': existing_images + [img for img in new_images_data if img not in existing_images],
+                'data_aktualizacji_zdjec': datetime.now(),
+            }, existing=draft_data)
+        invalidate_collection_cache('wymiary_draft')
         return True
+    except (LookupError, DocumentTooLargeError) as e:
+        st.error(f"❌ {e}")
+        return False
     except Exception as e:
         st.error(f"❌ Błąd podczas dodawania zdjęć: {e}")
         return False
 
-def update_draft_images(db, draft_id, images_data):
+def remove_images_from_draft(db, draft_id, images_to_remove):
     """
-    Aktualizuje zdjęcia w szkicu (używane przy usuwaniu)
+    Usuwa wskazane zdjęcia ze szkicu (ArrayRemove – bez przepisywania tablicy).
+    Pliki zdjęć, do których nie odwołuje się już żaden dokument, są usuwane z magazynu.
     """
     try:
-        db.collection('wymiary_draft').document(draft_id).update({
-            'zdjecia': images_data,
-            'data_aktualizacji_zdjec': datetime.now(),
-            'updated_at': datetime.now()
-        })
+        released = call_firestore('write', lambda **options: _remove_draft_images_transaction(
+            db.transaction(), db, draft_id, images_to_remove, **options))
+        invalidate_collection_cache('wymiary_draft')
+        try:
+            delete_unreferenced_images(db, released)
+        except Exception as e:
+            # Szkic jest już zaktualizowany – nieusunięty plik zajmuje tylko miejsce
+            print(f"⚠️ Nie udało się usunąć nieużywanych zdjęć szkicu {draft_id}: {e}")
         return True
+    except LookupError as e:
+        st.error(f"❌ {e}")
+        return False
     except Exception as e:
-        st.error(f"❌ Błąd podczas aktualizacji zdjęć: {e}")
+        st.error(f"❌ Błąd podczas usuwania zdjęć: {e}")
         return False
-
-
-
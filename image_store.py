@@ -0,0 +1,301 @@
+import base64
+import functools
+import hashlib
+import io
+import os
+from datetime import datetime
+
+import firebase_admin
+from firebase_admin import storage
+from google.api_core import exceptions as google_exceptions
+import streamlit as st
+from PIL import ExifTags, Image, ImageOps
+
+# ===================
+# Magazyn zdjęć
+# ===================
+#
+# Dokumenty protokołów przechowują tylko lekkie referencje do zdjęć:
+#   {'id', 'nazwa', 'typ', 'rozmiar', 'szerokosc', 'wysokosc', 'hash',
+#    'miniatury', 'data_dodania'}
+# Przy każdym zdjęciu zapisywane są miniatury o stałych szerokościach
+# (THUMBNAIL_WIDTHS) – galerie wczytują je zamiast pełnego zdjęcia.
+# Same pliki trafiają do Firebase Storage (produkcja) albo do katalogu
+# lokalnego (testy, praca offline – zmienna środowiskowa IMAGE_STORE_DIR).
+# Identyfikator zdjęcia to skrót SHA-256 jego zawartości, więc ponowny zapis
+# tego samego pliku jest operacją idempotentną.
+
+# Szerokości miniatur (px)
+THUMBNAIL_WIDTHS = (256, 512)
+THUMBNAIL_QUALITY = 80
+
+# Kolekcje, których dokumenty mogą zawierać zdjęcia
+IMAGE_COLLECTIONS = ['drzwi', 'drzwi_wejsciowe', 'podlogi', 'wymiary_draft']
+
+# Kolekcja z punktami kontrolnymi migracji
+MIGRATION_COLLECTION = 'migracje'
+MIGRATION_DONE = '__zakonczono__'
+
+
+class ImageStore:
+    """Interfejs magazynu zdjęć"""
+
+    def put(self, image_id, data, content_type='image/jpeg'):
+        raise NotImplementedError
+
+    def get(self, image_id):
+        raise NotImplementedError
+
+    def delete(self, image_id):
+        raise NotImplementedError
+
+    def exists(self, image_id):
+        raise NotImplementedError
+
+
+class FirebaseImageStore(ImageStore):
+    """Magazyn zdjęć w Firebase Storage"""
+
+    def __init__(self, bucket_name=None, prefix='zdjecia'):
+        self.bucket = storage.bucket(bucket_name or _default_bucket_name())
+        self.prefix = prefix
+
+    def _blob(self, image_id):
+        return self.bucket.blob(f"{self.prefix}/{image_id}")
+
+    def put(self, image_id, data, content_type='image/jpeg'):
+        self._blob(image_id).upload_from_string(data, content_type=content_type)
+
+    def get(self, image_id):
+        return self._blob(image_id).download_as_bytes()
+
+    def delete(self, image_id):
+        try:
+            self._blob(image_id).delete()
+        except google_exceptions.NotFound:
+            pass
+
+    def exists(self, image_id):
+        return self._blob(image_id).exists()
+
+
+class LocalImageStore(ImageStore):
+    """Magazyn zdjęć w lokalnym katalogu (testy i praca offline)"""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, image_id):
+        # Dwuznakowe podkatalogi, aby nie trzymać tysięcy plików w jednym miejscu
+        return os.path.join(self.root, image_id[:2], image_id)
+
+    def put(self, image_id, data, content_type='image/jpeg'):
+        path = self._path(image_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def get(self, image_id):
+        with open(self._path(image_id), 'rb') as f:
+            return f.read()
+
+    def delete(self, image_id):
+        try:
+            os.remove(self._path(image_id))
+        except FileNotFoundError:
+            pass
+
+    def exists(self, image_id):
+        return os.path.exists(self._path(image_id))
+
+
+def _default_bucket_name():
+    """Nazwa bucketu z env/secrets lub domyślny bucket projektu Firebase"""
+    name = os.environ.get('FIREBASE_STORAGE_BUCKET')
+    if not name:
+        try:
+            name = st.secrets.get('firebase_storage_bucket')
+        except Exception:
+            name = None
+    if not name:
+        name = f"{firebase_admin.get_app().project_id}.appspot.com"
+    return name
+
+
+_store = None
+
+def get_image_store():
+    """Zwraca magazyn zdjęć procesu (lokalny, jeśli ustawiono IMAGE_STORE_DIR)"""
+    global _store
+    if _store is None:
+        local_dir = os.environ.get('IMAGE_STORE_DIR')
+        _store = LocalImageStore(local_dir) if local_dir else FirebaseImageStore()
+    return _store
+
+def set_image_store(store):
+    """Podmienia magazyn zdjęć procesu (np. na LocalImageStore w testach)"""
+    global _store
+    _store = store
+    _read_blob.cache_clear()
+
+
+# Orientacje EXIF, w których szerokość i wysokość są zamienione
+_TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+def open_image_reduced(fp, max_width, max_height):
+    """
+    Otwiera zdjęcie i dekoduje je możliwie blisko rozmiaru docelowego
+    (mieszczącego się w max_width x max_height po obróceniu wg EXIF).
+
+    JPEG: tryb draft – skalowanie 1/2, 1/4, 1/8 już podczas dekodowania DCT,
+    więc zdjęcie 48 MP nigdy nie trafia do pamięci w pełnej rozdzielczości.
+    PNG i inne: szybka całkowitoliczbowa redukcja (reduce) przed LANCZOS.
+    Zwraca obraz z zastosowaną orientacją EXIF.
+    """
+    image = Image.open(fp)
+    orientation = image.getexif().get(ExifTags.Base.Orientation, 1)
+    transposed = orientation in _TRANSPOSED_ORIENTATIONS
+
+    # Rozmiar docelowy liczony dla zdjęcia już obróconego
+    width, height = (image.height, image.width) if transposed else image.size
+    ratio = min(1.0, max_width / width, max_height / height)
+    target = (max(1, round(width * ratio)), max(1, round(height * ratio)))
+    raw_target = (target[1], target[0]) if transposed else target
+
+    if ratio < 1.0 and image.format == 'JPEG':
+        image.draft(None, raw_target)
+    image.load()
+
+    if ratio < 1.0 and image.format != 'JPEG':
+        factor = int(min(image.width / raw_target[0], image.height / raw_target[1]))
+        if factor >= 2:
+            image = image.reduce(factor)
+
+    image = ImageOps.exif_transpose(image)
+    if image.width > target[0] or image.height > target[1]:
+        image = image.resize(target, Image.Resampling.LANCZOS)
+    return image
+
+def make_thumbnails(image):
+    """Zwraca {szerokość: bajty JPEG} dla szerokości z THUMBNAIL_WIDTHS"""
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    thumbnails = {}
+    for width in THUMBNAIL_WIDTHS:
+        thumb = image.copy()
+        if thumb.width > width:
+            thumb.thumbnail((width, thumb.height), Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        thumb.save(buffer, format='JPEG', quality=THUMBNAIL_QUALITY)
+        thumbnails[width] = buffer.getvalue()
+    return thumbnails
+
+def _store_thumbnails(digest, image, store):
+    """Zapisuje miniatury obok oryginału i zwraca mapę {'256': id, ...}"""
+    refs = {}
+    for width, thumb_data in make_thumbnails(image).items():
+        thumb_id = f"{digest}_w{width}"
+        if not store.exists(thumb_id):
+            store.put(thumb_id, thumb_data, 'image/jpeg')
+        # Klucze map w Firestore muszą być tekstem
+        refs[str(width)] = thumb_id
+    return refs
+
+def store_image(data, nazwa, width, height, content_type='image/jpeg', store=None, image=None):
+    """
+    Zapisuje zdjęcie wraz z miniaturami w magazynie i zwraca referencję
+    do umieszczenia w dokumencie. image – już zdekodowany obraz PIL (opcjonalnie).
+    """
+    store = store or get_image_store()
+    digest = hashlib.sha256(data).hexdigest()
+    if not store.exists(digest):
+        store.put(digest, data, content_type)
+    if image is None:
+        with Image.open(io.BytesIO(data)) as decoded:
+            decoded.load()
+            miniatury = _store_thumbnails(digest, decoded, store)
+    else:
+        miniatury = _store_thumbnails(digest, image, store)
+    return {
+        'id': digest,
+        'nazwa': nazwa,
+        'typ': content_type,
+        'rozmiar': len(data),
+        'szerokosc': width,
+        'wysokosc': height,
+        'hash': digest,
+        'miniatury': miniatury,
+        'data_dodania': datetime.now(),
+    }
+
+def is_embedded(img):
+    """Czy zdjęcie jest zapisane po staremu (base64 w dokumencie)"""
+    return isinstance(img, dict) and 'data' in img
+
+@functools.lru_cache(maxsize=64)
+def _read_blob(image_id):
+    # Zawartość pod danym id nigdy się nie zmienia (id = hash), więc cache jest bezpieczny
+    return get_image_store().get(image_id)
+
+def needs_migration(img):
+    """Czy zdjęcie jest w base64 albo nie ma jeszcze miniatur"""
+    return is_embedded(img) or (isinstance(img, dict) and not img.get('miniatury'))
+
+def thumbnail_id(img, width):
+    """
+    Zwraca id najmniejszej miniatury nie węższej niż width
+    (lub największej dostępnej); None, gdy zdjęcie nie ma miniatur
+    """
+    miniatury = img.get('miniatury') if isinstance(img, dict) else None
+    if not miniatury:
+        return None
+    widths = sorted(int(w) for w in miniatury)
+    chosen = next((w for w in widths if w >= width), widths[-1])
+    return miniatury[str(chosen)]
+
+def load_image_bytes(img, width=None):
+    """
+    Zwraca bajty zdjęcia – z referencji lub (starsze dokumenty) z base64.
+    Jeśli podano width, zwraca pasującą miniaturę (o ile istnieje).
+    """
+    if is_embedded(img):
+        return base64.b64decode(img['data'])
+    if width is not None:
+        thumb = thumbnail_id(img, width)
+        if thumb:
+            return _read_blob(thumb)
+    return _read_blob(img['id'])
+
+
+def image_blob_ids(image_id):
+    """Pliki zdjęcia w magazynie: oryginał i miniatury z THUMBNAIL_WIDTHS"""
+    return [image_id] + [f"{image_id}_w{width}" for width in THUMBNAIL_WIDTHS]
+
+def delete_image(image_id, store=None):
+    """
+    Usuwa zdjęcie wraz z miniaturami. Zdjęcia są współdzielone przez dokumenty
+    (id = hash zawartości) – wywołujący sprawdza, że nic się już do niego nie odwołuje.
+    """
+    store = store or get_image_store()
+    for blob_id in image_blob_ids(image_id):
+        store.delete(blob_id)
+    _read_blob.cache_clear()
+
+
+def externalize_image(img, store=None):
+    """
+    Przenosi jedno zdjęcie base64 do magazynu (lub uzupełnia miniatury
+    referencji) i zwraca referencję
+    """
+    store = store or get_image_store()
+    data = base64.b64decode(img['data']) if is_embedded(img) else store.get(img['id'])
+    with Image.open(io.BytesIO(data)) as image:
+        image.load()
+        ref = store_image(data, img.get('nazwa', ''), image.width, image.height,
+                          img.get('typ') or 'image/jpeg', store=store, image=image)
+    if img.get('data_dodania'):
+        ref['data_dodania'] = img['data_dodania']
+    return ref
@@ -0,0 +1,52 @@
+"""
+Importuje dokumenty z eksportu Parquet (export_parquet.py) lub plików JSONL do bazy.
+
+Użycie:
+    python import_data.py eksport_20250701_120000
+    python import_data.py eksport --collections drzwi podlogi --rate 200
+    python import_data.py dane/drzwi.jsonl --overwrite
+    STORAGE_BACKEND=sqlite SQLITE_DB_PATH=staging.db python import_data.py eksport
+
+Postęp zapisywany jest w kolekcji migracje (import_<nazwa katalogu>) – ponowne
+uruchomienie po przerwaniu kontynuuje od ostatniej zapisanej grupy dokumentów.
+Pliki JSONL: <kolekcja>.jsonl, jeden dokument z polem 'id' w wierszu, daty w ISO 8601.
+"""
+import argparse
+import os
+
+from data_transfer import EXPORT_COLLECTIONS, IMPORT_MAX_RATE, IMPORT_WORKERS, import_collections
+from firebase_config import initialize_firebase
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('source', help="katalog eksportu Parquet, katalog z plikami .jsonl albo pojedynczy plik")
+    parser.add_argument('--collections', nargs='+', choices=EXPORT_COLLECTIONS)
+    parser.add_argument('--checkpoint', help="nazwa punktu kontrolnego (domyślnie nazwa źródła)")
+    parser.add_argument('--overwrite', action='store_true',
+                        help="aktualizuj istniejące dokumenty zamiast je pomijać (po zakończonym imporcie z --restart)")
+    parser.add_argument('--restart', action='store_true', help="zignoruj zapisany punkt kontrolny")
+    parser.add_argument('--rate', type=float, default=IMPORT_MAX_RATE,
+                        help="początkowy limit dokumentów/s (0 – bez limitu), rośnie o 50%% co 5 minut")
+    parser.add_argument('--workers', type=int, default=IMPORT_WORKERS)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.source):
+        parser.error(f"{args.source} nie istnieje")
+    db = initialize_firebase()
+    if db is None:
+        raise SystemExit("Nie udało się połączyć z bazą danych")
+
+    stats = import_collections(
+        db, args.source, args.collections, checkpoint_id=args.checkpoint, overwrite=args.overwrite,
+        restart=args.restart, max_rate=args.rate, max_workers=max(1, args.workers),
+        progress_callback=lambda s: print(
+            f"\r{s['documents']} dok. ({s['written']} zapisanych, {s['skipped']} pominiętych), "
+            f"{s['docs_per_second']:.0f} dok./s", end='', flush=True))
+    print()
+    print(f"Zaimportowano {stats['written']} dokumentów (pominięte istniejące: {stats['skipped']}) "
+          f"w {stats['seconds']:.1f} s ({stats['docs_per_second']:.0f} dok./s)")
+
+
+if __name__ == '__main__':
+    main()
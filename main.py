@@ -1,14 +1,18 @@
 import streamlit as st
 import hashlib
+import io
 import json
 import os
+import tempfile
+import zipfile
 from firebase_config import (
     setup_database,
-    get_all_drzwi,
-    get_all_podlogi,
-    get_all_drzwi_wejsciowe,
+    get_records_page,
+    paginated_records,
+    get_counts_for_collections,
+    PROTOCOL_STATUSES,
+    get_document_by_id,
     delete_record,
-    get_drafts_for_monter,
     delete_draft,
     # Nowe funkcje do zarządzania użytkownikami
     get_all_users,
@@ -18,14 +22,27 @@ from firebase_config import (
     update_user,
     delete_user,
     update_last_login,
-    init_default_users,
+    ensure_default_users,
+    get_startup_timings,
+    get_cache_stats,
+    get_breaker_stats,
+    invalidate_collection_cache,
+    migrate_updated_at,
+    rebuild_folder_index,
+    get_draft_autosaver,
+    flush_autosave_on_navigation,
+    get_snapshot_store,
+    start_collection_mirrors,
+    migrate_embedded_images,
 )
 
 def init_users():
-    """Inicjalizuje użytkowników w bazie Firebase"""
+    """Inicjalizuje użytkowników w bazie Firebase (sprawdzenie raz na proces)"""
     db = setup_database()
     if db:
-        init_default_users(db)
+        ensure_default_users(db)
+        # Mirrory startują ze snapshotu na dysku, zanim strony zaczną czytać kolekcje
+        start_collection_mirrors(db)
     return db
 
 def authenticate_user(username, password):
@@ -220,6 +237,174 @@ def admin_panel():
         
         st.markdown("---")
         
+        # Statystyki cache kolekcji
+        st.subheader("🗄️ Cache kolekcji")
+        cache_stats = get_cache_stats()
+        total_reads = cache_stats["hits"] + cache_stats["misses"]
+        hit_ratio = cache_stats["hits"] / total_reads * 100 if total_reads else 0
+        col_c1, col_c2, col_c3, col_c4 = st.columns(4)
+        with col_c1:
+            st.metric("✅ Trafienia", cache_stats["hits"])
+        with col_c2:
+            st.metric("❌ Chybienia", cache_stats["misses"])
+        with col_c3:
+            st.metric("📈 Skuteczność", f"{hit_ratio:.0f}%")
+        with col_c4:
+            st.metric("🧹 Unieważnienia", cache_stats["invalidations"])
+        
+        if cache_stats["collections"]:
+            cache_rows = [
+                {"Kolekcja": name, "Rekordy": info["records"], "Wiek (s)": info["age_s"]}
+                for name, info in cache_stats["collections"].items()
+            ]
+            st.dataframe(cache_rows, use_container_width=True, hide_index=True)
+        st.caption(f"TTL: {cache_stats['ttl_s']} s · Odczyty z mirrora: {cache_stats['mirror_hits']} · "
+                   f"Przeterminowane (awaria bazy): {cache_stats['stale_hits']}")
+        
+        if cache_stats["mirror"]:
+            mirror_rows = [
+                {"Kolekcja": name, "Rekordy": info["records"],
+                 "Listener": "🟢 aktywny" if info["active"] else "🔴 nieaktywny",
+                 "Start z": info["source"],
+                 "Snapshoty": info["snapshots"], "Ostatni snapshot (s temu)": info["age_s"]}
+                for name, info in cache_stats["mirror"].items()
+            ]
+            st.markdown("**📡 Mirror kolekcji (listenery on_snapshot)**")
+            st.dataframe(mirror_rows, use_container_width=True, hide_index=True)
+        snapshot_store = get_snapshot_store()
+        if snapshot_store is not None:
+            snapshot_stats = snapshot_store.stats()
+            if snapshot_stats:
+                st.caption("💽 Snapshot na dysku: " + " · ".join(
+                    f"{name} {info['records']} rek. (zapis {info['saved_at'].strftime('%H:%M:%S')})"
+                    for name, info in snapshot_stats.items()
+                ))
+        
+        if st.button("🧹 Wyczyść cache kolekcji"):
+            invalidate_collection_cache()
+            st.success("✅ Cache został wyczyszczony")
+
+        # Stan połączenia z bazą (circuit breaker)
+        st.subheader("🛡️ Połączenie z bazą danych")
+        breaker = get_breaker_stats()
+        breaker_labels = {
+            'closed': "🟢 sprawne",
+            'half_open': "🟡 próba połączenia",
+            'open': f"🔴 wstrzymane (ponowienie za {breaker['retry_in_s']} s)",
+        }
+        col_b1, col_b2, col_b3, col_b4 = st.columns(4)
+        with col_b1:
+            st.metric("Stan", breaker_labels[breaker['state']])
+        with col_b2:
+            st.metric("🔁 Ponowienia", breaker['retries'])
+        with col_b3:
+            st.metric("⛔ Otwarcia obwodu", breaker['trips'])
+        with col_b4:
+            st.metric("🚫 Odrzucone wywołania", breaker['rejected'])
+        if breaker['last_error']:
+            st.caption(f"Ostatni błąd: {breaker['last_error']}")
+        if db is not None:
+            autosave = get_draft_autosaver(db).stats()
+            st.caption(f"💾 Autozapis szkiców: zapisy {autosave['writes']} · scalone zmiany {autosave['coalesced']} · "
+                       f"w buforze {autosave['pending']} (ponawiane {autosave['retrying']}) · "
+                       f"odrzucone {autosave['rejected'] + autosave['dropped']}")
+
+        startup_timings = get_startup_timings()
+        if startup_timings:
+            st.caption("⏱️ Start procesu: " + " · ".join(
+                f"{phase} {seconds * 1000:.0f} ms" for phase, seconds in startup_timings.items()
+            ))
+
+        st.markdown("---")
+
+        # Migracja zdjęć base64 do magazynu zdjęć
+        st.subheader("📦 Migracja zdjęć do magazynu")
+        st.caption("Przenosi zdjęcia zapisane w dokumentach (base64) do Firebase Storage i zapisuje w dokumentach "
+                   "identyfikatory zdjęć – dopiero po niej usuwane są pliki zdjęć, których nikt już nie używa. "
+                   "Migrację można bezpiecznie przerwać i wznowić.")
+        if st.button("📦 Uruchom migrację zdjęć"):
+            migration_status = st.empty()
+            
+            def _report(collection_name, stats):
+                migration_status.text(
+                    f"{collection_name}: {stats['documents']} dokumentów, "
+                    f"{stats['images']} zdjęć, {stats['bytes'] / 1024 / 1024:.1f} MB"
+                )
+            
+            try:
+                stats = migrate_embedded_images(db, progress_callback=_report)
+                st.success(f"✅ Przeniesiono {stats['images']} zdjęć z {stats['documents']} dokumentów")
+            except Exception as e:
+                st.error(f"❌ Migracja przerwana: {e} – uruchom ponownie, aby wznowić")
+        
+        # Migracja znacznika updated_at (synchronizacja przyrostowa)
+        st.subheader("🔄 Znacznik modyfikacji (updated_at)")
+        st.caption("Uzupełnia updated_at w dokumentach zapisanych przed jego wprowadzeniem. "
+                   "Migrację można bezpiecznie przerwać i wznowić.")
+        if st.button("🔄 Uzupełnij updated_at"):
+            updated_at_status = st.empty()
+            
+            def _report_updated_at(collection_name, stats):
+                updated_at_status.text(
+                    f"{collection_name}: {stats['documents']} dokumentów, uzupełniono {stats['updated']}"
+                )
+            
+            try:
+                stats = migrate_updated_at(db, progress_callback=_report_updated_at)
+                st.success(f"✅ Uzupełniono updated_at w {stats['updated']} z {stats['documents']} dokumentów")
+            except Exception as e:
+                st.error(f"❌ Migracja przerwana: {e} – uruchom ponownie, aby wznowić")
+        
+        # Indeks folderów klientów (strona Foldery)
+        st.subheader("📁 Indeks folderów klientów")
+        st.caption("Odbudowuje kolekcję folderów na podstawie wszystkich protokołów "
+                   "(pierwsze uruchomienie lub naprawa). Najlepiej uruchamiać przy małym ruchu.")
+        if st.button("📁 Przebuduj foldery"):
+            folders_status = st.empty()
+            try:
+                stats = rebuild_folder_index(
+                    db, progress_callback=lambda stage, done: folders_status.text(f"Zapisano {done} operacji")
+                )
+                st.success(f"✅ Zbudowano {stats['folders']} folderów ({stats['protocols']} protokołów), "
+                           f"usunięto {stats['removed']} pustych")
+            except Exception as e:
+                st.error(f"❌ Przebudowa przerwana: {e} – uruchom ponownie")
+        
+        # Eksport danych do Parquet
+        st.subheader("📤 Eksport danych (Parquet)")
+        st.caption("Eksportuje protokoły i szkice do plików Parquet partycjonowanych po kolekcji i miesiącu "
+                   "(bez zdjęć – tylko ich identyfikatory). Duże eksporty: python export_parquet.py")
+        if st.button("📤 Eksportuj do Parquet"):
+            export_status = st.empty()
+            try:
+                # pyarrow ładowany dopiero przy eksporcie
+                from data_transfer import export_collections_parquet
+                # Pliki Parquet trafiają do katalogu tymczasowego, archiwum – do pamięci
+                with tempfile.TemporaryDirectory(prefix="eksport_") as export_dir:
+                    summary = export_collections_parquet(
+                        db, export_dir,
+                        progress_callback=lambda name, rows: export_status.text(f"{name}: {rows} dokumentów")
+                    )
+                    buffer = io.BytesIO()
+                    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+                        for root, _, files in os.walk(export_dir):
+                            for file_name in sorted(files):
+                                path = os.path.join(root, file_name)
+                                archive.write(path, os.path.relpath(path, export_dir))
+                st.session_state.export_archive = buffer.getvalue()
+                st.success("✅ Wyeksportowano: " + ", ".join(
+                    f"{name} {info['rows']}" + (f" (pominięte bez daty: {info['skipped']})" if info['skipped'] else "")
+                    for name, info in summary.items()
+                ))
+            except Exception as e:
+                st.error(f"❌ Eksport przerwany: {e}")
+        archive = st.session_state.get('export_archive')
+        if archive:
+            st.download_button("⬇️ Pobierz eksport (.zip)", archive, file_name="eksport.zip",
+                               mime="application/zip")
+        
+        st.markdown("---")
+        
         # Reset hasła administratora
         st.subheader("🔄 Reset hasła administratora")
         with st.form("reset_admin_password"):
@@ -284,21 +469,33 @@ def main_interface():
     
     try:
         db = setup_database()
+        flush_autosave_on_navigation(db, "main")
         
         if db is not None:
             st.success("✅ Baza danych została zainicjalizowana")
 
-            drzwi_count = len(get_all_drzwi(db))
-            podlogi_count = len(get_all_podlogi(db))
-            drzwi_wejsciowe_count = len(get_all_drzwi_wejsciowe(db))
+            # Liczniki z zapytań agregujących (bez pobierania dokumentów)
+            status_icons = {
+                'pomiary_wykonane': '📏',
+                'aktywny': '✅',
+                'zakończony': '🏁',
+                'anulowany': '❌',
+            }
+            metrics = [
+                ("Rekordy drzwi", 'drzwi'),
+                ("Rekordy podłóg", 'podlogi'),
+                ("Drzwi wejściowe", 'drzwi_wejsciowe'),
+            ]
+            # Liczniki trzech kolekcji pobierane współbieżnie
+            all_counts = get_counts_for_collections(db, [name for _, name in metrics])
 
-            col1, col2, col3 = st.columns(3)
-            with col1:
-                st.metric("Rekordy drzwi", drzwi_count)
-            with col2:
-                st.metric("Rekordy podłóg", podlogi_count)
-            with col3:
-                st.metric("Drzwi wejściowe", drzwi_wejsciowe_count)
+            for col, (label, name) in zip(st.columns(3), metrics):
+                counts = all_counts[name]
+                with col:
+                    st.metric(label, counts['total'])
+                    st.caption(" | ".join(
+                        f"{status_icons[s]} {counts['by_status'].get(s, 0)}" for s in PROTOCOL_STATUSES
+                    ))
             
             st.markdown("---")
             st.subheader("📚 Podgląd bazy danych")
@@ -306,7 +503,10 @@ def main_interface():
             tab1, tab2, tab3, tab4 = st.tabs(["🚪 Drzwi", "🚨 Drzwi wejściowe", "🏠 Podłogi", "🗂️ Szkice (Wymiary)"])
 
             with tab1:
-                drzwi = get_all_drzwi(db)
+                drzwi = paginated_records(
+                    "tab_drzwi",
+                    lambda size, cursor: get_records_page(db, 'drzwi', size, cursor),
+                )
                 if drzwi:
                     display = []
                     for r in drzwi:
@@ -329,7 +529,7 @@ def main_interface():
                             drzwi_ids = [r["ID"] for r in display]
                             selected_drzwi = st.selectbox("Wybierz rekord do podglądu/usunięcia:", options=[""]+drzwi_ids)
                             if selected_drzwi:
-                                rec = next((x for x in drzwi if x.get('id')==selected_drzwi), None)
+                                rec = get_document_by_id(db, 'drzwi', selected_drzwi)
                                 if rec:
                                     with st.expander("Podgląd danych (JSON)"):
                                         st.json(rec)
@@ -344,7 +544,10 @@ def main_interface():
                     st.info("📭 Brak rekordów w kolekcji 'drzwi'")
 
             with tab2:
-                drzwi_wejsciowe = get_all_drzwi_wejsciowe(db)
+                drzwi_wejsciowe = paginated_records(
+                    "tab_drzwi_wejsciowe",
+                    lambda size, cursor: get_records_page(db, 'drzwi_wejsciowe', size, cursor),
+                )
                 if drzwi_wejsciowe:
                     display_we = []
                     for r in drzwi_wejsciowe:
@@ -367,7 +570,7 @@ def main_interface():
                             drzwi_we_ids = [r["ID"] for r in display_we]
                             selected_drzwi_we = st.selectbox("Wybierz rekord do podglądu/usunięcia:", options=[""]+drzwi_we_ids, key="select_drzwi_we")
                             if selected_drzwi_we:
-                                rec_we = next((x for x in drzwi_wejsciowe if x.get('id')==selected_drzwi_we), None)
+                                rec_we = get_document_by_id(db, 'drzwi_wejsciowe', selected_drzwi_we)
                                 if rec_we:
                                     with st.expander("Podgląd danych (JSON)"):
                                         st.json(rec_we)
@@ -382,7 +585,10 @@ def main_interface():
                     st.info("📭 Brak rekordów w kolekcji 'drzwi_wejsciowe'")
 
             with tab3:
-                podlogi = get_all_podlogi(db)
+                podlogi = paginated_records(
+                    "tab_podlogi",
+                    lambda size, cursor: get_records_page(db, 'podlogi', size, cursor),
+                )
                 if podlogi:
                     display = []
                     for r in podlogi:
@@ -404,7 +610,7 @@ def main_interface():
                             podlogi_ids = [r["ID"] for r in display]
                             selected_podlogi = st.selectbox("Wybierz rekord do podglądu/usunięcia:", options=[""]+podlogi_ids, key="sel_podlogi")
                             if selected_podlogi:
-                                rec = next((x for x in podlogi if x.get('id')==selected_podlogi), None)
+                                rec = get_document_by_id(db, 'podlogi', selected_podlogi)
                                 if rec:
                                     with st.expander("Podgląd danych (JSON)"):
                                         st.json(rec)
@@ -419,7 +625,10 @@ def main_interface():
                     st.info("📭 Brak rekordów w kolekcji 'podlogi'")
 
             with tab4:
-                szkice = get_drafts_for_monter(db)
+                szkice = paginated_records(
+                    "tab_szkice",
+                    lambda size, cursor: get_records_page(db, 'wymiary_draft', size, cursor, order_field='updated_at'),
+                )
                 if szkice:
                     display = []
                     for r in szkice:
@@ -442,7 +651,7 @@ def main_interface():
                             szkice_ids = [r["ID"] for r in display]
                             selected_szkic = st.selectbox("Wybierz szkic do podglądu/usunięcia:", options=[""]+szkice_ids, key="sel_szkic")
                             if selected_szkic:
-                                rec = next((x for x in szkice if x.get('id')==selected_szkic), None)
+                                rec = get_document_by_id(db, 'wymiary_draft', selected_szkic)
                                 if rec:
                                     with st.expander("Podgląd szkicu (JSON)"):
                                         st.json(rec)
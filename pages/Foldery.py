@@ -1,14 +1,16 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime, timedelta, date
-import unicodedata
-import re
 
 from firebase_config import (
     setup_database,
-    get_all_drzwi,
-    get_all_podlogi,
-    get_all_drzwi_wejsciowe,
+    get_folders_page,
+    folder_day,
+    FOLDER_TIMEZONE,
+    get_folder_members,
+    folder_counts,
+    paginated_records,
+    flush_autosave_on_navigation,
     get_document_by_id,
     update_document,
     display_images
@@ -35,40 +37,21 @@ def can_view_records():
     return user_role in ['admin', 'sprzedawca', 'monter']
 
 
-def _normalize_name(text: str) -> str:
-    if not text:
-        return "nieznany_klient"
-    norm = unicodedata.normalize('NFKD', text)
-    norm = norm.encode('ascii', 'ignore').decode('ascii')
-    norm = re.sub(r'[^a-zA-Z0-9]+', '_', norm).strip('_').lower()
-    return norm or "nieznany_klient"
-
-
-
-def _as_dt(value) -> datetime:
-    if isinstance(value, datetime):
-        return value
-    if isinstance(value, date):
-        return datetime.combine(value, datetime.min.time())
-    if isinstance(value, str):
-        try:
-            return datetime.fromisoformat(value)
-        except Exception:
-            return datetime.min
-    return datetime.min
-
-
-def _folder_name(rec: dict) -> tuple[str, datetime]:
-    name = rec.get('imie_nazwisko') or rec.get('nazwisko') or ''
-    # preferuj data_pomiary, w przeciwnym razie data_utworzenia
-    dt = _as_dt(rec.get('data_pomiary') or rec.get('data_utworzenia'))
-    day = dt.strftime('%d') if dt != datetime.min else '00'
-    month = dt.strftime('%m') if dt != datetime.min else '00'
-    year = dt.strftime('%Y') if dt != datetime.min else '0000'
+def _date_bounds(date_filter, start_date=None, end_date=None):
+    """Zamienia wybrany zakres dat na granice (od, do) zapytania po dacie folderu"""
+    today = datetime.now(FOLDER_TIMEZONE).date()
+    if date_filter == "Dziś":
+        start, end = today, today
+    elif date_filter == "Ostatnie 7 dni":
+        start, end = today - timedelta(days=7), None
+    elif date_filter == "Ostatnie 30 dni":
+        start, end = today - timedelta(days=30), None
+    elif date_filter == "Zakres..." and start_date and end_date:
+        start, end = start_date, end_date
+    else:
+        return None, None
 
-    n = _normalize_name(name)
-    folder = f"{n}_{day}_{month}_{year}"
-    return folder, dt
+    return folder_day(start), folder_day(end) if end else None
 
 
 def page_foldery():
@@ -191,26 +174,7 @@ def page_foldery():
     if db is None:
         st.error("❌ Brak połączenia z bazą danych")
         st.stop()
-
-    with st.spinner("Ładowanie danych..."):
-        drzwi = get_all_drzwi(db)
-        podlogi = get_all_podlogi(db)
-        drzwi_wejsciowe = get_all_drzwi_wejsciowe(db)
-
-    # Przygotuj rekordy z typem
-    all_records = []
-    for r in drzwi:
-        r2 = r.copy()
-        r2['__type'] = 'drzwi'
-        all_records.append(r2)
-    for r in podlogi:
-        r2 = r.copy()
-        r2['__type'] = 'podlogi'
-        all_records.append(r2)
-    for r in drzwi_wejsciowe:
-        r2 = r.copy()
-        r2['__type'] = 'drzwi_wejsciowe'
-        all_records.append(r2)
+    flush_autosave_on_navigation(db, "foldery")
 
     # Filtry
     st.subheader("🔎 Filtry")
@@ -242,76 +206,51 @@ def page_foldery():
             "Typ pomiaru:", ["drzwi", "drzwi_wejsciowe", "podlogi"], default=["drzwi", "drzwi_wejsciowe", "podlogi"],
         )
 
-    # Zastosuj filtry
-    def _in_date(dt: datetime) -> bool:
-        d = dt.date()
-        if date_filter == "Wszystko":
-            return True
-        if date_filter == "Dziś":
-            return d == date.today()
-        if date_filter == "Ostatnie 7 dni":
-            return d >= date.today() - timedelta(days=7)
-        if date_filter == "Ostatnie 30 dni":
-            return d >= date.today() - timedelta(days=30)
-        if date_filter == "Zakres...":
-            if not (start_date and end_date):
-                return True
-            return start_date <= d <= end_date
-        return True
-
-    filtered = []
-    for rec in all_records:
-        if rec.get('__type') not in types_selected:
-            continue
-        folder, dt = _folder_name(rec)
-        if not _in_date(dt):
-            continue
-        if monter_filter and monter_filter.lower() not in str(rec.get('monter_id', '')).lower():
-            continue
-        # Filtr po imieniu i nazwisku klienta
-        if klient_filter and klient_filter.lower() not in str(rec.get('imie_nazwisko', '')).lower():
-            continue
-        rec['__folder'] = folder
-        rec['__dt'] = dt
-        filtered.append(rec)
-
-    # Grupowanie po folderze
-    groups = {}
-    for rec in filtered:
-        folder = rec['__folder']
-        if folder not in groups:
-            groups[folder] = {
-                'dt': rec['__dt'],
-                'items': [],
-            }
-        groups[folder]['items'].append(rec)
+    # Pobierz bieżącą stronę folderów (filtry stosowane są przy pobieraniu strony,
+    # protokoły folderu wczytywane są dopiero po jego otwarciu)
+    date_from, date_to = _date_bounds(date_filter, start_date, end_date)
+    with st.spinner("Ładowanie folderów..."):
+        folders = paginated_records(
+            "foldery",
+            lambda size, cursor: get_folders_page(db, size, cursor, date_from=date_from, date_to=date_to,
+                                                  types=types_selected, monter=monter_filter,
+                                                  klient=klient_filter),
+            reset_token=(date_filter, start_date, end_date, tuple(types_selected), monter_filter, klient_filter),
+        )
+    filtered = [(folder, list(folder['czlonkowie'].values())) for folder in folders]
 
     # Statystyki
     st.markdown("---")
     col_s1, col_s2, col_s3 = st.columns(3)
     with col_s1:
-        st.metric("📁 Liczba folderów", len(groups))
+        st.metric("📁 Liczba folderów", len(filtered))
     with col_s2:
-        st.metric("📄 Liczba pomiarów", len(filtered))
+        st.metric("📄 Pomiary na stronie", sum(len(members) for _, members in filtered))
     with col_s3:
-        today_count = sum(1 for g in groups.values() if g['dt'].date() == date.today())
+        today = datetime.now(FOLDER_TIMEZONE).date()
+        today_count = sum(1 for folder, _ in filtered
+                          if folder.get('data_folderu') and folder['data_folderu'].date() == today)
         st.metric("🆕 Foldery z dziś", today_count)
 
     st.markdown("---")
 
-    if not groups:
+    if not filtered:
         st.info("📭 Brak folderów dla wybranych filtrów")
         return
 
-    # Sortuj foldery po dacie malejąco
-    sorted_groups = sorted(groups.items(), key=lambda kv: kv[1]['dt'], reverse=True)
+    type_icons = {'drzwi': '🚪', 'drzwi_wejsciowe': '🚨', 'podlogi': '🏠'}
 
-    # Renderuj w akordeonach
-    for folder_name, data in sorted_groups:
-        items = data['items']
-        dt = data['dt']
-        nice_label = f"{folder_name}  ·  {dt.strftime('%Y-%m-%d %H:%M') if dt != datetime.min else ''}  ·  {len(items)} pomiar(y)"
+    # Renderuj w akordeonach (foldery są już posortowane po dacie malejąco)
+    for folder, members in filtered:
+        folder_name = folder['id']
+        dt = folder.get('data_folderu')
+        counts = folder_counts(members)
+        counts_label = " ".join(f"{type_icons[t]} {n}" for t, n in counts.items() if n)
+        nice_label = f"{folder_name}  ·  {dt.strftime('%Y-%m-%d') if dt else ''}  ·  {counts_label}"
         with st.expander(nice_label, expanded=False):
+            if not st.toggle("📂 Pokaż protokoły", key=f"open_{folder_name}"):
+                continue
+            items = get_folder_members(db, members)
             rows = []
             for it in items:
                 if it.get('__type') == 'drzwi':
@@ -6,8 +6,9 @@ import base64
 from datetime import datetime
 from firebase_config import (
     setup_database, save_pomiary_data, generate_share_link,
-    get_forms_for_completion, complete_form_by_seller, get_form_by_access_code,
-    save_draft_data, display_images
+    get_forms_for_completion, complete_form_by_seller, find_form_by_access_code,
+    display_images, get_document_by_id, autosave_draft, save_autosaved_draft,
+    autosave_caption, flush_autosave_on_navigation
 )
 import os
 from pdf_generator import display_pdf_download_button
@@ -240,43 +241,48 @@ def formularz_montera_drzwi():
     norma = st.selectbox("Norma/Szkic:", ["PL", "CZ"], key="norma_monter")
     uwagi_montera = st.text_area("Uwagi montera:", height=100, key="uwagi_montera")
     
-    save_draft_clicked = st.button("🗂️ Zapisz do przechowalni", type="primary")
+    dane_pomiary = {
+        "pomieszczenie": pomieszczenie,
+        "imie_nazwisko": imie_nazwisko,
+        "telefon": telefon,
+        "szerokosc_otworu": szerokosc_otworu,
+        "wysokosc_otworu": wysokosc_otworu,
+        "mierzona_od": mierzona_od,
+        "typ_drzwi": typ_drzwi,
+        "norma": norma,
+        "grubosc_muru": grubosc_muru,
+        "stan_sciany": stan_sciany,
+        "oscieznica": oscieznica,
+        "opaska": opaska,
+        "kat_zaciecia": kat_zaciecia,
+        "prog": prog,
+        "wizjer": wizjer,
+        "strona_otwierania": {
+            "lewe_przyl": strona_otwierania == "LEWE",
+            "prawe_przyl": strona_otwierania == "PRAWE",
+            "lewe_odwr": strona_otwierania == "LEWE odwrotna przylga",
+            "prawe_odwr": strona_otwierania == "PRAWE odwrotna przylga"
+        },
+        "napis_nad_drzwiami": napis_nad_drzwiami,
+        "szerokosc_skrzydla": szerokosc_skrzydla,
+        "uwagi_montera": uwagi_montera,
+    }
 
-    # ZAPIS DO PRZECHOWALNI (szkic)
-    if save_draft_clicked:
-        dane_pomiary = {
-            "pomieszczenie": pomieszczenie,
-            "imie_nazwisko": imie_nazwisko,
-            "telefon": telefon,
-            "szerokosc_otworu": szerokosc_otworu,
-            "wysokosc_otworu": wysokosc_otworu,
-            "mierzona_od": mierzona_od,
-            "typ_drzwi": typ_drzwi,
-            "norma": norma,
-            "grubosc_muru": grubosc_muru,
-            "stan_sciany": stan_sciany,
-            "oscieznica": oscieznica,
-            "opaska": opaska,
-            "kat_zaciecia": kat_zaciecia,
-            "prog": prog,
-            "wizjer": wizjer,
-            "strona_otwierania": {
-                "lewe_przyl": strona_otwierania == "LEWE",
-                "prawe_przyl": strona_otwierania == "PRAWE",
-                "lewe_odwr": strona_otwierania == "LEWE odwrotna przylga",
-                "prawe_odwr": strona_otwierania == "PRAWE odwrotna przylga"
-            },
-            "napis_nad_drzwiami": napis_nad_drzwiami,
-            "szerokosc_skrzydla": szerokosc_skrzydla,
-            "uwagi_montera": uwagi_montera,
-        }
+    # Autozapis – zmienione pola trafiają do szkicu w tle
+    autosave_id = autosave_draft(db, "autosave_drzwi", dane_pomiary,
+                                 collection_target="drzwi", monter_id=monter_id)
+    st.caption(autosave_caption(db, autosave_id))
 
+    # ZAPIS DO PRZECHOWALNI (szkic)
+    if st.button("🗂️ Zapisz do przechowalni", type="primary"):
         # Pozwalamy zapisać szkic nawet z brakami
         with st.spinner("Zapisywanie szkicu..."):
-            draft_id = save_draft_data(db, "drzwi", dane_pomiary, monter_id)
-            if draft_id:
+            draft_id, saved = save_autosaved_draft(db, "autosave_drzwi", "drzwi", dane_pomiary, monter_id)
+            if saved:
                 st.success(f"🗂️ Szkic zapisany (ID: {draft_id}). Możesz wrócić i dokończyć później na stronie 'Przechowalnia'.")
                 st.info("📷 **Zdjęcia można dodać w przechowalni po wybraniu szkicu**")
+            elif draft_id:
+                st.warning(f"⚠️ Brak połączenia – szkic {draft_id} czeka w buforze i zostanie zapisany automatycznie.")
             else:
                 st.error("❌ Nie udało się zapisać szkicu")
 
@@ -306,10 +312,13 @@ def formularz_sprzedawcy_drzwi():
             if st.button("🔍 Znajdź formularz"):
                 if kod_dostepu:
                     with st.spinner("Wyszukiwanie formularza..."):
-                        selected_form = get_form_by_access_code(db, "drzwi", kod_dostepu)
+                        found_form = find_form_by_access_code(db, kod_dostepu)
                         
-                        if selected_form:
+                        if found_form and found_form['__type'] == "drzwi":
+                            selected_form = found_form
                             st.success("✅ Formularz znaleziony!")
+                        elif found_form:
+                            st.warning(f"⚠️ Ten kod należy do protokołu typu: {found_form['__type']}")
                         else:
                             st.error("❌ Nie znaleziono formularza z tym kodem")
                 else:
@@ -404,7 +413,8 @@ def formularz_sprzedawcy_drzwi():
             if selected_display:
                 # Znajdź formularz na podstawie wybranego displayu
                 selected_index = form_options.index(selected_display) - 1  # -1 bo pierwszy element to pusty
-                selected_form = filtered_forms[selected_index]
+                # Lista zawiera tylko podsumowania – pobierz pełny dokument
+                selected_form = get_document_by_id(db, "drzwi", filtered_forms[selected_index]['id'])
         else:
             st.info("📭 Brak formularzy oczekujących na uzupełnienie")
     
@@ -862,33 +872,38 @@ def formularz_montera_podlogi():
     # Ostrzeżenie
     st.warning("⚠️ UWAGA!! Podłoże powinno być suche i równe!!")
     
+    dane_pomiary = {
+        "pomieszczenie": pomieszczenie,
+        "imie_nazwisko": imie_nazwisko,
+        "telefon": telefon,
+        "system_montazu": system_montazu,
+        "podklad": podklad,
+        "mdf_mozliwy": mdf_mozliwy,
+        "nw": nw,
+        "nz": nz,
+        "l": l,
+        "zl": zl,
+        "zp": zp,
+        "listwy_jaka": listwy_jaka,
+        "listwy_ile": listwy_ile,
+        "listwy_gdzie": listwy_gdzie,
+        "uwagi_montera": uwagi_montera,
+        # Pola sprzedawcy - puste na razie
+        "rodzaj_podlogi": "",
+        "seria": "",
+        "kolor": "",
+        "folia": "",
+        "listwa_przypodlogowa": "",
+        "uwagi": ""
+    }
+
+    # Autozapis – zmienione pola trafiają do szkicu w tle
+    autosave_id = autosave_draft(db, "autosave_podlogi", dane_pomiary,
+                                 collection_target="podlogi", monter_id=monter_id)
+    st.caption(autosave_caption(db, autosave_id))
+
     # Zapisz do przechowalni
     if st.button("🗂️ Zapisz do przechowalni", type="primary"):
-        dane_pomiary = {
-            "pomieszczenie": pomieszczenie,
-            "imie_nazwisko": imie_nazwisko,
-            "telefon": telefon,
-            "system_montazu": system_montazu,
-            "podklad": podklad,
-            "mdf_mozliwy": mdf_mozliwy,
-            "nw": nw,
-            "nz": nz,
-            "l": l,
-            "zl": zl,
-            "zp": zp,
-            "listwy_jaka": listwy_jaka,
-            "listwy_ile": listwy_ile,
-            "listwy_gdzie": listwy_gdzie,
-            "uwagi_montera": uwagi_montera,
-            # Pola sprzedawcy - puste na razie
-            "rodzaj_podlogi": "",
-            "seria": "",
-            "kolor": "",
-            "folia": "",
-            "listwa_przypodlogowa": "",
-            "uwagi": ""
-        }
-        
         # Sprawdź wymagane pola
         wymagane_pola = ["pomieszczenie", "imie_nazwisko", "telefon"]
         brakujace_pola = [pole for pole in wymagane_pola if not dane_pomiary.get(pole)]
@@ -897,9 +912,9 @@ def formularz_montera_podlogi():
             st.error(f"❌ Proszę wypełnić wymagane pola: {', '.join(brakujace_pola)}")
         else:
             with st.spinner("Zapisywanie szkicu do przechowalni..."):
-                draft_id = save_draft_data(db, "podlogi", dane_pomiary, monter_id)
+                draft_id, saved = save_autosaved_draft(db, "autosave_podlogi", "podlogi", dane_pomiary, monter_id)
                 
-                if draft_id:
+                if saved:
                     st.success(f"✅ Szkic pomiarów został zapisany do przechowalni! ID: {draft_id}")
                     st.info("📋 **Szkic można teraz edytować i finalizować w sekcji 'Przechowalnia'**")
                     st.info("📷 **Zdjęcia można dodać w przechowalni po wybraniu szkicu**")
@@ -907,6 +922,8 @@ def formularz_montera_podlogi():
                     # Pokaż zapisane dane
                     with st.expander("Pokaż zapisany szkic"):
                         st.json(dane_pomiary)
+                elif draft_id:
+                    st.warning(f"⚠️ Brak połączenia – szkic {draft_id} czeka w buforze i zostanie zapisany automatycznie.")
                 else:
                     st.error("❌ Błąd podczas zapisywania szkicu!")
 
@@ -979,42 +996,50 @@ def formularz_montera_drzwi_wejsciowe():
         if prawe:
             st.markdown("*Prawe otwieranie*")
     
+    dane_szkicu = {
+        "numer_strony": numer_strony,
+        "imie_nazwisko": imie_nazwisko,
+        "telefon": telefon,
+        "pomieszczenie": pomieszczenie,
+        "szerokosc_otworu": szerokosc_otworu,
+        "wysokosc_otworu": wysokosc_otworu,
+        "mierzona_od": mierzona_od,
+        "skrot": skrot,
+        "grubosc_muru": grubosc_muru,
+        "stan_sciany": stan_sciany,
+        "oscieznica": oscieznica,
+        "okapnik": okapnik,
+        "prog": prog,
+        "wizjer": wizjer,
+        "elektrozaczep": elektrozaczep,
+        "strona_otwierania": {
+            "na_zewnatrz": na_zewnatrz,
+            "do_wewnatrz": do_wewnatrz,
+            "lewe": lewe,
+            "prawe": prawe
+        },
+        "uwagi_montera": uwagi_montera,
+        "collection_target": "drzwi_wejsciowe"  # Ważne dla szkiców
+    }
+
+    # Autozapis – zmienione pola trafiają do szkicu w tle
+    autosave_id = autosave_draft(db, "autosave_drzwi_wejsciowe", dane_szkicu,
+                                 collection_target="drzwi_wejsciowe", monter_id=monter_id)
+    st.caption(autosave_caption(db, autosave_id))
+
     szkic_button = st.button("🗂️ Zapisz do przechowalni", type="primary")
     
     if szkic_button:
-        dane_szkicu = {
-            "numer_strony": numer_strony,
-                "imie_nazwisko": imie_nazwisko,
-                "telefon": telefon,
-                "pomieszczenie": pomieszczenie,
-                "szerokosc_otworu": szerokosc_otworu,
-                "wysokosc_otworu": wysokosc_otworu,
-                "mierzona_od": mierzona_od,
-                "skrot": skrot,
-                "grubosc_muru": grubosc_muru,
-                "stan_sciany": stan_sciany,
-                "oscieznica": oscieznica,
-                "okapnik": okapnik,
-                "prog": prog,
-                "wizjer": wizjer,
-                "elektrozaczep": elektrozaczep,
-                "strona_otwierania": {
-                    "na_zewnatrz": na_zewnatrz,
-                    "do_wewnatrz": do_wewnatrz,
-                    "lewe": lewe,
-                    "prawe": prawe
-                },
-                "uwagi_montera": uwagi_montera,
-                "collection_target": "drzwi_wejsciowe"  # Ważne dla szkiców
-        }
-            
         with st.spinner("Zapisywanie szkicu..."):
-            success = save_draft_data(db, "drzwi_wejsciowe", dane_szkicu, monter_id)
+            draft_id, saved = save_autosaved_draft(db, "autosave_drzwi_wejsciowe", "drzwi_wejsciowe",
+                                                   dane_szkicu, monter_id)
             
-            if success:
+            if saved:
                 st.success("📝 Szkic został zapisany w kwarantannie!")
                 st.info("💡 Możesz kontynuować edycję w zakładce 'Przechowalnia'")
                 st.info("📷 **Zdjęcia można dodać w przechowalni po wybraniu szkicu**")
+            elif draft_id:
+                st.warning(f"⚠️ Brak połączenia – szkic {draft_id} czeka w buforze i zostanie zapisany automatycznie.")
             else:
                 st.error("❌ Błąd podczas zapisywania szkicu!")
 
@@ -1045,10 +1070,13 @@ def formularz_sprzedawcy_podlogi():
             if st.button("🔍 Znajdź formularz", key="znajdz_podlogi"):
                 if kod_dostepu:
                     with st.spinner("Wyszukiwanie formularza..."):
-                        selected_form = get_form_by_access_code(db, "podlogi", kod_dostepu)
+                        found_form = find_form_by_access_code(db, kod_dostepu)
                         
-                        if selected_form:
+                        if found_form and found_form['__type'] == "podlogi":
+                            selected_form = found_form
                             st.success("✅ Formularz znaleziony!")
+                        elif found_form:
+                            st.warning(f"⚠️ Ten kod należy do protokołu typu: {found_form['__type']}")
                         else:
                             st.error("❌ Nie znaleziono formularza z tym kodem")
                 else:
@@ -1148,7 +1176,8 @@ def formularz_sprzedawcy_podlogi():
             if selected_display:
                 # Znajdź formularz na podstawie wybranego displayu
                 selected_index = form_options_p.index(selected_display) - 1  # -1 bo pierwszy element to pusty
-                selected_form = filtered_forms_p[selected_index]
+                # Lista zawiera tylko podsumowania – pobierz pełny dokument
+                selected_form = get_document_by_id(db, "podlogi", filtered_forms_p[selected_index]['id'])
         else:
             st.info("📭 Brak formularzy oczekujących na uzupełnienie")
     
@@ -1365,10 +1394,13 @@ def formularz_sprzedawcy_drzwi_wejsciowe():
             if st.button("🔍 Znajdź formularz"):
                 if kod_dostepu:
                     with st.spinner("Wyszukiwanie formularza..."):
-                        selected_form = get_form_by_access_code(db, "drzwi_wejsciowe", kod_dostepu)
+                        found_form = find_form_by_access_code(db, kod_dostepu)
                         
-                        if selected_form:
+                        if found_form and found_form['__type'] == "drzwi_wejsciowe":
+                            selected_form = found_form
                             st.success("✅ Formularz znaleziony!")
+                        elif found_form:
+                            st.warning(f"⚠️ Ten kod należy do protokołu typu: {found_form['__type']}")
                         else:
                             st.error("❌ Nie znaleziono formularza z tym kodem")
                 else:
@@ -1464,7 +1496,8 @@ def formularz_sprzedawcy_drzwi_wejsciowe():
             if selected_display:
                 # Znajdź formularz na podstawie wybranego displayu
                 selected_index = form_options_dw.index(selected_display) - 1  # -1 bo pierwszy element to pusty
-                selected_form = filtered_forms[selected_index]
+                # Lista zawiera tylko podsumowania – pobierz pełny dokument
+                selected_form = get_document_by_id(db, "drzwi_wejsciowe", filtered_forms[selected_index]['id'])
         else:
             st.info("📭 Brak formularzy oczekujących na uzupełnienie")
     
@@ -1688,6 +1721,8 @@ def main():
             ["🚪 Drzwi", "🚨 Drzwi wejściowe", "🏠 Podłogi"],
             key="typ_pomiarow"
         )
+        # Zmiana formularza czyści jego pola – wyślij najpierw autozapis
+        flush_autosave_on_navigation(setup_database(), f"pomiary:{typ_pomiarow}")
         
         if typ_pomiarow == "🚪 Drzwi":
             formularz_montera_drzwi()
@@ -1697,6 +1732,7 @@ def main():
             formularz_montera_podlogi()
     
     else:
+        flush_autosave_on_navigation(setup_database(), "sprzedawca")
         st.sidebar.markdown("### 👔 Tryb: Sprzedawca")
         st.sidebar.markdown("Uzupełnij dane produktu i sfinalizuj zamówienie")
         
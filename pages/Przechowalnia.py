@@ -8,11 +8,17 @@ from firebase_config import (
     update_draft_data,
     delete_draft,
     finalize_draft,
+    finalize_drafts_bulk,
     display_images_with_edit,
     add_images_to_draft,
-    update_draft_images,
+    remove_images_from_draft,
     create_image_uploader,
     process_uploaded_images,
+    get_document_by_id,
+    get_draft_autosaver,
+    autosave_draft,
+    autosave_caption,
+    flush_autosave_on_navigation,
 )
 
 # ZABEZPIECZENIE - sprawdź logowanie przed załadowaniem strony
@@ -29,9 +35,8 @@ def finalize_all_drafts(db, drafts):
         st.warning("⚠️ Brak protokołów do finalizacji")
         return
     
-    success_count = 0
-    error_count = 0
-    results = []
+    drafts_by_id = {d['id']: d for d in drafts if d.get('id')}
+    error_count = len(drafts) - len(drafts_by_id)
     
     # Progress bar
     progress_bar = st.progress(0)
@@ -39,50 +44,29 @@ def finalize_all_drafts(db, drafts):
     
     total_drafts = len(drafts)
     
-    for i, draft in enumerate(drafts):
-        draft_id = draft.get('id')
-        if not draft_id:
-            error_count += 1
-            continue
-            
-        # Aktualizuj progress
-        progress = (i + 1) / total_drafts
-        progress_bar.progress(progress)
-        status_text.text(f"Przetwarzanie protokołu {i+1}/{total_drafts}...")
-        
-        try:
-            # Finalizuj szkic
-            doc_id, kod = finalize_draft(db, draft_id)
-            if doc_id:
-                success_count += 1
-                results.append({
-                    'draft_id': draft_id,
-                    'doc_id': doc_id,
-                    'kod': kod,
-                    'status': 'success',
-                    'typ': draft.get('collection_target', ''),
-                    'klient': draft.get('imie_nazwisko', ''),
-                    'pomieszczenie': draft.get('pomieszczenie', '')
-                })
-            else:
-                error_count += 1
-                results.append({
-                    'draft_id': draft_id,
-                    'status': 'error',
-                    'typ': draft.get('collection_target', ''),
-                    'klient': draft.get('imie_nazwisko', ''),
-                    'pomieszczenie': draft.get('pomieszczenie', '')
-                })
-        except Exception as e:
+    def _on_progress(done_chunks, total_chunks, done_drafts, planned_drafts):
+        progress_bar.progress(done_drafts / planned_drafts if planned_drafts else 1.0)
+        status_text.text(f"Zapisano porcję {done_chunks}/{total_chunks} "
+                         f"({done_drafts}/{planned_drafts} protokołów)...")
+    
+    # Zapis i usunięcie szkiców w batchach (po max. 500 operacji)
+    status_text.text(f"Przygotowywanie {len(drafts_by_id)} protokołów...")
+    bulk_results = finalize_drafts_bulk(db, list(drafts_by_id), progress_callback=_on_progress)
+    
+    results = []
+    success_count = 0
+    for result in bulk_results:
+        draft = drafts_by_id.get(result['draft_id'], {})
+        if result['status'] == 'success':
+            success_count += 1
+        else:
             error_count += 1
-            results.append({
-                'draft_id': draft_id,
-                'status': 'error',
-                'error': str(e),
-                'typ': draft.get('collection_target', ''),
-                'klient': draft.get('imie_nazwisko', ''),
-                'pomieszczenie': draft.get('pomieszczenie', '')
-            })
+        results.append({
+            **result,
+            'typ': result.get('typ') or draft.get('collection_target', ''),
+            'klient': draft.get('imie_nazwisko', ''),
+            'pomieszczenie': draft.get('pomieszczenie', '')
+        })
     
     # Ukryj progress bar
     progress_bar.empty()
@@ -120,6 +104,7 @@ def page_wymiary():
 
 
     db = setup_database()
+    flush_autosave_on_navigation(db, "przechowalnia")
 
     st.markdown("""
     Na tej stronie znajdują się protokoły pomiarów zapisane przez montera, które nie zostały jeszcze
@@ -254,17 +239,17 @@ def page_wymiary():
     selected_id = st.selectbox("Wybierz protokół:", options=[""] + draft_ids, format_func=format_draft_option)
 
     if selected_id:
-        # Pobierz najświeższe dane szkicu z bazy danych
-        try:
-            fresh_draft_doc = db.collection('wymiary_draft').document(selected_id).get()
-            if not fresh_draft_doc.exists:
-                st.error("❌ Nie znaleziono protokołu")
-                return
-            draft = fresh_draft_doc.to_dict()
-            draft['id'] = fresh_draft_doc.id
-
-        except Exception as e:
-            st.error(f"❌ Błąd podczas pobierania protokołu: {e}")
+        # Dane szkicu wczytywane są raz na wybór (po wysłaniu zaległego autozapisu) –
+        # kolejne przebiegi strony nie wymuszają zapisu, więc autozapis zachowuje opóźnienie
+        loaded = st.session_state.get('przechowalnia_draft')
+        if loaded is None or loaded['id'] != selected_id:
+            get_draft_autosaver(db).flush([selected_id])
+            loaded = st.session_state['przechowalnia_draft'] = {
+                'id': selected_id, 'data': get_document_by_id(db, 'wymiary_draft', selected_id)}
+        draft = loaded['data']
+        if not draft:
+            st.session_state.pop('przechowalnia_draft', None)
+            st.error("❌ Nie znaleziono protokołu")
             return
 
         st.markdown("---")
@@ -524,6 +509,10 @@ def page_wymiary():
                 'uwagi_montera': uwagi_montera,
             }
 
+        # Autozapis – zmienione pola trafiają do szkicu w tle
+        autosave_draft(db, f"autosave_edit_{selected_id}", updates, draft_id=selected_id)
+        st.caption(autosave_caption(db, selected_id))
+
         # ========================
         # ZARZĄDZANIE ZDJĘCIAMI
         # ========================
@@ -532,13 +521,15 @@ def page_wymiary():
         existing_images = draft.get('zdjecia', [])
         
         if existing_images:
-            remaining_images = display_images_with_edit(existing_images, selected_id, max_width=250)
+            images_to_delete = display_images_with_edit(existing_images, selected_id, max_width=250)
             
-            if len(remaining_images) != len(existing_images):
-                if update_draft_images(db, selected_id, remaining_images):
-                    st.success(f"✅ Zaktualizowano zdjęcia w szkicu (pozostało: {len(remaining_images)})")
-                    if len(remaining_images) == 0:
+            if images_to_delete:
+                remaining_count = len(existing_images) - len(images_to_delete)
+                if remove_images_from_draft(db, selected_id, images_to_delete):
+                    st.success(f"✅ Zaktualizowano zdjęcia w szkicu (pozostało: {remaining_count})")
+                    if remaining_count == 0:
                         st.info("📷 Wszystkie zdjęcia zostały usunięte ze szkicu")
+                    st.session_state.pop('przechowalnia_draft', None)
                     st.rerun() 
                 else:
                     st.error("❌ Błąd podczas aktualizacji zdjęć")
@@ -573,6 +564,7 @@ def page_wymiary():
                                 # Dodaj do szkicu
                                 if add_images_to_draft(db, selected_id, new_images_data):
                                     st.success(f"✅ Dodano {len(new_images_data)} nowych zdjęć do szkicu!")
+                                    st.session_state.pop('przechowalnia_draft', None)
                                     st.rerun()
                                 else:
                                     st.error("❌ Błąd podczas dodawania zdjęć do szkicu")
@@ -585,6 +577,8 @@ def page_wymiary():
         col_a, col_b, col_c = st.columns(3)
         with col_a:
             if st.button("💾 Zapisz zmiany"):
+                # Pełny zapis obejmuje zmiany czekające w autozapisie
+                get_draft_autosaver(db).discard(selected_id)
                 if update_draft_data(db, selected_id, updates):
                     st.success("✅ Zapisano zmiany w szkicu")
         with col_b:
@@ -610,6 +604,7 @@ def page_wymiary():
                 if st.button("✅ TAK - USUŃ SZKIC", type="primary"):
                     if delete_draft(db, selected_id):
                         st.success("✅ Szkic usunięty")
+                        st.session_state.pop('przechowalnia_draft', None)
                         st.session_state[f'confirm_delete_{selected_id}'] = False
                         st.rerun()
                     else:
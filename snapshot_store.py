@@ -0,0 +1,140 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from sqlite_backend import _decode, _encode
+
+# ===================
+# Snapshot kolekcji na dysku
+# ===================
+#
+# Mirror kolekcji (firebase_config.CollectionMirror) zapisuje tu swoje
+# rekordy "summary" razem z watermarkiem – czasem odczytu ostatniego
+# przetworzonego snapshotu Firestore. Po restarcie procesu mirror wczytuje
+# rekordy z dysku (od razu gotowe do obsługi stron), a z Firestore pobiera
+# tylko dokumenty i znaczniki usunięć z updated_at >= watermark.
+#
+# Snapshot to lokalna kopia robocza: można go w każdej chwili usunąć –
+# mirror zbuduje go ponownie z pełnego odczytu kolekcji.
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    collection TEXT NOT NULL,
+    id TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (collection, id)
+);
+CREATE TABLE IF NOT EXISTS watermarks (
+    collection TEXT PRIMARY KEY,
+    watermark TEXT NOT NULL,
+    fields TEXT NOT NULL,
+    saved_at REAL NOT NULL
+);
+"""
+
+
+def _dumps(value):
+    return json.dumps(_encode(value), ensure_ascii=False, separators=(',', ':'))
+
+
+def _loads(text):
+    return _decode(json.loads(text))
+
+
+class SnapshotStore:
+    """Rekordy kolekcji i ich watermarki w pliku SQLite (jeden plik na proces)"""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+
+    def load(self, collection_name, fields):
+        """
+        Zwraca ({id: rekord}, watermark) albo (None, None), gdy snapshotu nie ma
+        lub zapisano go dla innego zestawu pól.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT watermark, fields FROM watermarks WHERE collection = ?', (collection_name,)).fetchone()
+            if row is None or json.loads(row[1]) != sorted(fields):
+                return None, None
+            rows = self._conn.execute(
+                'SELECT id, data FROM records WHERE collection = ?', (collection_name,)).fetchall()
+        return {doc_id: _loads(data) for doc_id, data in rows}, _loads(row[0])
+
+    def save(self, collection_name, records, watermark, fields):
+        """Zastępuje snapshot kolekcji kompletem rekordów"""
+        with self._lock:
+            self._conn.execute('BEGIN')
+            try:
+                self._conn.execute('DELETE FROM records WHERE collection = ?', (collection_name,))
+                self._conn.executemany(
+                    'INSERT INTO records (collection, id, data) VALUES (?, ?, ?)',
+                    [(collection_name, doc_id, _dumps(record)) for doc_id, record in records.items()])
+                self._set_watermark(collection_name, watermark, fields)
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def apply(self, collection_name, upserts, deleted_ids, watermark, fields):
+        """Dopisuje zmiany ({id: rekord} i usunięte ID) i przesuwa watermark"""
+        with self._lock:
+            self._conn.execute('BEGIN')
+            try:
+                self._conn.executemany(
+                    'INSERT OR REPLACE INTO records (collection, id, data) VALUES (?, ?, ?)',
+                    [(collection_name, doc_id, _dumps(record)) for doc_id, record in upserts.items()])
+                self._conn.executemany(
+                    'DELETE FROM records WHERE collection = ? AND id = ?',
+                    [(collection_name, doc_id) for doc_id in deleted_ids])
+                self._set_watermark(collection_name, watermark, fields)
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+
+    def _set_watermark(self, collection_name, watermark, fields):
+        self._conn.execute(
+            'INSERT OR REPLACE INTO watermarks (collection, watermark, fields, saved_at) VALUES (?, ?, ?, ?)',
+            (collection_name, _dumps(watermark), json.dumps(sorted(fields)), time.time()))
+
+    def clear(self, collection_name=None):
+        """Usuwa snapshot jednej kolekcji (lub wszystkich)"""
+        with self._lock:
+            if collection_name is None:
+                self._conn.execute('DELETE FROM records')
+                self._conn.execute('DELETE FROM watermarks')
+            else:
+                self._conn.execute('DELETE FROM records WHERE collection = ?', (collection_name,))
+                self._conn.execute('DELETE FROM watermarks WHERE collection = ?', (collection_name,))
+
+    def stats(self):
+        """{kolekcja: {'records', 'watermark', 'saved_at'}} do panelu administratora"""
+        with self._lock:
+            counts = dict(self._conn.execute(
+                'SELECT collection, COUNT(*) FROM records GROUP BY collection').fetchall())
+            rows = self._conn.execute('SELECT collection, watermark, saved_at FROM watermarks').fetchall()
+        return {
+            name: {
+                'records': counts.get(name, 0),
+                'watermark': _loads(watermark),
+                'saved_at': datetime.fromtimestamp(saved_at),
+            }
+            for name, watermark, saved_at in rows
+        }
+
+
+def open_snapshot_store(path=None):
+    """Otwiera snapshot; ścieżka z SNAPSHOT_CACHE_PATH lub monterapp_snapshot.db"""
+    path = path or os.environ.get('SNAPSHOT_CACHE_PATH', 'monterapp_snapshot.db')
+    return SnapshotStore(path)
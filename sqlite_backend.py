@@ -0,0 +1,911 @@
+import base64
+import copy
+import json
+import os
+import queue
+import secrets
+import sqlite3
+import string
+import threading
+from datetime import date, datetime, timedelta, timezone
+
+from google.api_core import exceptions as google_exceptions
+from google.cloud.firestore_v1 import transforms
+from google.cloud.firestore_v1.watch import ChangeType, DocumentChange
+
+# ===================
+# Lokalny backend bazy danych (SQLite)
+# ===================
+#
+# SqliteClient implementuje interfejs backendu bazy danych
+# (db_backend.DatabaseBackend – podzbiór API klienta Firestore, z którego
+# korzysta firebase_config) na lokalnym pliku SQLite: praca offline, testy
+# obciążeniowe, profilowanie. Zdjęcia obsługuje image_store
+# (FirebaseImageStore / LocalImageStore).
+#
+# Dokumenty trzymane są w jednej tabeli jako JSON, a pola używane
+# w filtrach i sortowaniu mają własne, zindeksowane kolumny.
+
+# Pola wydzielone do kolumn z indeksami
+INDEXED_FIELDS = ['status', 'etap_formularza', 'kod_dostepu', 'monter_id', 'data_utworzenia', 'updated_at',
+                  'data_folderu']
+
+# Limity zgodne z Firestore
+MAX_BATCH_OPERATIONS = 500
+MAX_DOCUMENT_SIZE = 1024 * 1024
+
+_SQL_OPERATORS = {'==': '=', '<': '<', '<=': '<=', '>': '>', '>=': '>='}
+_ID_ALPHABET = string.ascii_letters + string.digits
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS documents (
+    path TEXT PRIMARY KEY,
+    parent TEXT NOT NULL,
+    id TEXT NOT NULL,
+    data TEXT NOT NULL,
+    create_time INTEGER NOT NULL,
+    update_time INTEGER NOT NULL,
+    {', '.join(f'{field}' for field in INDEXED_FIELDS)}
+);
+"""
+
+_INDEXES = f"""
+CREATE INDEX IF NOT EXISTS idx_documents_parent ON documents (parent, id);
+{''.join(f'CREATE INDEX IF NOT EXISTS idx_documents_{field} ON documents (parent, {field}, id);' for field in INDEXED_FIELDS)}
+CREATE INDEX IF NOT EXISTS idx_documents_etap_data ON documents (parent, etap_formularza, data_utworzenia, id);
+"""
+
+
+# ===================
+# Kodowanie wartości
+# ===================
+
+def _to_micros(value):
+    """Znacznik czasu w mikrosekundach UTC (naiwne daty traktowane jak UTC – jak w Firestore)"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    delta = value - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+def _from_micros(micros):
+    return _EPOCH + timedelta(microseconds=micros)
+
+def _encode(value):
+    """Wartość Pythona -> struktura JSON (daty i bajty oznaczone)"""
+    if isinstance(value, datetime):
+        return {'__ts': _to_micros(value)}
+    if isinstance(value, date):
+        raise TypeError(f"Nie można zapisać wartości typu date: {value!r}")
+    if isinstance(value, bytes):
+        return {'__bytes': base64.b64encode(value).decode('ascii')}
+    if isinstance(value, dict):
+        return {str(k): _encode(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_encode(v) for v in value]
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    raise TypeError(f"Nie można zapisać wartości typu {type(value).__name__}")
+
+def _decode(value):
+    if isinstance(value, dict):
+        if len(value) == 1 and '__ts' in value:
+            return _from_micros(value['__ts'])
+        if len(value) == 1 and '__bytes' in value:
+            return base64.b64decode(value['__bytes'])
+        return {k: _decode(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    return value
+
+def _column_value(value):
+    """Wartość kolumny indeksu (tylko skalary; inne typy nie są indeksowane)"""
+    if isinstance(value, datetime):
+        return _to_micros(value)
+    if isinstance(value, str):
+        return value
+    return None
+
+def _order_key(value):
+    """Klucz sortowania zgodny z kolejnością typów Firestore"""
+    if value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (1, value)
+    if isinstance(value, (int, float)):
+        return (2, value)
+    if isinstance(value, datetime):
+        return (3, _to_micros(value))
+    if isinstance(value, str):
+        return (4, value)
+    if isinstance(value, bytes):
+        return (5, value)
+    if isinstance(value, (list, tuple)):
+        return (8, tuple(_order_key(v) for v in value))
+    if isinstance(value, dict):
+        return (9, tuple(sorted((k, _order_key(v)) for k, v in value.items())))
+    return (10, str(value))
+
+def _new_id():
+    return ''.join(secrets.choice(_ID_ALPHABET) for _ in range(20))
+
+def _get_field(data, field_path):
+    """Wartość pola (ścieżki z kropkami) albo _MISSING"""
+    value = data
+    for part in field_path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+_MISSING = object()
+
+
+# ===================
+# Transformacje zapisu
+# ===================
+
+def _now():
+    return datetime.now(timezone.utc)
+
+def _same(a, b):
+    return json.dumps(_encode(a), sort_keys=True) == json.dumps(_encode(b), sort_keys=True)
+
+def _apply_value(current, value):
+    """Wylicza nową wartość pola (obsługa znaczników i transformacji Firestore)"""
+    if value is transforms.SERVER_TIMESTAMP:
+        return _now()
+    if isinstance(value, transforms.ArrayUnion):
+        result = list(current) if isinstance(current, list) else []
+        for item in value.values:
+            if not any(_same(item, existing) for existing in result):
+                result.append(copy.deepcopy(item))
+        return result
+    if isinstance(value, transforms.ArrayRemove):
+        if not isinstance(current, list):
+            return []
+        return [item for item in current if not any(_same(item, r) for r in value.values)]
+    if isinstance(value, transforms.Increment):
+        base = current if isinstance(current, (int, float)) and not isinstance(current, bool) else 0
+        return base + value.value
+    if isinstance(value, dict):
+        return {k: _apply_value(None, v) for k, v in value.items() if v is not transforms.DELETE_FIELD}
+    return copy.deepcopy(value)
+
+def _merge(base, data):
+    """set(merge=True): łączenie zagnieżdżonych map"""
+    for key, value in data.items():
+        if value is transforms.DELETE_FIELD:
+            base.pop(key, None)
+        elif isinstance(value, dict) and isinstance(base.get(key), dict):
+            _merge(base[key], value)
+        else:
+            base[key] = _apply_value(base.get(key), value)
+    return base
+
+def _update(base, data):
+    """update(): klucze z kropkami to ścieżki pól zagnieżdżonych"""
+    for field_path, value in data.items():
+        parts = field_path.split('.')
+        target = base
+        for part in parts[:-1]:
+            if not isinstance(target.get(part), dict):
+                target[part] = {}
+            target = target[part]
+        if value is transforms.DELETE_FIELD:
+            target.pop(parts[-1], None)
+        else:
+            target[parts[-1]] = _apply_value(target.get(parts[-1]), value)
+    return base
+
+
+# ===================
+# Dokumenty i zapytania
+# ===================
+
+class DocumentSnapshot:
+    """Odczytany stan dokumentu (interfejs jak google.cloud.firestore.DocumentSnapshot)"""
+
+    def __init__(self, reference, data, create_time=None, update_time=None):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        self.exists = data is not None
+        self.create_time = create_time
+        self.update_time = update_time
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path):
+        value = _get_field(self._data or {}, field_path)
+        if value is _MISSING:
+            raise KeyError(field_path)
+        return copy.deepcopy(value)
+
+
+class DocumentReference:
+    def __init__(self, client, path):
+        self._client = client
+        self.path = path
+        self.id = path.rsplit('/', 1)[-1]
+
+    def __eq__(self, other):
+        return isinstance(other, DocumentReference) and other.path == self.path
+
+    def __hash__(self):
+        return hash(self.path)
+
+    @property
+    def parent(self):
+        return CollectionReference(self._client, self.path.rsplit('/', 1)[0])
+
+    def collection(self, name):
+        return CollectionReference(self._client, f"{self.path}/{name}")
+
+    def get(self, field_paths=None, transaction=None, **kwargs):
+        snap = self._client._read(self, transaction)
+        if field_paths is not None and snap.exists:
+            snap._data = {k: v for k, v in snap._data.items() if k in field_paths}
+        return snap
+
+    def _single(self, method, *args, **kwargs):
+        batch = self._client.batch()
+        getattr(batch, method)(self, *args, **kwargs)
+        return batch.commit()[0]
+
+    def set(self, document_data, merge=False, **kwargs):
+        return self._single('set', document_data, merge=merge)
+
+    def create(self, document_data, **kwargs):
+        return self._single('create', document_data)
+
+    def update(self, field_updates, option=None, **kwargs):
+        return self._single('update', field_updates, option=option)
+
+    def delete(self, option=None, **kwargs):
+        return self._single('delete', option=option)
+
+
+class _Filter:
+    def __init__(self, field_path, op, value):
+        self.field_path = field_path
+        self.op = op
+        self.value = value
+
+    def matches(self, doc_id, data):
+        if self.field_path == '__name__':
+            value = doc_id
+            expected = self.value.id if hasattr(self.value, 'id') else self.value
+        else:
+            value = _get_field(data, self.field_path)
+            expected = self.value
+            if value is _MISSING:
+                return False
+        op = self.op
+        if op == '==':
+            return _order_key(value) == _order_key(expected)
+        if op == '!=':
+            return value is not None and _order_key(value) != _order_key(expected)
+        if op == 'in':
+            return any(_order_key(value) == _order_key(e) for e in expected)
+        if op == 'not-in':
+            return value is not None and all(_order_key(value) != _order_key(e) for e in expected)
+        if op == 'array_contains':
+            return isinstance(value, list) and any(_same(v, expected) for v in value)
+        if op == 'array_contains_any':
+            return isinstance(value, list) and any(_same(v, e) for v in value for e in expected)
+        a, b = _order_key(value), _order_key(expected)
+        if a[0] != b[0]:  # filtry zakresowe dotyczą tylko wartości tego samego typu
+            return False
+        return {'<': a < b, '<=': a <= b, '>': a > b, '>=': a >= b}[op]
+
+
+class Query:
+    ASCENDING = 'ASCENDING'
+    DESCENDING = 'DESCENDING'
+
+    def __init__(self, client, parent_path, filters=(), orders=(), limit=None,
+                 projection=None, start_after=None):
+        self._client = client
+        self._parent_path = parent_path
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._projection = projection
+        self._start_after = start_after
+
+    def _copy(self, **changes):
+        state = dict(filters=self._filters, orders=self._orders, limit=self._limit,
+                     projection=self._projection, start_after=self._start_after)
+        state.update(changes)
+        return Query(self._client, self._parent_path, **state)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + (_Filter(field_path, op_string, value),))
+
+    def order_by(self, field_path, direction=ASCENDING):
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def select(self, field_paths):
+        return self._copy(projection=list(field_paths))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, document_fields_or_snapshot):
+        return self._copy(start_after=document_fields_or_snapshot)
+
+    def get(self, transaction=None, **kwargs):
+        return self._client._run_query(self, transaction)
+
+    def stream(self, transaction=None, **kwargs):
+        return iter(self.get(transaction=transaction))
+
+    def count(self, alias=None):
+        return _CountQuery(self, alias)
+
+    def on_snapshot(self, callback):
+        return self._client._watch(self, callback)
+
+    # --- wykonanie ---
+
+    def _effective_orders(self):
+        """Kolejność jak w Firestore: jawne pola + __name__ w kierunku ostatniego pola"""
+        orders = list(self._orders)
+        if not any(field == '__name__' for field, _ in orders):
+            direction = orders[-1][1] if orders else self.ASCENDING
+            orders.append(('__name__', direction))
+        return orders
+
+    def _cursor_values(self, orders):
+        cursor = self._start_after
+        if hasattr(cursor, 'to_dict'):
+            data = cursor.to_dict() or {}
+            return [cursor.id if f == '__name__' else _get_field(data, f) for f, _ in orders]
+        values = []
+        for field, _ in orders:
+            if field in cursor:
+                value = cursor[field]
+                if field == '__name__':
+                    value = value.id if hasattr(value, 'id') else str(value).rsplit('/', 1)[-1]
+                values.append(value)
+        return values
+
+
+class CollectionReference(Query):
+    def __init__(self, client, path):
+        super().__init__(client, path)
+        self.id = path.rsplit('/', 1)[-1]
+        self.path = path
+
+    @property
+    def parent(self):
+        if '/' not in self.path:
+            return None
+        return DocumentReference(self._client, self.path.rsplit('/', 1)[0])
+
+    def document(self, document_id=None):
+        return DocumentReference(self._client, f"{self.path}/{document_id or _new_id()}")
+
+    def add(self, document_data, document_id=None, **kwargs):
+        doc_ref = self.document(document_id)
+        result = doc_ref.create(document_data)
+        return result.update_time, doc_ref
+
+    def list_documents(self, page_size=None, **kwargs):
+        return [DocumentReference(self._client, path) for path in self._client._paths(self.path)]
+
+
+class _AggregationResult:
+    def __init__(self, alias, value, read_time):
+        self.alias = alias
+        self.value = value
+        self.read_time = read_time
+
+
+class _CountQuery:
+    def __init__(self, query, alias):
+        self._query = query
+        self._alias = alias or 'count'
+
+    def get(self, transaction=None, **kwargs):
+        value = self._query._client._count(self._query)
+        return [[_AggregationResult(self._alias, value, _now())]]
+
+
+class _WriteResult:
+    def __init__(self, update_time):
+        self.update_time = update_time
+
+
+class _Precondition:
+    def __init__(self, last_update_time=None, exists=None):
+        self.last_update_time = last_update_time
+        self.exists = exists
+
+
+# ===================
+# Zapisy: batch i transakcja
+# ===================
+
+class WriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def __len__(self):
+        return len(self._writes)
+
+    def set(self, reference, document_data, merge=False):
+        self._writes.append(('set', reference, document_data, merge))
+        return self
+
+    def create(self, reference, document_data):
+        self._writes.append(('create', reference, document_data, None))
+        return self
+
+    def update(self, reference, field_updates, option=None):
+        self._writes.append(('update', reference, field_updates, option))
+        return self
+
+    def delete(self, reference, option=None):
+        self._writes.append(('delete', reference, None, option))
+        return self
+
+    def commit(self, **kwargs):
+        writes, self._writes = self._writes, []
+        return self._client._commit(writes)
+
+
+class Transaction(WriteBatch):
+    """
+    Transakcja optymistyczna: zapamiętuje wersje odczytanych dokumentów
+    i przy commicie zgłasza Aborted, jeśli któryś się zmienił
+    (dekorator @firestore.transactional ponawia wtedy funkcję).
+    """
+
+    def __init__(self, client, max_attempts=5, read_only=False):
+        super().__init__(client)
+        self._max_attempts = max_attempts
+        self._read_only = read_only
+        self._id = None
+        self._read_versions = {}
+
+    @property
+    def id(self):
+        return self._id
+
+    @property
+    def in_progress(self):
+        return self._id is not None
+
+    def _begin(self, retry_id=None):
+        self._id = _new_id().encode('ascii')
+
+    def _clean_up(self):
+        self._writes = []
+        self._read_versions = {}
+        self._id = None
+
+    def _rollback(self):
+        self._clean_up()
+
+    def _record_read(self, path, update_time):
+        self._read_versions.setdefault(path, update_time)
+
+    def _commit(self):
+        writes, read_versions = self._writes, self._read_versions
+        self._clean_up()
+        return self._client._commit(writes, read_versions)
+
+    def commit(self, **kwargs):
+        return self._commit()
+
+    def get(self, ref_or_query, **kwargs):
+        if isinstance(ref_or_query, DocumentReference):
+            return iter([ref_or_query.get(transaction=self)])
+        return iter(ref_or_query.get(transaction=self))
+
+
+# ===================
+# Listenery
+# ===================
+
+class _LazyDocuments:
+    """Pełny wynik zapytania listenera – wykonywany dopiero przy użyciu"""
+
+    def __init__(self, query):
+        self._query = query
+        self._docs = None
+
+    def _load(self):
+        if self._docs is None:
+            self._docs = self._query.get()
+        return self._docs
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+    def __getitem__(self, index):
+        return self._load()[index]
+
+
+class Watch:
+    def __init__(self, client, query, callback):
+        self._client = client
+        self._query = query
+        self._callback = callback
+        self._known = set()
+        self.is_active = True
+
+    def unsubscribe(self):
+        self.is_active = False
+        self._client._unwatch(self)
+
+    close = unsubscribe
+
+    def _initial(self):
+        docs = self._query.get()
+        self._known = {d.id for d in docs}
+        changes = [DocumentChange(ChangeType.ADDED, d, -1, i) for i, d in enumerate(docs)]
+        self._callback(docs, changes, _now())
+
+    def _changed(self, paths):
+        if self._query._limit is not None or self._query._start_after is not None:
+            self._changed_window(paths)
+            return
+        changes = []
+        for path in paths:
+            if path.rsplit('/', 1)[0] != self._query._parent_path:
+                continue
+            snap = self._client._read(DocumentReference(self._client, path))
+            doc_id = snap.id
+            matches = snap.exists and all(f.matches(doc_id, snap._data) for f in self._query._filters)
+            if matches:
+                kind = ChangeType.MODIFIED if doc_id in self._known else ChangeType.ADDED
+                self._known.add(doc_id)
+                changes.append(DocumentChange(kind, snap, -1, -1))
+            elif doc_id in self._known:
+                self._known.discard(doc_id)
+                changes.append(DocumentChange(ChangeType.REMOVED, snap, -1, -1))
+        if changes:
+            self._callback(_LazyDocuments(self._query), changes, _now())
+
+    def _changed_window(self, paths):
+        # Zapytanie z limit/start_after: zmiana dokumentu może przesunąć okno
+        # wyników, więc zapytanie jest wykonywane ponownie i porównywane
+        parent = self._query._parent_path
+        if not any(path.rsplit('/', 1)[0] == parent for path in paths):
+            return
+        docs = self._query.get()
+        current = {d.id for d in docs}
+        changes = []
+        for index, snap in enumerate(docs):
+            if snap.id not in self._known:
+                changes.append(DocumentChange(ChangeType.ADDED, snap, -1, index))
+            elif snap.reference.path in paths:
+                changes.append(DocumentChange(ChangeType.MODIFIED, snap, index, index))
+        for doc_id in self._known - current:
+            snap = self._client._read(DocumentReference(self._client, f"{parent}/{doc_id}"))
+            changes.append(DocumentChange(ChangeType.REMOVED, snap, -1, -1))
+        self._known = current
+        if changes:
+            self._callback(docs, changes, _now())
+
+
+# ===================
+# Klient
+# ===================
+
+class SqliteClient:
+    """Klient bazy danych w pliku SQLite o interfejsie klienta Firestore"""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(_SCHEMA)
+        self._add_missing_columns()
+        self._conn.executescript(_INDEXES)
+        self._lock = threading.RLock()
+        self._clock = 0
+        self._watches = []
+        self._events = queue.Queue()
+        self._dispatcher = None
+
+    def _add_missing_columns(self):
+        """Baza utworzona przez starszą wersję: dodaje kolumny nowych pól indeksowanych"""
+        existing = {row[1] for row in self._conn.execute('PRAGMA table_info(documents)')}
+        for field in INDEXED_FIELDS:
+            if field in existing:
+                continue
+            self._conn.execute(f'ALTER TABLE documents ADD COLUMN {field}')
+            # Te same wartości co _column_value: tekst albo znacznik czasu w mikrosekundach
+            self._conn.execute(
+                f"UPDATE documents SET {field} = CASE json_type(data, '$.{field}') "
+                f"WHEN 'text' THEN json_extract(data, '$.{field}') "
+                f"WHEN 'object' THEN json_extract(data, '$.{field}.__ts') END")
+
+    # --- API klienta ---
+
+    def collection(self, path):
+        return CollectionReference(self, path)
+
+    def document(self, path):
+        return DocumentReference(self, path)
+
+    def collections(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT parent FROM documents WHERE instr(parent, '/') = 0").fetchall()
+        return [CollectionReference(self, row[0]) for row in rows]
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def transaction(self, max_attempts=5, read_only=False, **kwargs):
+        return Transaction(self, max_attempts=max_attempts, read_only=read_only)
+
+    def write_option(self, last_update_time=None, exists=None):
+        return _Precondition(last_update_time, exists)
+
+    def get_all(self, references, field_paths=None, transaction=None, **kwargs):
+        for reference in references:
+            yield reference.get(field_paths=field_paths, transaction=transaction)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    # --- odczyty ---
+
+    def _snapshot(self, reference, row):
+        if row is None:
+            return DocumentSnapshot(reference, None)
+        data, create_time, update_time = row
+        return DocumentSnapshot(reference, _decode(json.loads(data)),
+                                _from_micros(create_time), _from_micros(update_time))
+
+    def _read(self, reference, transaction=None):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data, create_time, update_time FROM documents WHERE path = ?",
+                (reference.path,)).fetchone()
+        snap = self._snapshot(reference, row)
+        if transaction is not None:
+            transaction._record_read(reference.path, row[2] if row else None)
+        return snap
+
+    def _paths(self, parent):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT path FROM documents WHERE parent = ? ORDER BY id", (parent,)).fetchall()
+        return [row[0] for row in rows]
+
+    def _plan(self, query):
+        """
+        Buduje SQL dla zapytania. Filtry na zindeksowanych kolumnach (wartości
+        tekstowe i daty) oraz sortowanie po nich wykonuje SQLite; pozostałe
+        warunki są sprawdzane w Pythonie. Zwraca (sql, parametry, pozostałe
+        filtry, czy sortowanie i kursor wykonano w SQL). LIMIT trafia do SQL
+        tylko, gdy nie ma filtrów sprawdzanych w Pythonie.
+        """
+        where, params, residual = ['parent = ?'], [query._parent_path], []
+        for f in query._filters:
+            if f.field_path in INDEXED_FIELDS and f.op in _SQL_OPERATORS and isinstance(f.value, (str, datetime)):
+                where.append(f"{f.field_path} {_SQL_OPERATORS[f.op]} ? AND typeof({f.field_path}) = ?")
+                params += [_column_value(f.value), 'integer' if isinstance(f.value, datetime) else 'text']
+            elif f.field_path == '__name__' and f.op in _SQL_OPERATORS:
+                where.append(f"id {_SQL_OPERATORS[f.op]} ?")
+                params.append(f.value.id if hasattr(f.value, 'id') else f.value)
+            else:
+                residual.append(f)
+
+        orders = query._effective_orders()
+        directions = {direction for _, direction in orders}
+        in_sql = (len(directions) == 1
+                  and all(field in INDEXED_FIELDS or field == '__name__' for field, _ in orders))
+        sql = "SELECT id, data, create_time, update_time FROM documents WHERE {where}"
+        if in_sql:
+            columns = ['id' if field == '__name__' else field for field, _ in orders]
+            for column in columns:
+                if column != 'id':
+                    where.append(f"{column} IS NOT NULL")
+            descending = orders[0][1] == Query.DESCENDING
+            if query._start_after is not None:
+                values = query._cursor_values(orders)
+                if len(values) == len(columns):
+                    placeholders = ', '.join('?' for _ in columns)
+                    where.append(f"({', '.join(columns)}) {'<' if descending else '>'} ({placeholders})")
+                    params += [v if c == 'id' else _column_value(v) for c, v in zip(columns, values)]
+                else:
+                    in_sql = False
+            if in_sql:
+                sql += " ORDER BY " + ', '.join(f"{c} {'DESC' if descending else 'ASC'}" for c in columns)
+                if query._limit is not None and not residual:
+                    sql += f" LIMIT {int(query._limit)}"
+        return sql.format(where=' AND '.join(where)), params, residual, in_sql
+
+    def _run_query(self, query, transaction=None):
+        sql, params, residual, in_sql = self._plan(query)
+        snaps = []
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            # Wiersze w kolejności SQL – przy filtrach w Pythonie kończymy po osiągnięciu limitu
+            for doc_id, data, create_time, update_time in cursor:
+                reference = DocumentReference(self, f"{query._parent_path}/{doc_id}")
+                snap = self._snapshot(reference, (data, create_time, update_time))
+                if all(f.matches(snap.id, snap._data) for f in residual):
+                    snaps.append(snap)
+                    if in_sql and query._limit is not None and len(snaps) >= query._limit:
+                        break
+            cursor.close()
+
+        if not in_sql:
+            snaps = self._order_in_python(query, snaps)
+
+        if transaction is not None:
+            for snap in snaps:
+                transaction._record_read(snap.reference.path, _to_micros(snap.update_time))
+        if query._projection is not None:
+            for snap in snaps:
+                snap._data = {k: v for k, v in snap._data.items() if k in query._projection}
+        return snaps
+
+    def _order_in_python(self, query, snaps):
+        orders = query._effective_orders()
+        for field, _ in orders:
+            if field != '__name__':
+                snaps = [s for s in snaps if _get_field(s._data, field) is not _MISSING]
+
+        def value(snap, field):
+            return snap.id if field == '__name__' else _get_field(snap._data, field)
+
+        for field, direction in reversed(orders):
+            snaps.sort(key=lambda s: _order_key(value(s, field)), reverse=direction == Query.DESCENDING)
+
+        if query._start_after is not None:
+            cursor = [_order_key(v) for v in query._cursor_values(orders)]
+
+            def after_cursor(snap):
+                for (field, direction), bound in zip(orders, cursor):
+                    current = _order_key(value(snap, field))
+                    if current != bound:
+                        return current < bound if direction == Query.DESCENDING else current > bound
+                return False
+
+            snaps = [s for s in snaps if after_cursor(s)]
+        if query._limit is not None:
+            snaps = snaps[:query._limit]
+        return snaps
+
+    def _count(self, query):
+        sql, params, residual, in_sql = self._plan(query)
+        if not residual and query._limit is None and query._start_after is None:
+            count_sql = sql.replace("SELECT id, data, create_time, update_time", "SELECT COUNT(*)", 1)
+            count_sql = count_sql.split(" ORDER BY ")[0]
+            with self._lock:
+                return self._conn.execute(count_sql, params).fetchone()[0]
+        return len(self._run_query(query))
+
+    # --- zapisy ---
+
+    def _tick(self):
+        """Ściśle rosnący czas zapisu (µs) – służy jako wersja dokumentu"""
+        self._clock = max(self._clock + 1, _to_micros(_now()))
+        return self._clock
+
+    def _commit(self, writes, read_versions=None):
+        if len(writes) > MAX_BATCH_OPERATIONS:
+            raise google_exceptions.InvalidArgument(
+                f"Batch może zawierać maksymalnie {MAX_BATCH_OPERATIONS} operacji")
+        changed = []
+        results = []
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                for path, version in (read_versions or {}).items():
+                    row = self._conn.execute(
+                        "SELECT update_time FROM documents WHERE path = ?", (path,)).fetchone()
+                    if (row[0] if row else None) != version:
+                        raise google_exceptions.Aborted(f"Dokument {path} zmienił się w trakcie transakcji")
+
+                update_time = self._tick()
+                for kind, reference, data, extra in writes:
+                    self._apply_write(kind, reference, data, extra, update_time)
+                    changed.append(reference.path)
+                    results.append(_WriteResult(_from_micros(update_time)))
+                self._conn.execute('COMMIT')
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+        if changed and self._watches:
+            self._events.put(('changed', changed))
+        return results
+
+    def _apply_write(self, kind, reference, data, extra, update_time):
+        row = self._conn.execute(
+            "SELECT data, create_time, update_time FROM documents WHERE path = ?",
+            (reference.path,)).fetchone()
+        current = _decode(json.loads(row[0])) if row else None
+        option = extra if kind in ('update', 'delete') else None
+        if option is not None:
+            if option.exists is not None and option.exists != (row is not None):
+                raise google_exceptions.FailedPrecondition(f"Warunek istnienia niespełniony: {reference.path}")
+            if option.last_update_time is not None and (
+                    row is None or row[2] != _to_micros(option.last_update_time)):
+                raise google_exceptions.FailedPrecondition(f"Dokument {reference.path} został zmieniony")
+
+        if kind == 'delete':
+            self._conn.execute("DELETE FROM documents WHERE path = ?", (reference.path,))
+            return
+        if kind == 'create':
+            if row is not None:
+                raise google_exceptions.AlreadyExists(f"Dokument już istnieje: {reference.path}")
+            new = _merge({}, data)
+        elif kind == 'update':
+            if row is None:
+                raise google_exceptions.NotFound(f"Brak dokumentu do aktualizacji: {reference.path}")
+            new = _update(current, data)
+        elif extra:  # set(merge=True)
+            new = _merge(current or {}, data)
+        else:
+            new = _merge({}, data)
+
+        encoded = json.dumps(_encode(new), ensure_ascii=False, separators=(',', ':'))
+        if len(encoded.encode('utf-8')) > MAX_DOCUMENT_SIZE:
+            raise google_exceptions.InvalidArgument(f"Dokument {reference.path} przekracza 1 MiB")
+        columns = [_column_value(new.get(field)) for field in INDEXED_FIELDS]
+        create_time = row[1] if row else update_time
+        self._conn.execute(
+            f"INSERT OR REPLACE INTO documents (path, parent, id, data, create_time, update_time, "
+            f"{', '.join(INDEXED_FIELDS)}) VALUES ({', '.join('?' for _ in range(6 + len(INDEXED_FIELDS)))})",
+            [reference.path, reference.path.rsplit('/', 1)[0], reference.id, encoded,
+             create_time, update_time, *columns])
+
+    # --- listenery ---
+
+    def _watch(self, query, callback):
+        watch = Watch(self, query, callback)
+        with self._lock:
+            self._watches.append(watch)
+            if self._dispatcher is None:
+                self._dispatcher = threading.Thread(target=self._dispatch, daemon=True,
+                                                    name='sqlite-backend-listeners')
+                self._dispatcher.start()
+        self._events.put(('initial', watch))
+        return watch
+
+    def _unwatch(self, watch):
+        with self._lock:
+            if watch in self._watches:
+                self._watches.remove(watch)
+
+    def _dispatch(self):
+        # Callbacki listenerów wywoływane są w osobnym wątku, jak w Firestore
+        while True:
+            kind, payload = self._events.get()
+            try:
+                if kind == 'initial':
+                    if payload.is_active:
+                        payload._initial()
+                else:
+                    with self._lock:
+                        watches = list(self._watches)
+                    for watch in watches:
+                        watch._changed(payload)
+            except Exception as e:
+                print(f"⚠️ Błąd listenera SQLite: {e}")
+
+
+def open_database(path=None):
+    """Otwiera (lub tworzy) lokalną bazę SQLite; ścieżka z SQLITE_DB_PATH lub monterapp.db"""
+    path = path or os.environ.get('SQLITE_DB_PATH', 'monterapp.db')
+    return SqliteClient(path)
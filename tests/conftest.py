@@ -0,0 +1,19 @@
+import os
+import sys
+
+# Testy działają na lokalnym backendzie SQLite – bez projektu Firebase
+os.environ.setdefault('FIRESTORE_MIRROR', '0')
+os.environ.setdefault('SNAPSHOT_CACHE', '0')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import sqlite_backend
+from image_store import LocalImageStore, set_image_store
+
+
+@pytest.fixture
+def db(tmp_path):
+    set_image_store(LocalImageStore(str(tmp_path / 'zdjecia')))
+    yield sqlite_backend.open_database(str(tmp_path / 'baza.db'))
+    set_image_store(None)
@@ -0,0 +1,28 @@
+from datetime import datetime, timezone
+
+import sqlite_backend
+from data_transfer import export_collections_parquet, import_collections
+
+
+def test_roundtrip_keeps_non_string_values_of_string_fields(db, tmp_path):
+    created = datetime(2025, 6, 1, 12, tzinfo=timezone.utc)
+    db.collection('drzwi').document('odznaczone').set({
+        'data_utworzenia': created, 'imie_nazwisko': 'Jan Kowalski',
+        'kolor_osc': False, 'uwagi_klienta': False,
+    })
+    db.collection('drzwi').document('wypelnione').set({
+        'data_utworzenia': created, 'imie_nazwisko': 'Anna Nowak',
+        'kolor_osc': 'biały', 'uwagi_klienta': None,
+    })
+
+    export_collections_parquet(db, str(tmp_path / 'eksport'), ['drzwi'])
+    restored = sqlite_backend.open_database(str(tmp_path / 'odtworzona.db'))
+    import_collections(restored, str(tmp_path / 'eksport'), max_rate=0)
+
+    unchecked = restored.collection('drzwi').document('odznaczone').get().to_dict()
+    assert unchecked['kolor_osc'] is False
+    assert unchecked['uwagi_klienta'] is False
+    filled = restored.collection('drzwi').document('wypelnione').get().to_dict()
+    assert filled['kolor_osc'] == 'biały'
+    assert filled.get('uwagi_klienta') is None
+    assert filled['data_utworzenia'] == created
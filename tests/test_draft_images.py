@@ -0,0 +1,67 @@
+import io
+
+import pytest
+from PIL import Image
+
+import firebase_config as fc
+from image_store import MIGRATION_COLLECTION, get_image_store, image_blob_ids, store_image
+
+
+def _photo(color):
+    buffer = io.BytesIO()
+    Image.new('RGB', (600, 400), color).save(buffer, format='JPEG')
+    return store_image(buffer.getvalue(), f'{color}.jpg', 600, 400)
+
+
+def _draft(db, draft_id):
+    fc.write_with_budget(db, db.collection('wymiary_draft').document(draft_id),
+                         fc._draft_metadata('drzwi', 'monter'))
+
+
+def _stored(image):
+    return [get_image_store().exists(blob_id) for blob_id in image_blob_ids(image['id'])]
+
+
+@pytest.fixture
+def migrated(db):
+    fc.migrate_embedded_images(db)
+    return db
+
+
+def test_removed_photo_is_deleted_when_no_document_uses_it(migrated):
+    db = migrated
+    shared, own = _photo('red'), _photo('blue')
+    _draft(db, 'a')
+    _draft(db, 'b')
+    assert fc.add_images_to_draft(db, 'a', [shared, own])
+    assert fc.add_images_to_draft(db, 'b', [shared])
+
+    assert fc.remove_images_from_draft(db, 'a', [shared, own])
+    assert _stored(shared) == [True, True, True]
+    assert _stored(own) == [False, False, False]
+
+    assert fc.remove_images_from_draft(db, 'b', [shared])
+    assert _stored(shared) == [False, False, False]
+
+
+def test_photo_kept_while_same_file_is_still_in_the_draft(migrated):
+    db = migrated
+    photo = _photo('green')
+    duplicate = dict(photo, nazwa='kopia.jpg')
+    _draft(db, 'a')
+    fc.add_images_to_draft(db, 'a', [photo, duplicate])
+
+    fc.remove_images_from_draft(db, 'a', [photo])
+    draft = db.collection('wymiary_draft').document('a').get().to_dict()
+    assert draft[fc.IMAGE_IDS_FIELD] == [photo['id']]
+    assert _stored(photo) == [True, True, True]
+
+
+def test_nothing_deleted_before_image_migration(db):
+    photo = _photo('white')
+    _draft(db, 'a')
+    fc.add_images_to_draft(db, 'a', [photo])
+    assert not db.collection(MIGRATION_COLLECTION).document(fc.IMAGE_MIGRATION_CHECKPOINT).get().exists
+
+    fc.remove_images_from_draft(db, 'a', [photo])
+    assert _stored(photo) == [True, True, True]
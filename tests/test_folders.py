@@ -0,0 +1,41 @@
+from datetime import datetime, timezone
+
+import firebase_config as fc
+
+
+def _protocol(db, collection_name, doc_id, name):
+    doc_ref = db.collection(collection_name).document(doc_id)
+    fc.write_with_budget(db, doc_ref, {
+        'imie_nazwisko': name, 'monter_id': 'm1',
+        'data_utworzenia': datetime(2025, 6, 1, 10, tzinfo=timezone.utc),
+    })
+    return doc_ref
+
+
+def _folder(db, key):
+    return db.collection(fc.FOLDERS_COLLECTION).document(key).get()
+
+
+def test_folder_removed_with_its_last_protocol(db):
+    first = _protocol(db, 'drzwi', 'a', 'Jan Kowalski')
+    second = _protocol(db, 'podlogi', 'b', 'Jan Kowalski')
+    key = first.get().to_dict()[fc.FOLDER_FIELD]
+
+    fc.delete_with_overflow(db, first, folder=key)
+    assert list(_folder(db, key).to_dict()['czlonkowie']) == ['podlogi__b']
+
+    fc.delete_with_overflow(db, second, folder=key)
+    assert not _folder(db, key).exists
+    assert fc.get_folders_page(db, 10) == ([], None)
+
+
+def test_folder_removed_when_its_last_protocol_moves(db):
+    doc_ref = _protocol(db, 'drzwi', 'a', 'Jan Kowalski')
+    old_key = doc_ref.get().to_dict()[fc.FOLDER_FIELD]
+
+    fc.write_with_budget(db, doc_ref, {'imie_nazwisko': 'Anna Nowak'}, existing=doc_ref.get().to_dict())
+    new_key = doc_ref.get().to_dict()[fc.FOLDER_FIELD]
+
+    assert new_key != old_key
+    assert not _folder(db, old_key).exists
+    assert list(_folder(db, new_key).to_dict()['czlonkowie']) == ['drzwi__a']